@@ -209,6 +209,12 @@ def set_admin_config(
     if allow_vocals_ai is not None:
         data["allow_vocals_ai"] = bool(allow_vocals_ai)
     _save_raw(data)
+    # Reglas nuevas → strategies memoizadas con las reglas viejas ya no valen
+    try:
+        from .strategy_cache import invalidate_strategy_cache
+        invalidate_strategy_cache()
+    except Exception:
+        pass
     return data
 
 
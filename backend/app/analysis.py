@@ -5,7 +5,10 @@ from typing import Optional
 import librosa
 import numpy as np
 
+from .memory import memory_stage, track_buffers
+from .metrics import stage
 from .models import SongAnalysis
+from .tracing import set_attributes, traced
 
 # Notas cromáticas (12 bins)
 _NOTES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
@@ -63,11 +66,13 @@ def detect_key(y: np.ndarray, sr: int) -> tuple[str, str, str, float]:
         chroma_cqt = librosa.feature.chroma_cqt(
             y=y, sr=sr, hop_length=2048, bins_per_octave=36
         )
+        track_buffers(chroma_cqt=chroma_cqt)
         mean_cqt = np.mean(chroma_cqt, axis=1)
         if mean_cqt.size != 12:
             return "C", "major", "1A", 0.5
         # Chroma STFT: complementario para transitorios
         chroma_stft = librosa.feature.chroma_stft(y=y, sr=sr, hop_length=2048)
+        track_buffers(chroma_stft=chroma_stft)
         mean_stft = np.mean(chroma_stft, axis=1)
         if mean_stft.size != 12:
             key_name, scale, conf = _key_from_chroma(mean_cqt)
@@ -154,12 +159,14 @@ def _beats_librosa(y: np.ndarray, sr: int) -> list[float]:
     """Get beat times in seconds."""
     tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
     beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+    track_buffers(beat_times=beat_times)
     return beat_times.tolist()
 
 
 def _energy_librosa(y: np.ndarray, sr: int, hop_length: int = 512) -> float:
     """Overall energy 0-1: RMS normalized by max observed."""
     rms = librosa.feature.rms(y=y, hop_length=hop_length)[0]
+    track_buffers(rms=rms)
     if rms.size == 0:
         return 0.5
     max_rms = np.max(rms)
@@ -195,23 +202,31 @@ def _phrase_starts_and_outro(bpm: float, duration_sec: float) -> tuple[list[floa
     return phrase_starts, outro_start
 
 
+@traced("analysis")
 def analyze_song(path: Path, sr: Optional[int] = None) -> SongAnalysis:
     """
     Analyze one audio file: BPM, key (chroma_cqt + chroma_stft), Camelot, beats, energy.
     """
     sr = sr or 44100
-    y, _ = librosa.load(path, sr=sr, mono=True)
-
-    try:
-        key_name, scale_name, key_camelot, key_confidence = detect_key(y, sr)
-    except Exception:
-        key_name, scale_name, key_conf = _key_librosa_fallback(y, sr)
-        key_camelot = key_to_camelot(key_name, scale_name)
-        key_confidence = key_conf
-
-    bpm = _bpm_librosa(y, sr)
-    beats = _beats_librosa(y, sr)
-    energy = _energy_librosa(y, sr)
+    track = Path(path).name
+    set_attributes(track=track)
+    with stage("decode"), memory_stage("load", track=track):
+        y, _ = librosa.load(path, sr=sr, mono=True)
+        track_buffers(y=y)
+
+    with stage("key"), memory_stage("key", track=track):
+        try:
+            key_name, scale_name, key_camelot, key_confidence = detect_key(y, sr)
+        except Exception:
+            key_name, scale_name, key_conf = _key_librosa_fallback(y, sr)
+            key_camelot = key_to_camelot(key_name, scale_name)
+            key_confidence = key_conf
+
+    with stage("beats"), memory_stage("beat", track=track):
+        bpm = _bpm_librosa(y, sr)
+        beats = _beats_librosa(y, sr)
+    with stage("features"), memory_stage("features", track=track):
+        energy = _energy_librosa(y, sr)
     duration_sec = float(len(y) / sr)
     phrase_starts_sec, outro_start_sec = _phrase_starts_and_outro(bpm, duration_sec)
 
@@ -0,0 +1,110 @@
+"""Codec binario de SongAnalysis (beats/frases como float32) y store por clave de contenido en Redis.
+
+Los tasks de Celery pasan la clave (str corta) en lugar del dump JSON con miles de floats; el worker la resuelve
+con analysis_from_ref (cache local por proceso: cada track aparece en dos segmentos). Formato:
+  b"\\x01" + msgpack {campos escalares..., "beats": bytes float32, "phrases": bytes float32}
+  b"\\x02" + JSON con los arrays en base64 (sin msgpack instalado)
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Optional, Union
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .metrics import cache_event
+from .models import SongAnalysis
+from .redis_store import get_blob, set_blob
+
+_FMT_MSGPACK = b"\x01"
+_FMT_JSON = b"\x02"
+_ARRAYS = {"beats": "beats", "phrase_starts_sec": "phrases"}
+REDIS_KEY_ANALYSIS = "opus:analysis:{}"
+REDIS_TTL_ANALYSIS = 6 * 3600  # un set largo puede tardar más que el TTL de job
+_LOCAL_MAX = 256
+
+_local: "OrderedDict[str, SongAnalysis]" = OrderedDict()
+
+
+def encode_analysis(analysis: SongAnalysis) -> bytes:
+    """SongAnalysis -> bytes (arrays como float32 little-endian)."""
+    data: dict[str, Any] = analysis.model_dump(mode="json", exclude=set(_ARRAYS))
+    arrays = {
+        short: np.asarray(getattr(analysis, field) or [], dtype="<f4").tobytes()
+        for field, short in _ARRAYS.items()
+    }
+    if msgpack is not None:
+        return _FMT_MSGPACK + msgpack.packb({**data, **arrays}, use_bin_type=True)
+    data.update({k: base64.b64encode(v).decode("ascii") for k, v in arrays.items()})
+    return _FMT_JSON + json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def decode_analysis(blob: bytes) -> SongAnalysis:
+    """Inverso de encode_analysis. Los tiempos vuelven redondeados a 0.1 ms (precisión de float32)."""
+    fmt, body = blob[:1], blob[1:]
+    if fmt == _FMT_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("msgpack is required to decode this analysis")
+        data = msgpack.unpackb(body, raw=False)
+    elif fmt == _FMT_JSON:
+        data = json.loads(body)
+        for short in _ARRAYS.values():
+            data[short] = base64.b64decode(data.get(short) or "")
+    else:
+        raise ValueError("Unknown analysis encoding")
+    for field, short in _ARRAYS.items():
+        arr = np.frombuffer(data.pop(short, b"") or b"", dtype="<f4")
+        data[field] = np.round(arr.astype(np.float64), 4).tolist()
+    return SongAnalysis.model_validate(data)
+
+
+def analysis_key(blob: bytes) -> str:
+    """Clave por contenido: el mismo análisis en otro segmento/sesión reusa la entrada."""
+    return hashlib.sha256(blob).hexdigest()[:32]
+
+
+def store_analysis(analysis: SongAnalysis) -> Optional[str]:
+    """Guarda el análisis en Redis y devuelve la clave; None si no hay Redis."""
+    blob = encode_analysis(analysis)
+    key = analysis_key(blob)
+    if not set_blob(REDIS_KEY_ANALYSIS.format(key), blob, REDIS_TTL_ANALYSIS):
+        return None
+    return key
+
+
+def analysis_ref(analysis: SongAnalysis) -> Union[str, dict[str, Any]]:
+    """Referencia para argumentos de task: clave en Redis o, sin Redis, el dump JSON de siempre."""
+    return store_analysis(analysis) or analysis.model_dump(mode="json")
+
+
+def load_analysis(key: str) -> SongAnalysis:
+    """SongAnalysis por clave (cache local LRU, si no Redis). KeyError si expiró o no existe."""
+    cached = _local.get(key)
+    if cached is not None:
+        _local.move_to_end(key)
+        cache_event("analysis", "hit")
+        return cached.model_copy(deep=True)
+    cache_event("analysis", "miss")
+    blob = get_blob(REDIS_KEY_ANALYSIS.format(key))
+    if blob is None:
+        raise KeyError(f"Analysis {key} not found (expired?)")
+    analysis = decode_analysis(blob)
+    _local[key] = analysis
+    while len(_local) > _LOCAL_MAX:
+        _local.popitem(last=False)
+    return analysis.model_copy(deep=True)
+
+
+def analysis_from_ref(ref: Union[str, dict[str, Any]]) -> SongAnalysis:
+    """Inverso de analysis_ref (acepta clave o dict, para tasks encolados con el formato viejo)."""
+    if isinstance(ref, str):
+        return load_analysis(ref)
+    return SongAnalysis.model_validate(ref)
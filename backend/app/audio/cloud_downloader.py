@@ -1,22 +1,125 @@
-"""Downloader: descarga samples por URL con httpx a carpeta temporal. Auto-cleanup después del render."""
+"""Downloader: descarga samples por URL con httpx a carpeta temporal. Auto-cleanup después del render.
+
+Un solo httpx.Client con pool de conexiones por proceso worker (se recrea tras fork). Los cuerpos se escriben a
+disco en chunks (memoria constante para stems grandes) y varias URLs se bajan en paralelo bajo un límite
+de conexiones; cada request tiene un deadline total además de los timeouts de conexión/lectura.
+"""
 from __future__ import annotations
 
+import hashlib
+import os
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import BinaryIO, List, Optional
 
 try:
     import httpx
 except ImportError:
     httpx = None
 
+from ..config import settings
+from ..metrics import timed
+
 OPUS_SAMPLES_DIR = "opus_samples"
+_CHUNK = 1 << 16
+_USER_AGENT = "OpusAI/1.0"
+
+_client = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+@dataclass
+class DownloadResult:
+    """Resultado de stream_download (status 304 = no se escribió nada)."""
+
+    status: int
+    size: int = 0
+    sha256: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
 
 
 def _temp_root() -> Path:
     return Path(tempfile.gettempdir()) / OPUS_SAMPLES_DIR
 
 
+def get_http_client():
+    """httpx.Client compartido del proceso (pool limitado a download_max_connections). None sin httpx."""
+    global _client, _client_pid
+    if httpx is None:
+        return None
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                # Tras fork (prefork de Celery) el pool heredado no es usable: cliente nuevo sin cerrar el del padre
+                limit = max(1, settings.download_max_connections)
+                _client = httpx.Client(
+                    timeout=httpx.Timeout(settings.download_timeout_sec),
+                    limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+                    follow_redirects=True,
+                    headers={"User-Agent": _USER_AGENT},
+                )
+                _client_pid = pid
+    return _client
+
+
+@timed("download")
+def stream_download(
+    url: str,
+    out: BinaryIO,
+    headers: Optional[dict[str, str]] = None,
+    deadline_sec: Optional[float] = None,
+) -> DownloadResult:
+    """
+    GET en streaming: escribe el cuerpo en out por chunks y calcula sha256 al vuelo.
+    Con headers condicionales, un 304 devuelve status=304 sin escribir. TimeoutError si se pasa el deadline.
+    """
+    deadline = time.monotonic() + (settings.download_deadline_sec if deadline_sec is None else deadline_sec)
+    sha = hashlib.sha256()
+    size = 0
+
+    def write(chunk: bytes) -> None:
+        nonlocal size
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Download deadline exceeded for {url}")
+        out.write(chunk)
+        sha.update(chunk)
+        size += len(chunk)
+
+    client = get_http_client()
+    if client is not None:
+        with client.stream("GET", url, headers=headers or {}) as r:
+            if r.status_code == 304:
+                return DownloadResult(status=304)
+            r.raise_for_status()
+            for chunk in r.iter_bytes(_CHUNK):
+                write(chunk)
+            return DownloadResult(r.status_code, size, sha.hexdigest(), r.headers.get("etag"), r.headers.get("last-modified"))
+
+    import urllib.error
+    import urllib.request
+    req = urllib.request.Request(url, headers={"User-Agent": _USER_AGENT, **(headers or {})})
+    try:
+        resp = urllib.request.urlopen(req, timeout=settings.download_timeout_sec)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return DownloadResult(status=304)
+        raise
+    with resp:
+        while True:
+            chunk = resp.read(_CHUNK)
+            if not chunk:
+                break
+            write(chunk)
+        return DownloadResult(resp.status, size, sha.hexdigest(), resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+
+
 def download_to_temp(url: str, temp_dir: Optional[Path] = None) -> Path:
     """
     Descarga el archivo desde url a temp_dir (o /tmp/opus_samples) con httpx.
@@ -31,55 +134,49 @@ def download_to_temp(url: str, temp_dir: Optional[Path] = None) -> Path:
     if not name.lower().endswith((".wav", ".mp3", ".flac", ".ogg", ".m4a")):
         name = name + ".wav"
     out_path = temp_dir / name
-    if httpx:
-        with httpx.Client(timeout=30.0) as client:
-            r = client.get(url)
-            r.raise_for_status()
-            out_path.write_bytes(r.content)
-    else:
-        import urllib.request
-        req = urllib.request.Request(url, headers={"User-Agent": "OpusAI/1.0"})
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            out_path.write_bytes(resp.read())
+    try:
+        with open(out_path, "wb") as f:
+            stream_download(url, f)
+    except Exception:
+        out_path.unlink(missing_ok=True)
+        raise
+    return out_path
+
+
+def _download_one(url: str, out_path: Path) -> Path:
+    try:
+        with open(out_path, "wb") as f:
+            stream_download(url, f)
+    except Exception:
+        out_path.unlink(missing_ok=True)
+        raise
     return out_path
 
 
 def download_urls_to_temp(urls: List[str], temp_dir: Optional[Path] = None) -> tuple[List[Path], Path]:
     """
-    Descarga varias URLs a un mismo temp_dir con httpx. Devuelve (lista de paths, temp_dir)
-    para poder borrar temp_dir después del render.
+    Descarga varias URLs a un mismo temp_dir en paralelo (pool compartido, límite de conexiones).
+    Devuelve (lista de paths en el orden de urls, temp_dir) para poder borrar temp_dir después del render.
     """
-    import shutil
     temp_dir = temp_dir or Path(tempfile.mkdtemp(prefix=OPUS_SAMPLES_DIR + "_"))
     temp_dir.mkdir(parents=True, exist_ok=True)
-    paths: List[Path] = []
-    if httpx:
-        with httpx.Client(timeout=30.0) as client:
-            for i, url in enumerate(urls):
-                if not url or not str(url).strip().startswith("http"):
-                    continue
-                url = str(url).strip()
-                ext = Path(url.split("/")[-1].split("?")[0]).suffix or ".wav"
-                name = f"cloud_{i}{ext}"
-                out_path = temp_dir / name
-                r = client.get(url)
-                r.raise_for_status()
-                out_path.write_bytes(r.content)
-                paths.append(out_path)
-    else:
-        import urllib.request
-        for i, url in enumerate(urls):
-            if not url or not str(url).strip().startswith("http"):
-                continue
-            url = str(url).strip()
-            ext = Path(url.split("/")[-1].split("?")[0]).suffix or ".wav"
-            name = f"cloud_{i}{ext}"
-            out_path = temp_dir / name
-            req = urllib.request.Request(url, headers={"User-Agent": "OpusAI/1.0"})
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                out_path.write_bytes(resp.read())
-            paths.append(out_path)
-    return paths, temp_dir
+    jobs: list[tuple[str, Path]] = []
+    for i, url in enumerate(urls):
+        if not url or not str(url).strip().startswith("http"):
+            continue
+        url = str(url).strip()
+        ext = Path(url.split("/")[-1].split("?")[0]).suffix or ".wav"
+        jobs.append((url, temp_dir / f"cloud_{i}{ext}"))
+    return parallel_map(lambda job: _download_one(*job), jobs), temp_dir
+
+
+def parallel_map(fn, items: list) -> list:
+    """Aplica fn a items en threads (máx. download_max_connections); mismo orden; propaga el primer error."""
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    workers = min(len(items), max(1, settings.download_max_connections))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cloud-dl") as pool:
+        return list(pool.map(fn, items))
 
 
 def cleanup_temp_dir(temp_dir: Path) -> None:
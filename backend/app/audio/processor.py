@@ -1,8 +1,20 @@
 """Mezcla profesional: 4 inputs fijos (track_a, track_b, cloud_vocal, cloud_instrument). Crossfade + amix en cadena."""
-import subprocess
 from pathlib import Path
 from typing import Union
 
+from ..metrics import stage
+from .tools import ToolError, run_tool
+
+# |ratio - 1| por debajo de esto no se aplica atempo (stems ya conformados por stem_cache, grilla de BPM fina)
+ATEMPO_EPSILON = 0.001
+
+
+def _overlay_chain(input_idx: int, ratio: float, entry_ms: int, label: str) -> str:
+    """[i:a]atempo,adelay -> [label]; sin atempo si el overlay ya viene al tempo del set."""
+    filters = [] if abs(ratio - 1.0) < ATEMPO_EPSILON else [f"atempo={round(ratio, 4)}"]
+    filters.append(f"adelay={entry_ms}|{entry_ms}")
+    return f"[{input_idx}:a]" + ",".join(filters) + f"[{label}]"
+
 
 def render_professional_mix(
     path_a: Union[str, Path],
@@ -21,7 +33,8 @@ def render_professional_mix(
     """
     Siempre 4 inputs: [0]=track_a, [1]=track_b, [2]=cloud_vocal, [3]=cloud_instrument.
     Filtro: [0:a][1:a]acrossfade -> [mixed_main]; [mixed_main][2:a]atempo,adelay -> [with_vocal]; [with_vocal][3:a]atempo,adelay -> [final_out]; loudnorm.
-    adelay usa overlay_entry_sec (breakdown) en ms. atempo = target_bpm / overlay_bpm por sample.
+    adelay usa overlay_entry_sec (breakdown) en ms. atempo = target_bpm / overlay_bpm por sample
+    (se omite si el overlay ya viene conformado: ratio ≈ 1, ver stem_cache).
     """
     path_a = Path(path_a)
     path_b = Path(path_b)
@@ -50,8 +63,8 @@ def render_professional_mix(
         base_chain = "[0:a][1:a]" + across + "[mixed_main]"
 
     # [mixed_main][2:a]atempo,adelay -> [with_vocal]; [with_vocal][3:a]atempo,adelay -> [final_out]
-    vocal_chain = f"[2:a]atempo={round(ratio_v, 4)},adelay={entry_ms}|{entry_ms}[vocal]"
-    instrument_chain = f"[3:a]atempo={round(ratio_i, 4)},adelay={entry_ms}|{entry_ms}[instrument]"
+    vocal_chain = _overlay_chain(2, ratio_v, entry_ms, "vocal")
+    instrument_chain = _overlay_chain(3, ratio_i, entry_ms, "instrument")
     amix1 = "[mixed_main][vocal]amix=inputs=2:duration=first:dropout_transition=2[with_vocal]"
     amix2 = "[with_vocal][instrument]amix=inputs=2:duration=first:dropout_transition=2[final_out]"
     filter_with_loudnorm = ";".join([
@@ -84,9 +97,12 @@ def render_professional_mix(
     # Debug: comando final FFmpeg
     print("[processor.py] FFmpeg command:", " ".join(command))
 
-    result = subprocess.run(command, capture_output=True, text=True)
-
-    if result.returncode != 0 and ("loudnorm" in (result.stderr or "") or "loudnorm" in (result.stdout or "")):
+    try:
+        with stage("ffmpeg_mix"):
+            run_tool(command)
+    except ToolError as e:
+        if e.timed_out or "loudnorm" not in e.stderr:
+            raise
         command_fallback = [
             "ffmpeg", "-y",
             *[arg for p in inputs for arg in ("-i", str(p))],
@@ -96,9 +112,7 @@ def render_professional_mix(
             str(output_path),
         ]
         print("[processor.py] FFmpeg fallback (no loudnorm):", " ".join(command_fallback))
-        result = subprocess.run(command_fallback, capture_output=True, text=True)
-
-    if result.returncode != 0:
-        raise RuntimeError(f"FFmpeg Error (exit {result.returncode}): {result.stderr or result.stdout}")
+        with stage("ffmpeg_mix"):
+            run_tool(command_fallback)
 
     return output_path
@@ -0,0 +1,288 @@
+"""Cache en disco de samples cloud (audio-worker): contenido direccionado por hash, índice por URL, LRU por tamaño.
+
+Layout en cache_dir:
+  blobs/<sha256>.<ext>   contenido (varias URLs con el mismo archivo comparten blob)
+  urls/<sha256(url)>.json  {url, blob, etag, last_modified, size, checked_at}
+  locks/                 flock por URL (una sola descarga entre procesos Celery) + lock de evicción
+Dentro de revalidate_sec se sirve sin red; después se revalida con If-None-Match / If-Modified-Since (304 = sin
+descarga). Si la red falla y hay blob, se sirve el blob viejo. La evicción borra blobs por mtime (LRU: cada hit
+toca el mtime) hasta quedar bajo max_bytes, sin tocar blobs usados hace menos de _EVICT_MIN_AGE_SEC
+(pueden estar abiertos por un FFmpeg en curso).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin locks entre procesos
+    fcntl = None
+
+from ..config import settings
+from ..metrics import cache_event
+from .cloud_downloader import parallel_map, stream_download
+
+_AUDIO_EXT = (".wav", ".mp3", ".flac", ".ogg", ".m4a")
+_EVICT_MIN_AGE_SEC = 600.0
+
+
+def _url_hash(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _url_ext(url: str) -> str:
+    ext = Path(url.split("/")[-1].split("?")[0]).suffix.lower()
+    return ext if ext in _AUDIO_EXT else ".wav"
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """flock exclusivo sobre path (entre procesos y threads); no-op sin fcntl."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a+") as fh:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def evict_lru(directory: Path, max_bytes: int, lock_path: Path) -> int:
+    """
+    Borra los archivos de directory con mtime más viejo hasta quedar bajo max_bytes (ignora ocultos/temporales
+    y los usados hace menos de _EVICT_MIN_AGE_SEC). Devuelve bytes liberados.
+    """
+    files: list[tuple[float, int, Path]] = []
+    for p in directory.iterdir():
+        if p.name.startswith("."):
+            continue
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in files)
+    if total <= max_bytes:
+        return 0
+    freed = 0
+    now = time.time()
+    with file_lock(lock_path):
+        for mtime, size, p in sorted(files):
+            if total - freed <= max_bytes:
+                break
+            if now - mtime < _EVICT_MIN_AGE_SEC:
+                continue
+            try:
+                p.unlink()
+                freed += size
+            except OSError:
+                continue
+    return freed
+
+
+def touch(path: Path) -> None:
+    """Marca uso (LRU por mtime)."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _write_json_atomic(path: Path, data: dict[str, Any]) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class SampleCache:
+    """Cache de samples por URL. Seguro entre procesos (flock) y threads (archivos temporales únicos)."""
+
+    def __init__(self, root: Path, max_bytes: int, revalidate_sec: float = 3600.0):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.revalidate_sec = float(revalidate_sec)
+        self.blobs = self.root / "blobs"
+        self.urls = self.root / "urls"
+        self.locks = self.root / "locks"
+        for d in (self.blobs, self.urls, self.locks):
+            d.mkdir(parents=True, exist_ok=True)
+
+    # ------------------------------------------------------------------ locks / índice
+
+    def _lock(self, name: str):
+        return file_lock(self.locks / f"{name}.lock")
+
+    def _entry_path(self, url: str) -> Path:
+        return self.urls / f"{_url_hash(url)}.json"
+
+    def _read_entry(self, url: str) -> Optional[dict[str, Any]]:
+        try:
+            entry = json.loads(self._entry_path(url).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url:
+            return None
+        blob = self.blobs / str(entry.get("blob", ""))
+        return entry if entry.get("blob") and blob.is_file() else None
+
+    # ------------------------------------------------------------------ red
+
+    def _conditional_get(self, url: str, entry: Optional[dict[str, Any]]) -> Optional[dict[str, Any]]:
+        """
+        GET condicional con streaming a blobs/. Devuelve la entrada nueva, o None si el servidor respondió 304.
+        El contenido se hashea mientras se escribe (cloud_downloader.stream_download, cliente httpx compartido);
+        si el blob ya existe (mismo contenido) se descarta el temporal.
+        """
+        headers: dict[str, str] = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        fd, tmp_name = tempfile.mkstemp(dir=self.blobs, prefix=".dl_")
+        tmp = Path(tmp_name)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                result = stream_download(url, out, headers=headers)
+            if result.status == 304:
+                return None
+            size = result.size
+            if size <= 0:
+                raise RuntimeError(f"Empty response for {url}")
+            blob_name = result.sha256 + _url_ext(url)
+            blob = self.blobs / blob_name
+            if blob.exists():
+                touch(blob)
+            else:
+                os.replace(tmp, blob)
+            return {
+                "url": url,
+                "blob": blob_name,
+                "etag": result.etag,
+                "last_modified": result.last_modified,
+                "size": size,
+                "checked_at": time.time(),
+            }
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    # ------------------------------------------------------------------ API
+
+    def get(self, url: str) -> Path:
+        """Path local del sample (descarga, revalida o sirve desde cache). RuntimeError si no hay forma de obtenerlo."""
+        url = (url or "").strip()
+        if not url.startswith("http"):
+            raise ValueError("URL must start with http")
+        entry = self._read_entry(url)
+        if entry and time.time() - float(entry.get("checked_at", 0)) < self.revalidate_sec:
+            blob = self.blobs / entry["blob"]
+            touch(blob)
+            cache_event("sample", "hit")
+            return blob
+        with self._lock(_url_hash(url)):
+            # Otro proceso pudo haberlo bajado/revalidado mientras esperábamos el lock
+            entry = self._read_entry(url)
+            if entry and time.time() - float(entry.get("checked_at", 0)) < self.revalidate_sec:
+                blob = self.blobs / entry["blob"]
+                touch(blob)
+                cache_event("sample", "hit")
+                return blob
+            try:
+                fresh = self._conditional_get(url, entry)
+            except Exception as e:
+                if entry:
+                    print(f"[sample_cache] revalidación falló ({e}); sirviendo copia cacheada de {url}", file=sys.stderr)
+                    cache_event("sample", "stale")
+                    blob = self.blobs / entry["blob"]
+                    touch(blob)
+                    return blob
+                cache_event("sample", "error")
+                raise RuntimeError(f"Could not download cloud sample {url}: {e}") from e
+            if fresh is None:  # 304
+                assert entry is not None
+                entry["checked_at"] = time.time()
+                fresh = entry
+                cache_event("sample", "revalidated")
+            else:
+                cache_event("sample", "miss")
+            _write_json_atomic(self._entry_path(url), fresh)
+            blob = self.blobs / fresh["blob"]
+            touch(blob)
+        self.evict()
+        return blob
+
+    def total_bytes(self) -> int:
+        total = 0
+        for p in self.blobs.glob("*.*"):
+            if not p.name.startswith("."):
+                try:
+                    total += p.stat().st_size
+                except OSError:
+                    pass
+        return total
+
+    def evict(self) -> int:
+        """Borra blobs menos usados hasta quedar bajo max_bytes. Devuelve bytes liberados."""
+        # Entradas de URL cuyo blob ya no existe se ignoran en _read_entry y se re-descargan
+        return evict_lru(self.blobs, self.max_bytes, self.locks / "evict.lock")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "dir": str(self.root),
+            "entries": sum(1 for _ in self.urls.glob("*.json")),
+            "bytes": self.total_bytes(),
+            "max_bytes": self.max_bytes,
+        }
+
+
+_CACHE: Optional[SampleCache] = None
+
+
+def get_sample_cache() -> SampleCache:
+    """Cache del proceso, configurada desde settings (AUTOMIX_CLOUD_CACHE_*)."""
+    global _CACHE
+    if _CACHE is None:
+        root = (settings.cloud_cache_dir or "").strip()
+        _CACHE = SampleCache(
+            Path(root) if root else Path(tempfile.gettempdir()) / "opus_sample_cache",
+            max_bytes=settings.cloud_cache_max_mb * 1024 * 1024,
+            revalidate_sec=settings.cloud_cache_revalidate_sec,
+        )
+    return _CACHE
+
+
+def cached_sample_paths(urls: list[str]) -> list[Path]:
+    """Paths locales (cacheados) de las URLs, en el mismo orden; las que faltan se bajan en paralelo. No borrar."""
+    cache = get_sample_cache()
+    return parallel_map(cache.get, list(urls))
+
+
+def prefetch_catalogue() -> dict[str, int]:
+    """Descarga/revalida todas las URLs de cloud_assets.json (al arrancar el worker). Errores se loguean."""
+    from .cloud_assets import load_cloud_assets
+
+    ok = failed = 0
+    cache = get_sample_cache()
+    for entries in load_cloud_assets().values():
+        for e in entries:
+            url = str(e.get("url") or "").strip() if isinstance(e, dict) else ""
+            if not url.startswith("http"):
+                continue
+            try:
+                cache.get(url)
+                ok += 1
+            except Exception as ex:
+                failed += 1
+                print(f"[sample_cache] prefetch falló para {url}: {ex}", file=sys.stderr)
+    print(f"[sample_cache] prefetch: {ok} ok, {failed} errores", file=sys.stderr, flush=True)
+    return {"ok": ok, "failed": failed}
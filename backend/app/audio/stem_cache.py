@@ -0,0 +1,142 @@
+"""Cache de stems derivados: overlays ya conformados (atempo al BPM del set + resample) para no repetir DSP por render.
+
+Clave: (id del sample, BPM objetivo redondeado a stem_bpm_grid, sr). El id es el hash de contenido del blob de
+sample_cache (o path+mtime+size para archivos locales). Se llena lazy en render_mix o con warm_stems (tarea de
+warm-up / arranque del worker). El stem sale en PCM s16 al sr del set: el mixer lo usa con atempo=1 (sin filtro).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sys
+from pathlib import Path
+from typing import Iterable, Optional
+
+from ..config import settings
+from ..metrics import cache_event
+from ..tracing import span
+from .sample_cache import evict_lru, file_lock, get_sample_cache, touch
+from .tools import ToolError, run_tool
+
+# Mismo rango que atempo en processor.render_professional_mix
+_MIN_RATIO, _MAX_RATIO = 0.5, 2.0
+
+
+def _stems_dir() -> Path:
+    d = get_sample_cache().root / "stems"
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def sample_id(path: Path) -> str:
+    """Id estable del sample: nombre del blob (sha256 del contenido) o hash de path+mtime+size."""
+    path = Path(path)
+    if path.parent == get_sample_cache().blobs:
+        return path.stem
+    st = path.stat()
+    return hashlib.sha256(f"{path.resolve()}|{st.st_mtime_ns}|{st.st_size}".encode()).hexdigest()
+
+
+def grid_bpm(bpm: float) -> float:
+    """BPM objetivo redondeado a la grilla (stem_bpm_grid): renders a BPMs casi iguales comparten stem."""
+    grid = max(0.01, float(settings.stem_bpm_grid))
+    return round(round(float(bpm) / grid) * grid, 4)
+
+
+def conformed_stem(source: Path, source_bpm: float, target_bpm: float, sr: Optional[int] = None) -> tuple[Path, float]:
+    """
+    Stem de source llevado a target_bpm (redondeado a la grilla) y sr. Devuelve (path, bpm del stem) para pasarle
+    al mixer vocal_bpm/instrument_bpm = bpm del stem. Si no hace falta conformar o falla FFmpeg, (source, source_bpm).
+    """
+    sr = int(sr or settings.default_sr)
+    source_bpm = float(source_bpm or 0.0)
+    if not settings.stem_cache_enabled or source_bpm <= 0 or target_bpm <= 0:
+        return source, source_bpm
+    target = grid_bpm(target_bpm)
+    ratio = target / source_bpm
+    if not (_MIN_RATIO <= ratio <= _MAX_RATIO):
+        # Fuera del rango de atempo el mixer clampa el ratio: se deja el original para no cambiar el resultado
+        return source, source_bpm
+    stem_bpm = target
+    try:
+        sid = sample_id(source)
+    except OSError:
+        return source, source_bpm
+    out = _stems_dir() / f"{sid[:32]}_{target:.2f}_{sr}.wav"
+    if out.exists():
+        touch(out)
+        cache_event("stem", "hit")
+        return out, stem_bpm
+    cache_event("stem", "miss")
+    with file_lock(_stems_dir() / f".{out.stem}.lock"):
+        if not out.exists():
+            tmp = out.with_name(f".{out.name}.{os.getpid()}.tmp.wav")
+            filters = f"atempo={round(ratio, 6)}" if abs(ratio - 1.0) > 1e-6 else "anull"
+            error = None
+            try:
+                with span("ffmpeg_stem", ratio=round(ratio, 6)):
+                    run_tool([
+                        "ffmpeg", "-y", "-i", str(source),
+                        "-af", filters, "-ar", str(sr), "-ac", "2",
+                        "-acodec", "pcm_s16le", str(tmp),
+                    ])
+            except ToolError as e:
+                error = str(e)[-300:]
+            if error is not None:
+                tmp.unlink(missing_ok=True)
+                print(f"[stem_cache] no se pudo conformar {source}: {error}", file=sys.stderr)
+                cache_event("stem", "error")
+                return source, source_bpm
+            os.replace(tmp, out)
+    try:
+        evict_lru(_stems_dir(), settings.stem_cache_max_mb * 1024 * 1024, _stems_dir() / ".evict.lock")
+    except OSError:
+        pass
+    return out, stem_bpm
+
+
+def warm_stems(urls_bpms: Iterable[tuple[str, float]], target_bpms: Iterable[float]) -> dict[str, int]:
+    """Pre-genera stems de (url, bpm del sample) para cada BPM objetivo. Errores se loguean."""
+    ok = failed = 0
+    cache = get_sample_cache()
+    targets = sorted({grid_bpm(b) for b in target_bpms if b and b > 0})
+    for url, bpm in urls_bpms:
+        try:
+            source = cache.get(url)
+        except Exception as e:
+            failed += 1
+            print(f"[stem_cache] warm-up: no se pudo bajar {url}: {e}", file=sys.stderr)
+            continue
+        for target in targets:
+            path, _ = conformed_stem(source, bpm, target)
+            if path != source:
+                ok += 1
+            else:
+                failed += 1
+    print(f"[stem_cache] warm-up: {ok} stems, {failed} errores", file=sys.stderr, flush=True)
+    return {"ok": ok, "failed": failed}
+
+
+def warm_catalogue(target_bpms: Iterable[float]) -> dict[str, int]:
+    """Warm-up de todo cloud_assets.json a los BPMs dados (p. ej. AUTOMIX_STEM_WARM_BPMS al arrancar)."""
+    from .cloud_assets import load_cloud_assets
+
+    items: list[tuple[str, float]] = []
+    for entries in load_cloud_assets().values():
+        for e in entries:
+            if isinstance(e, dict) and str(e.get("url") or "").strip().startswith("http"):
+                items.append((str(e["url"]).strip(), float(e.get("bpm", 120))))
+    return warm_stems(items, target_bpms)
+
+
+def parse_bpm_list(value: str) -> list[float]:
+    """'120,124,128' → [120.0, 124.0, 128.0] (ignora valores inválidos)."""
+    out: list[float] = []
+    for part in (value or "").split(","):
+        try:
+            bpm = float(part)
+        except ValueError:
+            continue
+        if bpm > 0:
+            out.append(bpm)
+    return out
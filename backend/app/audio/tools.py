@@ -0,0 +1,180 @@
+"""Ejecución de herramientas externas (ffmpeg, ffprobe, rubberband): la única puerta a subprocess del backend.
+
+- Timeout por herramienta (AUTOMIX_TOOL_TIMEOUT_*; 0 = sin límite): un ffmpeg colgado se mata y el task falla en
+  vez de retener el slot del worker para siempre.
+- Semáforo global de slots (AUTOMIX_TOOL_SLOTS, 0 = núcleos): flock sobre N archivos en tool_slots_dir,
+  compartido por todos los procesos del host (prefork, varios workers, API). Más procesos DSP que núcleos solo
+  suman cambios de contexto y memoria; con el semáforo la capacidad bajo carga es predecible.
+- Presupuesto de threads por task (governor): -threads/-filter_threads en ffmpeg, --no-threads en Rubber Band.
+- nice / ionice opcionales (prefijo del comando, no preexec_fn: la API corre esto desde threads).
+- stderr siempre capturado; si falla, ToolError con herramienta, exit code, duración y las últimas líneas.
+- Métricas: opus_tool_seconds{tool, outcome} y opus_tool_slot_wait_seconds{tool}.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows: semáforo solo dentro del proceso
+    fcntl = None
+
+from ..config import settings
+from ..governor import available_cores, ffmpeg_thread_args, rubberband_thread_args
+from ..metrics import tool_finished
+
+_STDERR_TAIL_LINES = 20  # en as_dict(); el mensaje de la excepción lleva las últimas 3
+_SLOT_POLL_SEC = (0.005, 0.1)  # backoff mientras todos los slots están ocupados
+
+_local_slots: Optional[threading.BoundedSemaphore] = None
+_local_slots_lock = threading.Lock()
+
+
+class ToolError(RuntimeError):
+    """Herramienta externa que falló, no arrancó o excedió su timeout."""
+
+    def __init__(
+        self,
+        tool: str,
+        cmd: Sequence[str],
+        returncode: Optional[int],
+        stderr: str,
+        duration_sec: float,
+        timed_out: bool = False,
+    ):
+        self.tool = tool
+        self.cmd = list(cmd)
+        self.returncode = returncode
+        self.stderr = stderr
+        self.duration_sec = duration_sec
+        self.timed_out = timed_out
+        if timed_out:
+            reason = f"timed out after {duration_sec:.1f}s"
+        elif returncode is None:
+            reason = "could not start"
+        else:
+            reason = f"exit {returncode}"
+        tail = self.stderr_tail(3)
+        super().__init__(f"{tool} {reason}" + (f": {tail}" if tail else ""))
+
+    def stderr_tail(self, lines: int = _STDERR_TAIL_LINES) -> str:
+        return "\n".join(self.stderr.strip().splitlines()[-lines:])
+
+    def as_dict(self) -> dict:
+        return {
+            "tool": self.tool,
+            "returncode": self.returncode,
+            "timed_out": self.timed_out,
+            "duration_sec": round(self.duration_sec, 3),
+            "stderr": self.stderr_tail(),
+        }
+
+
+def tool_slots() -> int:
+    return settings.tool_slots if settings.tool_slots > 0 else available_cores()
+
+
+def tool_timeout(tool: str) -> Optional[float]:
+    """Timeout de la herramienta (s) o None si no tiene (0 o herramienta sin setting)."""
+    timeout = getattr(settings, f"tool_timeout_{tool}_sec", 0.0)
+    return float(timeout) if timeout and timeout > 0 else None
+
+
+def _slots_dir() -> Path:
+    d = Path(settings.tool_slots_dir.strip() or Path(tempfile.gettempdir()) / "opus_tool_slots")
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+@contextmanager
+def _slot() -> Iterator[None]:
+    """Un slot del semáforo global (flock no bloqueante sobre slot-<i>.lock; se libera solo si el proceso muere)."""
+    n = tool_slots()
+    if fcntl is None:
+        global _local_slots
+        with _local_slots_lock:
+            if _local_slots is None:
+                _local_slots = threading.BoundedSemaphore(n)
+        with _local_slots:
+            yield
+        return
+    slots_dir = _slots_dir()
+    start = os.getpid() % n  # procesos distintos prueban primero slots distintos
+    delay = _SLOT_POLL_SEC[0]
+    while True:
+        for i in range(n):
+            fh = open(slots_dir / f"slot-{(start + i) % n}.lock", "a+")
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fh.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+                fh.close()
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, _SLOT_POLL_SEC[1])
+
+
+def _priority_prefix() -> list[str]:
+    prefix: list[str] = []
+    if settings.tool_nice > 0 and shutil.which("nice"):
+        prefix += ["nice", "-n", str(settings.tool_nice)]
+    ionice_class = {"idle": "3", "best-effort": "2"}.get(settings.tool_ionice_class.strip().lower())
+    if ionice_class and shutil.which("ionice"):
+        prefix += ["ionice", "-c", ionice_class]
+    return prefix
+
+
+def run_tool(
+    cmd: Sequence[str],
+    *,
+    cwd: Optional[Path] = None,
+    timeout: Optional[float] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Corre cmd (ffmpeg / ffprobe / rubberband ...) con slot, timeout, threads y prioridad configurados.
+    Devuelve el CompletedProcess (stdout/stderr como texto); ToolError si sale != 0, no arranca o excede el timeout.
+    """
+    tool = Path(cmd[0]).name
+    timeout = timeout if timeout is not None else tool_timeout(tool)
+    cmd = [str(c) for c in cmd]
+    if tool == "ffmpeg":
+        cmd = ffmpeg_thread_args(cmd)
+    elif tool == "rubberband":
+        cmd = rubberband_thread_args(cmd)
+    full_cmd = _priority_prefix() + cmd
+    t_wait = time.perf_counter()
+    with _slot():
+        t0 = time.perf_counter()
+        wait = t0 - t_wait
+        try:
+            result = subprocess.run(
+                full_cmd, cwd=cwd, capture_output=True, text=True, errors="replace", timeout=timeout
+            )
+        except subprocess.TimeoutExpired as e:
+            elapsed = time.perf_counter() - t0
+            tool_finished(tool, "timeout", elapsed, wait)
+            stderr = e.stderr.decode("utf-8", "replace") if isinstance(e.stderr, bytes) else (e.stderr or "")
+            raise ToolError(tool, cmd, None, stderr, elapsed, timed_out=True) from None
+        except OSError as e:
+            elapsed = time.perf_counter() - t0
+            tool_finished(tool, "error", elapsed, wait)
+            raise ToolError(tool, cmd, None, str(e), elapsed) from e
+    elapsed = time.perf_counter() - t0
+    if result.returncode != 0:
+        tool_finished(tool, "error", elapsed, wait)
+        raise ToolError(tool, cmd, result.returncode, result.stderr or result.stdout or "", elapsed)
+    tool_finished(tool, "ok", elapsed, wait)
+    return result
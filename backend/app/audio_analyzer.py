@@ -4,8 +4,59 @@ from typing import Any, Optional
 
 import librosa
 import numpy as np
+from scipy.signal import find_peaks
 
+from .memory import memory_stage, track_buffers
+from .metrics import timed
 
+# La estructura es contexto grueso (segundos): no hace falta analizar a 44.1 kHz
+STRUCTURE_SR = 22050
+LEVEL_CODES = "LMH"
+
+
+def _novelty(features: np.ndarray, width: int) -> np.ndarray:
+    """
+    Novedad por paso de la grilla: |media(features[i:i+width]) - media(features[i-width:i])| sumada sobre features
+    (kernel checkerboard 1D, con sumas acumuladas). features: (n_features, n_steps). Devuelve (n_steps,), 0 en bordes.
+    """
+    n = features.shape[1]
+    out = np.zeros(n, dtype=np.float64)
+    if n < 2 * width + 1:
+        return out
+    cs = np.concatenate([np.zeros((features.shape[0], 1)), np.cumsum(features, axis=1)], axis=1)
+    i = np.arange(width, n - width + 1)
+    before = cs[:, i] - cs[:, i - width]
+    after = cs[:, i + width] - cs[:, i]
+    out[width:n - width + 1] = np.abs(after - before).sum(axis=0) / width
+    return out
+
+
+def segment_boundaries(
+    rms_norm: np.ndarray,
+    onset_norm: np.ndarray,
+    grid: np.ndarray,
+    width: int,
+) -> np.ndarray:
+    """
+    Fronteras de sección (frames) por novedad de energía + densidad de onsets, medida sobre la grilla (beats).
+    grid: frames de inicio de cada paso (0 incluido, creciente). width: pasos a cada lado del kernel y distancia
+    mínima entre fronteras. Devuelve [0, ..., n_frames] (las fronteras caen siempre sobre la grilla).
+    """
+    n_frames = len(rms_norm)
+    lengths = np.diff(np.append(grid, n_frames))
+    per_step = np.vstack([
+        np.add.reduceat(rms_norm, grid) / lengths,
+        np.add.reduceat(onset_norm, grid) / lengths,
+    ])
+    nov = _novelty(per_step, width)
+    if not np.any(nov > 0):
+        return np.array([0, n_frames])
+    height = float(nov.mean() + 0.5 * nov.std())
+    steps, _ = find_peaks(nov, height=height, distance=max(1, width))
+    return np.concatenate([[0], grid[steps], [n_frames]])
+
+
+@timed("structure")
 def analyze_track_structure(
     path: Path,
     sr: Optional[int] = None,
@@ -13,18 +64,22 @@ def analyze_track_structure(
     segment_sec: float = 4.0,
 ) -> dict[str, Any]:
     """
-    Carga el track con librosa y devuelve bpm, duration y una lista de segments
-    basada en amplitud (RMS) y onset para puntos de alta/baja energía.
+    Carga el track con librosa y devuelve bpm, duration y secciones de energía. Las fronteras salen de la novedad
+    de RMS + onset strength sobre la grilla de beats (ventana y largo mínimo ~segment_sec); el nivel de cada
+    sección se calcula de una vez con reduceat y terciles de RMS.
 
     Returns:
-        dict con: bpm, duration_sec, segments (list of {start_sec, end_sec, energy_level}).
+        dict con: bpm, duration_sec, bounds_sec (n+1 fronteras en s), levels (str de n letras L/M/H),
+        energy (n medias de RMS normalizado, 0-1).
     """
-    sr = sr or 44100
+    sr = min(sr or 44100, STRUCTURE_SR)
     y, _ = librosa.load(path, sr=sr, mono=True)
     duration_sec = float(len(y) / sr)
 
-    # BPM
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr, hop_length=hop_length)
+    # Onset strength: se reusa para el beat tracker (no la recalcula) y para las fronteras
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+    track_buffers(y=y, onset_env=onset_env)
+    tempo, beats = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=hop_length)
     try:
         bpm = float(tempo[0]) if hasattr(tempo, "__len__") and len(tempo) else float(tempo)
     except (IndexError, TypeError):
@@ -33,50 +88,53 @@ def analyze_track_structure(
 
     # RMS por frame (energía)
     rms = librosa.feature.rms(y=y, hop_length=hop_length)[0]
-    # Onset strength para fronteras rítmicas
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
-
+    track_buffers(rms=rms)
     n_frames = len(rms)
     if n_frames == 0:
-        return {
-            "bpm": bpm,
-            "duration_sec": duration_sec,
-            "segments": [],
-        }
+        return {"bpm": bpm, "duration_sec": round(duration_sec, 2), "bounds_sec": [], "levels": "", "energy": []}
 
     frame_duration = hop_length / sr
-    max_rms = np.max(rms) if np.max(rms) > 0 else 1.0
+    max_rms = float(np.max(rms)) or 1.0
     rms_norm = rms / max_rms
+    onset_env = onset_env[:n_frames]
+    if len(onset_env) < n_frames:
+        onset_env = np.pad(onset_env, (0, n_frames - len(onset_env)))
+    onset_norm = onset_env / (float(np.max(onset_env)) or 1.0)
 
-    # Umbrales para high / low / mid (terciles)
-    low_q, mid_q = np.percentile(rms_norm, 33), np.percentile(rms_norm, 66)
+    # Grilla: beats detectados; si son pocos, pasos fijos de un beat al BPM estimado
+    beat_frames = int(max(1, round(60.0 / bpm / frame_duration)))
+    grid = np.unique(np.asarray(beats, dtype=np.int64))
+    grid = grid[(grid > 0) & (grid < n_frames)]
+    if len(grid) < 8:
+        grid = np.arange(beat_frames, n_frames, beat_frames)
+    grid = np.concatenate([[0], grid])
+    width = max(1, int(round(segment_sec / (60.0 / bpm))))
+    bounds = segment_boundaries(rms_norm, onset_norm, grid, width)
 
-    # Segmentar en ventanas de ~segment_sec segundos y etiquetar energía
-    n_seg = max(1, int(duration_sec / segment_sec))
-    seg_len_frames = n_frames // n_seg
-    segments: list[dict[str, Any]] = []
-
-    for i in range(n_seg):
-        start_f = i * seg_len_frames
-        end_f = (i + 1) * seg_len_frames if i < n_seg - 1 else n_frames
-        chunk = rms_norm[start_f:end_f]
-        mean_energy = float(np.mean(chunk))
-        if mean_energy <= low_q:
-            energy_level = "low"
-        elif mean_energy >= mid_q:
-            energy_level = "high"
-        else:
-            energy_level = "mid"
-        start_sec = start_f * frame_duration
-        end_sec = end_f * frame_duration
-        segments.append({
-            "start_sec": round(start_sec, 2),
-            "end_sec": round(end_sec, 2),
-            "energy_level": energy_level,
-        })
+    # Umbrales para high / low / mid (terciles) y nivel de todas las secciones en una operación
+    low_q, mid_q = np.percentile(rms_norm, 33), np.percentile(rms_norm, 66)
+    energy = np.add.reduceat(rms_norm, bounds[:-1]) / np.diff(bounds)
+    codes = np.where(energy <= low_q, 0, np.where(energy >= mid_q, 2, 1))
 
     return {
         "bpm": bpm,
         "duration_sec": round(duration_sec, 2),
-        "segments": segments,
+        "bounds_sec": np.round(bounds * frame_duration, 2).tolist(),
+        "levels": "".join(LEVEL_CODES[c] for c in codes),
+        "energy": np.round(energy, 2).tolist(),
     }
+
+
+def cached_track_structure(path: Path, cache: dict, sr: Optional[int] = None) -> Optional[dict[str, Any]]:
+    """
+    analyze_track_structure memoizado por path en cache (un dict por set: cada track aparece como A y como B).
+    None si el análisis falla (la estructura es contexto opcional del prompt).
+    """
+    key = str(path)
+    if key not in cache:
+        try:
+            with memory_stage("structure", track=Path(path).name):
+                cache[key] = analyze_track_structure(Path(path), sr=sr)
+        except Exception:
+            cache[key] = None
+    return cache[key]
@@ -1,10 +1,29 @@
-"""Celery app: ai_brain queue (sequencer + strategy), audio_worker queue (render). Broker/backend = Redis."""
+"""Celery app: ai_brain queue (sequencer + strategy), audio_worker queue (render), audio_interactive (/generate de
+dos tracks, prioridad alta). Broker/backend = Redis."""
+import threading
+
 from celery import Celery
+from celery.signals import (
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_ready,
+)
 from .config import settings
 
 broker = settings.redis_url or "redis://localhost:6379/0"
 backend = settings.redis_url or "redis://localhost:6379/0"
 
+# Renders interactivos en su propia cola (los workers la consultan primero) y con prioridad Redis más alta
+# (0 = máxima); los segmentos de sets van con PRIORITY_BATCH.
+QUEUE_INTERACTIVE = "audio_interactive"
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 5
+
 app = Celery(
     "opus",
     broker=broker,
@@ -19,8 +38,147 @@ app.conf.update(
         "app.tasks.run_folder_pipeline": {"queue": "ai_brain"},
         "app.tasks.render_segment": {"queue": "audio_worker"},
         "app.tasks.finalize_set": {"queue": "ai_brain"},
+        "app.tasks.warm_overlay_stems": {"queue": "audio_worker"},
+        "app.tasks.render_two_track": {"queue": QUEUE_INTERACTIVE},
     },
     task_default_queue="default",
+    task_default_priority=PRIORITY_BATCH,
+    # Tasks largos y CPU-bound: un mensaje por proceso (sin reservar renders detrás de uno largo) y ack al terminar
+    # (si el worker muere, el render vuelve a la cola)
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    broker_transport_options={
+        "visibility_timeout": settings.celery_visibility_timeout_sec,
+        # Orden de -Q estricto (audio_interactive antes que audio_worker) y 10 niveles de prioridad por cola
+        "queue_order_strategy": "priority",
+        "priority_steps": list(range(10)),
+        "sep": ":",
+    },
     timezone="UTC",
     enable_utc=True,
 )
+
+
+@worker_init.connect
+def _init_metrics(**_kwargs) -> None:
+    """Antes de forkear el pool: limpia el directorio multiproceso y levanta el exporter del worker."""
+    from .metrics import prepare_multiprocess_dir, start_worker_exporter
+
+    prepare_multiprocess_dir()
+    start_worker_exporter()
+
+
+@worker_init.connect
+def _init_thread_budget(sender=None, **_kwargs) -> None:
+    """Presupuesto de threads por task (núcleos / -c) antes del fork; los hijos lo reaplican con threadpoolctl."""
+    from .governor import apply_thread_limits, available_cores, set_worker_concurrency
+
+    concurrency = getattr(sender, "concurrency", None)
+    set_worker_concurrency(concurrency)
+    budget = apply_thread_limits()
+    print(f"[governor] {available_cores()} núcleos, concurrency {concurrency}: {budget} threads por task", flush=True)
+
+
+@worker_process_init.connect
+def _limit_child_threads(**_kwargs) -> None:
+    from .governor import apply_thread_limits
+
+    apply_thread_limits()
+
+
+@worker_init.connect
+def _init_tracing(sender=None, **_kwargs) -> None:
+    from .tracing import init_tracing
+
+    init_tracing("opus-worker")
+
+
+# Trazas: traceparent del que encola (API, pipeline, render) en los headers del mensaje; span por ejecución de task
+@before_task_publish.connect
+def _trace_publish(headers=None, **_kwargs) -> None:
+    from .tracing import inject_task_headers
+
+    inject_task_headers(headers)
+
+
+@task_prerun.connect
+def _trace_prerun(task_id=None, task=None, args=None, **_kwargs) -> None:
+    from .tracing import task_started
+
+    if task is not None:
+        task_started(task_id, task, args)
+
+
+@task_prerun.connect
+def _memory_prerun(task_id=None, task=None, args=None, **_kwargs) -> None:
+    from .memory import task_started
+
+    task_started(task_id, task, args)
+
+
+@task_prerun.connect
+def _profile_prerun(task_id=None, task=None, args=None, **_kwargs) -> None:
+    from .profiling import task_started
+
+    task_started(task_id, task, args)
+
+
+@task_failure.connect
+def _trace_failure(task_id=None, exception=None, **_kwargs) -> None:
+    from .tracing import task_failed
+
+    task_failed(task_id, exception)
+
+
+@task_postrun.connect
+def _trace_postrun(task_id=None, state=None, **_kwargs) -> None:
+    from .tracing import task_finished
+
+    task_finished(task_id, state)
+
+
+@task_postrun.connect
+def _profile_postrun(task_id=None, state=None, **_kwargs) -> None:
+    from .profiling import task_finished
+
+    task_finished(task_id, state)
+
+
+@task_postrun.connect
+def _memory_postrun(task_id=None, **_kwargs) -> None:
+    from .memory import task_finished
+
+    task_finished(task_id)
+
+
+@worker_process_shutdown.connect
+def _metrics_process_dead(pid=None, **_kwargs) -> None:
+    from .metrics import mark_process_dead
+    from .tracing import flush
+
+    flush()
+    if pid:
+        mark_process_dead(pid)
+
+
+@worker_ready.connect
+def _prefetch_cloud_samples(**_kwargs) -> None:
+    """
+    Con AUTOMIX_CLOUD_CACHE_PREFETCH: llena la cache de samples cloud en background al arrancar el worker;
+    con AUTOMIX_STEM_WARM_BPMS además pre-genera los stems conformados a esos BPMs.
+    """
+    warm_bpms = settings.stem_warm_bpms.strip()
+    if not settings.cloud_cache_prefetch and not warm_bpms:
+        return
+
+    def run() -> None:
+        from .audio.sample_cache import prefetch_catalogue
+        from .audio.stem_cache import parse_bpm_list, warm_catalogue
+
+        if settings.cloud_cache_prefetch:
+            prefetch_catalogue()
+        if warm_bpms:
+            warm_catalogue(parse_bpm_list(warm_bpms))
+
+    threading.Thread(target=run, name="cloud-prefetch", daemon=True).start()
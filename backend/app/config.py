@@ -12,6 +12,8 @@ class Settings(BaseSettings):
     session_root: Path = Path(".sessions")
     # Librería de samples para overlays IA (percussion, instruments, vocals)
     assets_samples_dir: Path = Path("assets") / "samples"
+    # Índice SQLite de la librería (BPM/Camelot); vacío = assets_samples_dir/.sample_index.sqlite
+    sample_index_path: str = ""
 
     # Redis: broker/backend for Celery, job state, admin config (if set → use Celery + Redis store)
     redis_url: str = ""
@@ -20,6 +22,81 @@ class Settings(BaseSettings):
     openai_api_key: str = ""
     openai_base_url: str = "https://api.openai.com/v1"
     mix_decision_model: str = "gpt-4o-mini"
+    # Presupuesto de tokens del prompt de decisión (system + user); el contexto se recorta para entrar
+    llm_prompt_token_budget: int = 2000
+    # Salida estructurada: json_schema (strict, desde MixStrategy) | json_object | text
+    llm_response_format: str = "json_schema"
+
+    # Cache de strategies LLM (mismo par A→B + prompt + reglas admin → sin llamada al LLM)
+    strategy_cache_enabled: bool = True
+    strategy_cache_ttl_sec: int = 7 * 24 * 3600
+    strategy_cache_max_entries: int = 5000
+
+    # Sequencer: presupuesto de tiempo del set planner (búsqueda local para crates grandes)
+    planner_time_budget_sec: float = 0.5
+
+    # Descargas de samples cloud: conexiones simultáneas por proceso, timeout por operación y deadline por request
+    download_max_connections: int = 8
+    download_timeout_sec: float = 10.0
+    download_deadline_sec: float = 60.0
+    # Cache en disco de samples cloud (audio-worker); vacío = <tmp>/opus_sample_cache
+    cloud_cache_dir: str = ""
+    cloud_cache_max_mb: int = 2048
+    # Dentro de este tiempo se sirve sin red; después se revalida con ETag/Last-Modified
+    cloud_cache_revalidate_sec: int = 3600
+    # Descargar todo cloud_assets.json al arrancar el worker
+    cloud_cache_prefetch: bool = False
+    # Stems derivados (overlay con atempo + resample al BPM del set, grilla de stem_bpm_grid BPM)
+    stem_cache_enabled: bool = True
+    stem_cache_max_mb: int = 4096
+    stem_bpm_grid: float = 0.1
+    # BPMs objetivo para pre-generar stems de todo el catálogo al arrancar el worker (ej. "120,124,128")
+    stem_warm_bpms: str = ""
+
+    # Celery: renders largos (acks_late + prefetch 1); el broker re-entrega un task sin ack pasado este tiempo
+    celery_visibility_timeout_sec: int = 4 * 3600
+    # Fair-share: renders en paralelo por sesión (un set grande no acapara los workers); 0 = sin límite
+    render_slots_per_session: int = 2
+    render_slot_retry_sec: float = 5.0
+
+    # Métricas Prometheus (GET /metrics en la API; requiere prometheus_client)
+    metrics_enabled: bool = True
+    # Exporter HTTP de los workers Celery (0 = apagado); con prefork, setear también PROMETHEUS_MULTIPROC_DIR
+    metrics_worker_port: int = 0
+
+    # Trazas OpenTelemetry ("" = apagado | file | otlp; requiere opentelemetry-sdk)
+    tracing_exporter: str = ""
+    # Exporter file: JSON lines compartido entre procesos; vacío = base_dir/.traces/spans.jsonl
+    tracing_file: str = ""
+    tracing_otlp_endpoint: str = "http://localhost:4318/v1/traces"
+
+    # Profiling por muestreo de tasks (run_folder_pipeline, render_segment, finalize_set, /generate); el admin
+    # puede prenderlo en caliente (POST /admin/profiling). session_ids: separados por coma, vacío = todas
+    profiling_enabled: bool = False
+    profiling_session_ids: str = ""
+    profiling_interval_ms: float = 10.0
+    # Vacío = base_dir/.profiles (fuera del directorio de sesión, que se borra al descargar)
+    profiling_dir: str = ""
+
+    # Presupuesto de threads por task (governor): 0 = núcleos disponibles / concurrency del worker. cpu_cores:
+    # 0 = afinidad del proceso acotada por la cuota de cgroup
+    thread_budget: int = 0
+    cpu_cores: int = 0
+
+    # Herramientas externas (audio.tools): timeouts en s (0 = sin límite), slots concurrentes en el host
+    # (0 = cpu_cores; flock en tool_slots_dir, vacío = <tmp>/opus_tool_slots) y prioridad opcional
+    tool_timeout_ffmpeg_sec: float = 1800.0
+    tool_timeout_ffprobe_sec: float = 60.0
+    tool_timeout_rubberband_sec: float = 1800.0
+    tool_slots: int = 0
+    tool_slots_dir: str = ""
+    tool_nice: int = 0
+    tool_ionice_class: str = ""  # "" | idle | best-effort
+
+    # Memoria por etapa en el job (GET /process-folder/{id}/status): pico de RSS, buffers NumPy declarados.
+    # tracemalloc agrega deltas de asignaciones Python/NumPy por etapa (más lento: solo para investigar OOMs)
+    memory_accounting_enabled: bool = True
+    memory_tracemalloc: bool = False
 
     # Audio
     default_sr: int = 44100
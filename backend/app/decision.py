@@ -1,7 +1,6 @@
 """Mix decision: DJ brain (LLM or deterministic heuristics). OPUS-QUAD mental model. No audio processing."""
 from __future__ import annotations
 
-import json
 import sys
 from dataclasses import dataclass
 from pathlib import Path
@@ -21,6 +20,11 @@ from .analysis import harmonic_distance_camelot
 from .sample_library import get_compatible_samples
 from .config import settings
 from .models import MixStrategy, SongAnalysis
+from .metrics import stage
+from .tracing import set_attributes, traced
+from .llm_output import parse_strategy_json, repair_messages, request_json_object
+from .prompt_builder import build_decision_prompt, log_prompt_usage
+from .strategy_cache import get_cached_strategy, store_strategy, strategy_cache_key
 
 # ---------------------------------------------------------------------------
 # Musical analysis helpers (bars ↔ seconds, energy scale)
@@ -162,6 +166,7 @@ def style_prompt_to_intent(dj_style_prompt: Optional[str]) -> DJIntent:
 
 def log_dj_reasoning(strategy: MixStrategy, session_label: str = "mix") -> None:
     """Print DJ reasoning and dj_comment to console (DJ console style)."""
+    set_attributes(source=session_label)  # span decision: heuristic / llm-cache / llm / heuristic-fallback
     r = (strategy.reasoning or "").strip()
     c = (getattr(strategy, "dj_comment", None) or "").strip()
     if not r and not c:
@@ -175,35 +180,6 @@ def log_dj_reasoning(strategy: MixStrategy, session_label: str = "mix") -> None:
     print("\n".join(lines), file=sys.stderr, flush=True)
 
 
-# ---------------------------------------------------------------------------
-# Format track structure (segments) for LLM context
-# ---------------------------------------------------------------------------
-
-def _format_audio_metadata_for_llm(metadata: Optional[dict[str, Any]], label: str) -> str:
-    """Formatea BPM, duración y picos de energía para el prompt del LLM."""
-    if not metadata:
-        return f"{label}: (no metadata)"
-    bpm = metadata.get("bpm", 0)
-    duration = metadata.get("duration", 0)
-    peaks = metadata.get("energy_peaks", [])
-    peaks_str = ", ".join(f"{t}s" for t in peaks[:20]) if peaks else "ninguno"
-    if len(peaks) > 20:
-        peaks_str += f" … (+{len(peaks) - 20} más)"
-    return f"{label}: BPM={bpm}, duration={duration}s, energy_peaks=[{peaks_str}]"
-
-
-def _format_structure_for_llm(structure: Optional[dict[str, Any]], label: str) -> str:
-    """Formatea metadata técnica: duración y puntos de alta/baja energía (segments)."""
-    if not structure or not structure.get("segments"):
-        return f"{label}: (no segment structure)"
-    dur = structure.get("duration_sec", 0)
-    segs = structure.get("segments", [])
-    parts = [f"{label}: duration={dur:.1f}s, segments (start_sec–end_sec, energy):"]
-    for s in segs[-12:]:  # últimos 12 segmentos (zona final + outro)
-        parts.append(f"  {s.get('start_sec', 0):.0f}-{s.get('end_sec', 0):.0f}s {s.get('energy_level', 'mid')}")
-    return "\n".join(parts)
-
-
 # ---------------------------------------------------------------------------
 # Pioneer Opus-Quad Simulator — System Prompt (perfiles, análisis, fx_chain)
 # ---------------------------------------------------------------------------
@@ -459,146 +435,19 @@ def _heuristic_strategy(
     )
 
 
-# ---------------------------------------------------------------------------
-# LLM as DJ brain (API key present)
-# ---------------------------------------------------------------------------
-
-def get_mix_strategy(
+def _strategy_from_llm_data(
+    data: dict[str, Any],
     analysis_a: SongAnalysis,
     analysis_b: SongAnalysis,
-    dj_style_prompt: Optional[str] = None,
-    audio_metadata_a: Optional[dict[str, Any]] = None,
-    audio_metadata_b: Optional[dict[str, Any]] = None,
-    track_structure_a: Optional[dict[str, Any]] = None,
-    track_structure_b: Optional[dict[str, Any]] = None,
-    compatible_overlays: Optional[list[tuple[Path, dict]]] = None,
-    available_assets: Optional[dict[str, list[str]]] = None,
-    cloud_compatible_overlays: Optional[list[dict[str, Any]]] = None,
-    only_two_songs: bool = False,
-    api_key: Optional[str] = None,
-    base_url: Optional[str] = None,
+    *,
+    compatible_overlays: Optional[list[tuple[Path, dict]]],
+    cloud_compatible_overlays: Optional[list[dict[str, Any]]],
+    only_two_songs: bool,
+    energy_a_10: int,
+    energy_b_10: int,
+    harmonic_dist: int,
 ) -> MixStrategy:
-    """
-    Decide transition strategy: LLM (if API key) o heurísticas.
-    audio_metadata_a/b: dict con bpm, duration, energy_peaks (desde get_audio_metadata).
-    compatible_overlays: si el Sequencer ya llamó a get_compatible_samples, pasá la lista aquí; si no, se calcula dentro.
-    available_assets: resultado del scanner (instruments, vocals); el Sequencer lo pasa antes de pedir la decisión al LLM.
-    cloud_compatible_overlays: samples por URL (cloud_assets); el Sequencer pasa los compatibles con BPM/Key para que la IA elija.
-    """
-    intent = style_prompt_to_intent(dj_style_prompt)
-    api_key = api_key or settings.openai_api_key
-    base_url = base_url or settings.openai_base_url
-    client = OpenAI(api_key=api_key, base_url=base_url) if api_key else None
-
-    if not client:
-        strategy = _heuristic_strategy(analysis_a, analysis_b, intent)
-        log_dj_reasoning(strategy, "heuristic")
-        return strategy
-
-    energy_a_10 = energy_0_1_to_1_10(analysis_a.energy)
-    energy_b_10 = energy_0_1_to_1_10(analysis_b.energy)
-    energy_jump = abs(energy_a_10 - energy_b_10)
-    camelot_a = getattr(analysis_a, "key_camelot", None) or ""
-    camelot_b = getattr(analysis_b, "key_camelot", None) or ""
-    harmonic_dist = harmonic_distance_camelot(camelot_a, camelot_b)
-    phrase_a = getattr(analysis_a, "phrase_starts_sec", None) or []
-    phrase_b = getattr(analysis_b, "phrase_starts_sec", None) or []
-    _outro_a = getattr(analysis_a, "outro_start_sec", None)
-    outro_a = max(0.0, analysis_a.duration_sec - 60.0) if _outro_a is None else float(_outro_a)
-
-    user_content = "Datos técnicos (BPM, Key, Camelot, energía):\n"
-    user_content += _format_audio_metadata_for_llm(audio_metadata_a, "Track A (outgoing)") + "\n"
-    user_content += _format_audio_metadata_for_llm(audio_metadata_b, "Track B (incoming)") + "\n\n"
-    user_content += f"Energy: A={energy_a_10}/10, B={energy_b_10}/10 (jump={energy_jump}). "
-    user_content += f"Distancia armónica Camelot: {harmonic_dist} (0=mismo, 1=vecino, 2+=lejano). "
-    sens = get_mix_sensitivity()
-    user_content += "Config: priorizar BPM/tempo." if sens < 0.4 else ("Config: priorizar armonía/key." if sens > 0.6 else "Config: equilibrio BPM y armonía.")
-    user_content += "\n\n"
-    user_content += f"Track A: phrase_starts_sec (inicios de frase cada 32 compases) = {phrase_a[-8:] if len(phrase_a) > 8 else phrase_a}. outro_start_sec = {outro_a:.0f}s.\n"
-    user_content += f"Track B: phrase_starts_sec = {phrase_b[:8]}.\n\n"
-    user_content += "Tarea: song_a_transition_start_sec debe alinearse OBLIGATORIAMENTE con un valor de phrase_starts_sec (múltiplos de 32 compases); si no, con la zona de outro de A (>= outro_start_sec). "
-    user_content += "start_offset_bars debe hacer que B entre en inicio de frase. "
-    if harmonic_dist <= 1:
-        user_content += "Distancia armónica 0 o 1: priorizá transición larga y atmosférica (32–64 barras). "
-    else:
-        user_content += "Distancia armónica > 1: priorizá transición corta/rítmica o filter_fade/wash_out. "
-    user_content += "Devuelve bass_swap_sec (segundo donde se cruzan los bajos; ej. crossfade_sec*0.5). "
-    user_content += "dj_comment DEBE ser explicación técnica senior: ej. 'Mezcla armónica detectada. Ejecutando Bass-Swap en el compás 16 para evitar saturación de sub-frecuencias.'\n"
-    if energy_jump > 3:
-        user_content += "Salto de energía alto → transición más corta (4 u 8 barras). "
-    user_content += "\nOutput ONLY the JSON object, no markdown."
-
-    if track_structure_a or track_structure_b:
-        user_content = "Segmentos de energía:\n" + _format_structure_for_llm(track_structure_a, "Track A") + "\n" + _format_structure_for_llm(track_structure_b, "Track B") + "\n\n" + user_content
-    if dj_style_prompt and dj_style_prompt.strip():
-        user_content = "Prompt del usuario: " + dj_style_prompt.strip() + "\n\n" + user_content
-
-    # Sampler Manager: usar lista precalculada (Sequencer) o llamar get_compatible_samples aquí
-    overlay_paths_resolved: list[Path] = []
-    if compatible_overlays is None:
-        compatible_overlays = []
-        allow_instruments = get_allow_instruments_ai()
-        allow_vocals = get_allow_vocals_ai()
-        if allow_instruments or allow_vocals:
-            avg_bpm = (analysis_a.bpm + analysis_b.bpm) / 2.0
-            camelot_mix = camelot_a or camelot_b or "8A"
-            categories = ["instruments"] if allow_instruments else []
-            if allow_vocals:
-                categories.append("vocals")
-            compatible_overlays = get_compatible_samples(
-                avg_bpm, camelot_mix, categories, bpm_tolerance=5.0, max_camelot_distance=1
-            )
-    if available_assets:
-        user_content += "\n\nSampler (Opus Quad) — Tenés estos recursos:\n"
-        user_content += "  instruments: " + (", ".join(available_assets.get("instruments", [])) or "(ninguno)") + "\n"
-        user_content += "  vocals: " + (", ".join(available_assets.get("vocals", [])) or "(ninguno)") + "\n"
-        user_content += "Si el reasoning indica baja energía, ELEGÍ uno de cada categoría (overlay_instrument, overlay_vocal con el filename). Si no, podés devolver null.\n"
-        user_content += "Devuelve overlay_instrument: filename o null, overlay_vocal: filename o null.\n"
-        user_content += "El punto donde entra el overlay debe coincidir con un inicio de frase (phrase_starts_sec); se usará el mismo que song_a_transition_start_sec.\n"
-    if compatible_overlays:
-        low_energy = energy_a_10 <= 4 or energy_b_10 <= 4
-        harmonic_transition = harmonic_dist <= 1
-        user_content += "\nSamples compatibles (BPM/Key) para elegir: "
-        for path, meta in compatible_overlays[:12]:
-            user_content += f"{path.name} (BPM={meta.get('bpm')}, {meta.get('key_camelot')}, {meta.get('category', '')}); "
-        user_content += "\n"
-    if cloud_compatible_overlays:
-        by_cat: dict[str, list[dict]] = {}
-        for e in cloud_compatible_overlays:
-            cat = (e.get("category") or "").strip().lower()
-            if cat not in by_cat:
-                by_cat[cat] = []
-            by_cat[cat].append(e)
-        user_content += "\n\nCloud Sampler (JSON) — Tenés estos samples por URL:\n"
-        for cat in ("instruments", "vocals"):
-            entries = by_cat.get(cat, [])
-            if not entries:
-                continue
-            user_content += f"  {cat}: "
-            user_content += "; ".join(f"{e.get('url', '')} (name={e.get('name')}, BPM={e.get('bpm')}, key={e.get('key', '')})" for e in entries[:10])
-            user_content += "\n"
-        if only_two_songs:
-            user_content += "Remix Live (OBLIGATORIO): Con solo 2 canciones el set debe ser un 'Remix Live'. DEBÉS elegir OBLIGATORIAMENTE al menos 2 samples de la nube: 1 instrumento (overlay_instrument_url) y 1 vocal (overlay_vocal_url) con las URL exactas del JSON. Sin excepción.\n"
-        user_content += "Si el reasoning indica baja energía (o solo 2 canciones), ELEGÍ una URL de instrument y una de vocal (overlay_instrument_url, overlay_vocal_url). Si no, podés devolver null.\n"
-        user_content += "Devuelve overlay_instrument_url: URL exacta o null, overlay_vocal_url: URL exacta o null.\n"
-
-    system_prompt = get_system_prompt()
-    response = client.chat.completions.create(
-        model=settings.mix_decision_model,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_content},
-        ],
-        temperature=0.2,
-    )
-
-    text = response.choices[0].message.content.strip()
-    if text.startswith("```"):
-        lines = text.split("\n")
-        text = "\n".join(lines[1:-1] if lines[-1].strip() == "```" else lines[1:])
-
-    data = json.loads(text)
-
+    """JSON del LLM → MixStrategy: clamp, alineación a frases y resolución de overlays (local + cloud)."""
     data["harmonic_distance"] = harmonic_dist
     data["transition_style"] = "long_atmospheric" if harmonic_dist <= 1 else ("wash_out" if data.get("transition_type") == "filter_fade" else "short_rhythmic")
 
@@ -690,6 +539,142 @@ def get_mix_strategy(
             else:
                 data["overlay_entry_sec"] = round(ta, 2)
 
-    strategy = MixStrategy(**data)
+    return MixStrategy(**data)
+
+
+# ---------------------------------------------------------------------------
+# LLM as DJ brain (API key present)
+# ---------------------------------------------------------------------------
+
+@traced("decision")
+def get_mix_strategy(
+    analysis_a: SongAnalysis,
+    analysis_b: SongAnalysis,
+    dj_style_prompt: Optional[str] = None,
+    audio_metadata_a: Optional[dict[str, Any]] = None,
+    audio_metadata_b: Optional[dict[str, Any]] = None,
+    track_structure_a: Optional[dict[str, Any]] = None,
+    track_structure_b: Optional[dict[str, Any]] = None,
+    compatible_overlays: Optional[list[tuple[Path, dict]]] = None,
+    available_assets: Optional[dict[str, list[str]]] = None,
+    cloud_compatible_overlays: Optional[list[dict[str, Any]]] = None,
+    only_two_songs: bool = False,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+) -> MixStrategy:
+    """
+    Decide transition strategy: LLM (if API key) o heurísticas.
+    audio_metadata_a/b: dict con bpm, duration, energy_peaks (desde get_audio_metadata).
+    compatible_overlays: si el Sequencer ya llamó a get_compatible_samples, pasá la lista aquí; si no, se calcula dentro.
+    available_assets: resultado del scanner (instruments, vocals); el Sequencer lo pasa antes de pedir la decisión al LLM.
+    cloud_compatible_overlays: samples por URL (cloud_assets); el Sequencer pasa los compatibles con BPM/Key para que la IA elija.
+    """
+    intent = style_prompt_to_intent(dj_style_prompt)
+    api_key = api_key or settings.openai_api_key
+    base_url = base_url or settings.openai_base_url
+    client = OpenAI(api_key=api_key, base_url=base_url) if api_key else None
+
+    if not client:
+        strategy = _heuristic_strategy(analysis_a, analysis_b, intent)
+        log_dj_reasoning(strategy, "heuristic")
+        return strategy
+
+    energy_a_10 = energy_0_1_to_1_10(analysis_a.energy)
+    energy_b_10 = energy_0_1_to_1_10(analysis_b.energy)
+    camelot_a = getattr(analysis_a, "key_camelot", None) or ""
+    camelot_b = getattr(analysis_b, "key_camelot", None) or ""
+    harmonic_dist = harmonic_distance_camelot(camelot_a, camelot_b)
+
+    # Sampler Manager: usar lista precalculada (Sequencer) o llamar get_compatible_samples aquí
+    if compatible_overlays is None:
+        compatible_overlays = []
+        allow_instruments = get_allow_instruments_ai()
+        allow_vocals = get_allow_vocals_ai()
+        if allow_instruments or allow_vocals:
+            avg_bpm = (analysis_a.bpm + analysis_b.bpm) / 2.0
+            camelot_mix = camelot_a or camelot_b or "8A"
+            categories = ["instruments"] if allow_instruments else []
+            if allow_vocals:
+                categories.append("vocals")
+            compatible_overlays = get_compatible_samples(
+                avg_bpm, camelot_mix, categories, bpm_tolerance=5.0, max_camelot_distance=1
+            )
+
+    system_prompt = get_system_prompt()
+    prompt = build_decision_prompt(
+        analysis_a,
+        analysis_b,
+        system_prompt=system_prompt,
+        token_budget=settings.llm_prompt_token_budget,
+        energy_a_10=energy_a_10,
+        energy_b_10=energy_b_10,
+        harmonic_dist=harmonic_dist,
+        sensitivity=get_mix_sensitivity(),
+        dj_style_prompt=dj_style_prompt,
+        audio_metadata_a=audio_metadata_a,
+        audio_metadata_b=audio_metadata_b,
+        track_structure_a=track_structure_a,
+        track_structure_b=track_structure_b,
+        compatible_overlays=compatible_overlays,
+        available_assets=available_assets,
+        cloud_compatible_overlays=cloud_compatible_overlays,
+        only_two_songs=only_two_songs,
+    )
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt.user_content},
+    ]
+    # Mismo prompt armado (par A→B, metadata, estructura, assets) y mismas reglas admin → reusar la decisión
+    cache_key = strategy_cache_key(
+        analysis_a,
+        analysis_b,
+        messages,
+        only_two_songs=only_two_songs,
+        compatible_overlays=compatible_overlays,
+        cloud_compatible_overlays=cloud_compatible_overlays,
+    )
+    cached = get_cached_strategy(cache_key)
+    if cached is not None:
+        log_dj_reasoning(cached, "llm-cache")
+        return cached
+    # Salida estructurada en streaming; si el JSON es inválido, un reintento con repair y luego heurísticas
+    strategy: Optional[MixStrategy] = None
+    for attempt in range(2):
+        try:
+            with stage("llm", model=settings.mix_decision_model, attempt=attempt + 1):
+                raw, prompt_tokens = request_json_object(
+                    client,
+                    model=settings.mix_decision_model,
+                    messages=messages,
+                    response_format=settings.llm_response_format,
+                )
+        except Exception as e:
+            print(f"[decision] LLM call failed: {e}", file=sys.stderr, flush=True)
+            break
+        log_prompt_usage(prompt, prompt_tokens, label="llm" if attempt == 0 else "llm-repair")
+        try:
+            data = parse_strategy_json(raw)
+            strategy = _strategy_from_llm_data(
+                data,
+                analysis_a,
+                analysis_b,
+                compatible_overlays=compatible_overlays,
+                cloud_compatible_overlays=cloud_compatible_overlays,
+                only_two_songs=only_two_songs,
+                energy_a_10=energy_a_10,
+                energy_b_10=energy_b_10,
+                harmonic_dist=harmonic_dist,
+            )
+            break
+        except (ValueError, TypeError) as e:  # JSONDecodeError y ValidationError son ValueError
+            print(f"[decision] invalid LLM output (attempt {attempt + 1}): {e}", file=sys.stderr, flush=True)
+            messages = messages + repair_messages(raw, e)
+
+    if strategy is None:
+        strategy = _heuristic_strategy(analysis_a, analysis_b, intent)
+        log_dj_reasoning(strategy, "heuristic-fallback")
+        return strategy
+
+    store_strategy(cache_key, strategy)
     log_dj_reasoning(strategy, "llm")
     return strategy
@@ -0,0 +1,125 @@
+"""Presupuesto de threads por task: evita la sobresuscripción de CPU entre procesos del pool Celery.
+
+Cada hijo prefork corre ffmpeg (multithread por defecto), Rubber Band y NumPy/numba (BLAS y numba con un pool por
+proceso): con concurrency = núcleos, cada uno abre ~núcleos threads y el box queda con cientos de threads listos.
+El presupuesto es núcleos disponibles / concurrency del worker (mínimo 1), o AUTOMIX_THREAD_BUDGET si se fija:
+
+- ffmpeg: -threads / -filter_threads / -filter_complex_threads (audio.tools lo agrega a cada comando).
+- Rubber Band: --no-threads con presupuesto 1 (usa un thread por canal).
+- BLAS/OpenMP/numba: en caliente con threadpoolctl y numba.set_num_threads. Es lo único que limita el worker:
+  app.tasks importa numpy/librosa antes de worker_init, así que sus pools BLAS/OpenMP ya leyeron el entorno. Las
+  variables de entorno (OMP_NUM_THREADS, ...) solo alcanzan a subprocesos y a librerías que todavía no se
+  inicializaron; sin threadpoolctl, los BLAS ya cargados quedan con un thread por núcleo.
+
+Núcleos disponibles: afinidad del proceso y cuota de cgroup (límite de CPU de Docker), no los del host.
+"""
+from __future__ import annotations
+
+import math
+import os
+import sys
+from typing import Optional
+
+from .config import settings
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# Variables que leen OpenBLAS / MKL / OpenMP / numexpr / Accelerate / numba al inicializarse
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMBA_NUM_THREADS",
+)
+
+_worker_concurrency: Optional[int] = None
+
+
+def _cgroup_cpu_limit() -> Optional[float]:
+    """Cuota de CPU del cgroup (v2 cpu.max o v1 cfs_quota/period); None sin límite."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota_us = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period_us = int(f.read())
+        return quota_us / period_us if quota_us > 0 and period_us > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cores() -> int:
+    """Núcleos usables: AUTOMIX_CPU_CORES, o afinidad del proceso acotada por la cuota de cgroup."""
+    if settings.cpu_cores > 0:
+        return settings.cpu_cores
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cores = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cores = min(cores, max(1, math.ceil(limit)))
+    return max(1, cores)
+
+
+def set_worker_concurrency(concurrency: Optional[int]) -> None:
+    """Concurrency del worker Celery (worker_init, antes del fork: los hijos la heredan)."""
+    global _worker_concurrency
+    _worker_concurrency = int(concurrency) if concurrency else None
+
+
+def thread_budget() -> int:
+    """Threads por task: AUTOMIX_THREAD_BUDGET, o núcleos / concurrency (fuera de Celery, concurrency 1)."""
+    if settings.thread_budget > 0:
+        return settings.thread_budget
+    return max(1, available_cores() // (_worker_concurrency or 1))
+
+
+def ffmpeg_thread_args(cmd: list[str]) -> list[str]:
+    """cmd de ffmpeg con el presupuesto: globales de filtros al principio y -threads antes del archivo de salida."""
+    if "-threads" in cmd or "-filter_threads" in cmd:
+        return cmd  # el caller ya decidió
+    n = str(thread_budget())
+    return [cmd[0], "-filter_threads", n, "-filter_complex_threads", n, *cmd[1:-1], "-threads", n, cmd[-1]]
+
+
+def rubberband_thread_args(cmd: list[str]) -> list[str]:
+    """Rubber Band paraleliza por canal: con presupuesto 1, --no-threads."""
+    if thread_budget() > 1 or "--no-threads" in cmd or "--threads" in cmd:
+        return cmd
+    return [cmd[0], "--no-threads", *cmd[1:]]
+
+
+def apply_thread_limits(budget: Optional[int] = None) -> int:
+    """
+    Limita BLAS/OpenMP/numba del proceso al presupuesto (threadpoolctl para los ya cargados; las variables de
+    entorno, para subprocesos y librerías aún no inicializadas; las que el operador fijó a mano se respetan).
+    Devuelve el presupuesto aplicado.
+    """
+    budget = budget or thread_budget()
+    for var in THREAD_ENV_VARS:
+        os.environ.setdefault(var, str(budget))
+    if threadpool_limits is not None:
+        try:
+            threadpool_limits(limits=budget)
+        except Exception:
+            pass
+    numba = sys.modules.get("numba")
+    if numba is not None:
+        try:
+            numba.set_num_threads(min(budget, numba.config.NUMBA_NUM_THREADS))
+        except Exception:
+            pass
+    return budget
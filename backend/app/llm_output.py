@@ -0,0 +1,260 @@
+"""Salida estructurada del DJ LLM: JSON schema desde MixStrategy, stream parseado incrementalmente, repair.
+
+El LLM devuelve un único objeto JSON. Se pide con response_format json_schema (strict) generado desde
+MixStrategy; si el endpoint OpenAI-compatible no lo soporta se baja a json_object y luego a texto.
+El stream se consume token a token y el objeto se cierra apenas balancean las llaves (no se espera el fin).
+"""
+from __future__ import annotations
+
+import json
+import sys
+from typing import Any, Optional
+
+import openai
+
+from .models import MixStrategy
+
+# Campos que decide el LLM (overlay_paths, overlay_bpms, overlay_entry_sec, etc. se resuelven en decision.py)
+LLM_FIELDS = (
+    "transition_type",
+    "transition_length_bars",
+    "crossfade_sec",
+    "bass_swap_sec",
+    "filter_type",
+    "song_a_stretch_ratio",
+    "song_a_pitch_semitones",
+    "song_a_transition_start_sec",
+    "song_b_stretch_ratio",
+    "song_b_pitch_semitones",
+    "song_b_transition_start_sec",
+    "start_offset_bars",
+    "reasoning",
+    "dj_comment",
+    "fx_chain",
+    "overlay_instrument",
+    "overlay_vocal",
+    "overlay_instrument_url",
+    "overlay_vocal_url",
+)
+
+RESPONSE_FORMATS = ("json_schema", "json_object", "text")
+
+_SCHEMA: Optional[dict[str, Any]] = None
+# Formato que el endpoint aceptó por última vez (se baja una vez y se recuerda en el proceso)
+_ACCEPTED_FORMAT: Optional[str] = None
+# False si el endpoint rechazó stream_options (400): se deja de pedir el usage en el stream
+_STREAM_USAGE = True
+# Chunks que se siguen leyendo tras cerrar el objeto para recibir el de usage (llega después del último de
+# contenido); con response_format el modelo corta ahí. Más que esto = texto de sobra: se corta sin usage
+_USAGE_DRAIN_CHUNKS = 16
+
+
+def _strict_property(prop: dict[str, Any]) -> dict[str, Any]:
+    """Propiedad pydantic → subset soportado por structured outputs strict (type + description, sin defaults/rangos)."""
+    types: list[str] = []
+    for option in prop.get("anyOf") or [prop]:
+        t = option.get("type")
+        if t and t not in types:
+            types.append(t)
+    out: dict[str, Any] = {"type": types[0] if len(types) == 1 else types}
+    if prop.get("description"):
+        out["description"] = prop["description"]
+    return out
+
+
+def decision_json_schema() -> dict[str, Any]:
+    """JSON schema (strict) del objeto de decisión, generado desde MixStrategy.model_json_schema()."""
+    global _SCHEMA
+    if _SCHEMA is None:
+        props = MixStrategy.model_json_schema().get("properties", {})
+        _SCHEMA = {
+            "type": "object",
+            "properties": {name: _strict_property(props[name]) for name in LLM_FIELDS if name in props},
+            "required": [name for name in LLM_FIELDS if name in props],
+            "additionalProperties": False,
+        }
+    return _SCHEMA
+
+
+def response_format_param(fmt: str) -> Optional[dict[str, Any]]:
+    """Parámetro response_format para chat.completions según fmt (json_schema | json_object | text)."""
+    if fmt == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "mix_strategy", "strict": True, "schema": decision_json_schema()},
+        }
+    if fmt == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+class JSONObjectStream:
+    """
+    Parser incremental: recibe fragmentos del stream y detecta el cierre del primer objeto JSON
+    (llaves balanceadas fuera de strings). Ignora texto previo como fences ```json.
+    """
+
+    def __init__(self) -> None:
+        self.raw = ""  # todo lo recibido (para repair / logs)
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start = -1
+        self._end = -1
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Agrega chunk; devuelve el texto del objeto completo apenas cierra, si no None."""
+        if self.done or not chunk:
+            return None
+        offset = len(self.raw)
+        self.raw += chunk
+        for i, ch in enumerate(chunk):
+            if self._start < 0:
+                if ch != "{":
+                    continue
+                self._start = offset + i
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end = offset + i + 1
+                    self.done = True
+                    return self.result()
+        return None
+
+    def result(self) -> str:
+        """Objeto completo si cerró; si no, lo recibido sin fences (para que json.loads dé un error útil)."""
+        if self.done:
+            return self.raw[self._start: self._end]
+        return strip_fences(self.raw)
+
+
+def strip_fences(text: str) -> str:
+    """Quita ```json ... ``` alrededor del objeto (respuestas sin response_format)."""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        lines = text.split("\n")
+        text = "\n".join(lines[1:-1] if lines[-1].strip() == "```" else lines[1:])
+    return text
+
+
+def parse_strategy_json(text: str) -> dict[str, Any]:
+    """json.loads del objeto de decisión; ValueError si no es un objeto JSON."""
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("LLM output is not a JSON object")
+    return data
+
+
+def repair_messages(raw: str, error: Exception) -> list[dict[str, str]]:
+    """Mensajes para el único reintento: la respuesta inválida + el error, pidiendo solo el JSON corregido."""
+    return [
+        {"role": "assistant", "content": raw[-4000:]},
+        {
+            "role": "user",
+            "content": (
+                f"La respuesta anterior no es válida ({type(error).__name__}: {str(error)[:300]}). "
+                "Devolvé SOLO el objeto JSON corregido con los mismos campos, sin markdown."
+            ),
+        },
+    ]
+
+
+def _stream_once(
+    client: Any, model: str, messages: list[dict[str, str]], fmt: str, temperature: float, include_usage: bool = True
+) -> tuple[str, Optional[int]]:
+    """
+    Una llamada en streaming. Devuelve (texto, prompt_tokens). Sin include_usage corta el stream apenas el objeto
+    JSON cierra; con include_usage sigue leyendo (sin parsear) hasta el chunk de usage, que llega al final.
+    """
+    kwargs: dict[str, Any] = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "stream": True,
+    }
+    if include_usage:
+        kwargs["extra_body"] = {"stream_options": {"include_usage": True}}
+    rf = response_format_param(fmt)
+    if rf is not None:
+        kwargs["response_format"] = rf
+    stream = client.chat.completions.create(**kwargs)
+    parser = JSONObjectStream()
+    prompt_tokens: Optional[int] = None
+    drained = 0
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                prompt_tokens = getattr(usage, "prompt_tokens", None)
+                break  # último chunk del stream
+            if parser.done:
+                drained += 1
+                if not include_usage or drained > _USAGE_DRAIN_CHUNKS:
+                    break
+                continue
+            for choice in getattr(chunk, "choices", None) or []:
+                delta = getattr(getattr(choice, "delta", None), "content", None)
+                if delta:
+                    parser.feed(delta)
+            if parser.done and not include_usage:
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+    return parser.result(), prompt_tokens
+
+
+def request_json_object(
+    client: Any,
+    *,
+    model: str,
+    messages: list[dict[str, str]],
+    response_format: str = "json_schema",
+    temperature: float = 0.2,
+) -> tuple[str, Optional[int]]:
+    """
+    Pide el objeto de decisión en streaming. Si el endpoint rechaza stream_options (400), reintenta sin usage;
+    si rechaza response_format, baja json_schema → json_object → text. Ambas elecciones se recuerdan en el proceso.
+    Otros 400 se propagan.
+    """
+    global _ACCEPTED_FORMAT, _STREAM_USAGE
+    preferred = response_format if response_format in RESPONSE_FORMATS else "json_schema"
+    start = _ACCEPTED_FORMAT or preferred
+    formats = RESPONSE_FORMATS[max(RESPONSE_FORMATS.index(start), RESPONSE_FORMATS.index(preferred)):]
+    last_error: Optional[Exception] = None
+    i = 0
+    while i < len(formats):
+        fmt = formats[i]
+        try:
+            result = _stream_once(client, model, messages, fmt, temperature, include_usage=_STREAM_USAGE)
+            _ACCEPTED_FORMAT = fmt
+            return result
+        except openai.BadRequestError as e:
+            last_error = e
+            message = str(e)
+            if _STREAM_USAGE and "stream_options" in message:
+                _STREAM_USAGE = False
+                print(f"[llm] stream_options rechazado ({e}); reintentando sin usage", file=sys.stderr, flush=True)
+                continue
+            if not any(k in message for k in ("response_format", "json_schema", "json_object")):
+                raise
+            print(f"[llm] response_format={fmt} rechazado ({e}); probando siguiente formato", file=sys.stderr, flush=True)
+            i += 1
+    assert last_error is not None
+    raise last_error
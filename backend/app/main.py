@@ -6,24 +6,33 @@ import threading
 import uuid
 from pathlib import Path
 from queue import Empty, Queue
-from typing import Any, Literal, Optional
+from typing import Any, Literal, Optional, Union
 
-from fastapi import BackgroundTasks, Body, FastAPI, File, HTTPException, UploadFile
+from fastapi import BackgroundTasks, Body, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
 from .admin_config import get_admin_config, set_admin_config
 from .analysis import analyze_song
+from .analysis_codec import analysis_ref, load_analysis, store_analysis
 from .audio.analyzer import get_audio_metadata
-from .audio_analyzer import analyze_track_structure
+from .audio.tools import run_tool
+from .audio_analyzer import analyze_track_structure, cached_track_structure
 from .config import settings
 from .decision import get_mix_strategy
+from .memory import accounted, memory_report, memory_stage
+from .metrics import render_latest, session_finished, session_started, stage
 from .models import MixStrategy, SongAnalysis
+from .profiling import get_toggle as get_profiling_toggle, list_profiles, profile_call, profile_path
+from .profiling import set_toggle as set_profiling_toggle
 from .render import render_mix
 from .sequencer import analyze_tracks, build_roadmap, sort_playlist
-from .redis_store import get_job as redis_get_job, set_job as redis_set_job
+from .set_planner import parse_energy_curve
+from .strategy_cache import get_strategy_cache_stats, invalidate_strategy_cache
+from .tracing import bind, current_trace_id, init_tracing, span
+from .redis_store import get_job as redis_get_job, put_segment_plan, set_job as redis_set_job
 
 JobStatus = Literal["processing", "ready", "failed"]
 
@@ -47,6 +56,15 @@ class GenerateStatusResponse(BaseModel):
     strategy: Optional[dict[str, Any]] = None
 
 
+class ProfilingBody(BaseModel):
+    """Body for POST /admin/profiling: toggle the sampling profiler at runtime (expires after ttl_sec)."""
+
+    enabled: bool = True
+    session_ids: Optional[list[str]] = None
+    interval_ms: Optional[float] = None
+    ttl_sec: int = 3600
+
+
 class AdminConfigBody(BaseModel):
     """Body for POST /admin/config: apply admin settings in real time."""
 
@@ -73,6 +91,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Trazas: un span por request (menos polls de status, /metrics y estáticos); es el padre de análisis, decisiones
+# y de los tasks Celery que encola
+_UNTRACED_PREFIXES = ("/metrics", "/health", "/static")
+
+if init_tracing("opus-api"):
+
+    @app.middleware("http")
+    async def _trace_requests(request: Request, call_next):
+        path = request.url.path
+        if path.startswith(_UNTRACED_PREFIXES) or path.endswith("/status"):
+            return await call_next(request)
+        with span(f"{request.method} {path}", **{"http.method": request.method}) as s:
+            response = await call_next(request)
+            route = request.scope.get("route")
+            if s is not None:
+                if route is not None:
+                    s.update_name(f"{request.method} {route.path}")
+                s.set_attribute("http.status_code", response.status_code)
+            return response
+
 # Stateless: solo memoria volátil cuando no hay Redis (two-track)
 _sessions: dict[str, Path] = {}  # session_id -> session_dir
 _job_status: dict[str, JobStatus] = {}
@@ -144,6 +182,7 @@ def _save_upload_to_session(upload: UploadFile, session_id: str, label: str) ->
     return path
 
 
+@profile_call("render_two_track")
 def _run_render_background(
     session_id: str,
     path_a: Path,
@@ -175,6 +214,12 @@ def _run_render_background(
             "strategy": strategy.model_dump(mode="json"),
         }
         if settings.use_celery:
+            # Job JSON liviano (se lee en cada poll): análisis por clave binaria, se expanden en el status
+            for name, analysis in (("analysis_a", analysis_a), ("analysis_b", analysis_b)):
+                key = store_analysis(analysis)
+                if key:
+                    payload.pop(name)
+                    payload[f"{name}_key"] = key
             redis_set_job(session_id, payload)
         else:
             _job_status[session_id] = "ready"
@@ -195,14 +240,15 @@ def _run_render_background(
             _job_error[session_id] = str(e)
             _job_result.pop(session_id, None)
     finally:
+        session_finished(session_id)
         if not succeeded:
             _delete_session_dir(session_id)
 
 
-def _run_folder_pipeline(session_id: str, session_dir: Path) -> None:
+@profile_call("run_folder_pipeline")
+@accounted
+def _run_folder_pipeline(session_id: str, session_dir: Path, energy_curve: Optional[Union[str, list[float]]] = None) -> None:
     """Background: Sequencer Agent en session_dir. Try/finally: si falla, borra session_dir."""
-    import subprocess
-
     def set_phase(phase: str, current: Optional[int] = None, total: Optional[int] = None) -> None:
         job = _folder_jobs.get(session_id)
         if job and job.get("status") == "processing":
@@ -222,6 +268,7 @@ def _run_folder_pipeline(session_id: str, session_dir: Path) -> None:
     set_path = work_dir / "set_final.wav"
     tracklist_path = work_dir / "tracklist.txt"
     succeeded = False
+    session_started(session_id, "set")
     try:
         set_phase("analyzing")
         analyzed = analyze_tracks(paths, sr=settings.default_sr)
@@ -229,40 +276,42 @@ def _run_folder_pipeline(session_id: str, session_dir: Path) -> None:
             _folder_jobs[session_id] = {"status": "failed", "error": "Could not analyze at least 2 tracks"}
             return
         set_phase("sequencing")
-        ordered = sort_playlist(analyzed, energy_curve_ascending=True)
+        ordered = sort_playlist(analyzed, energy_curve_ascending=True, energy_curve=energy_curve)
         roadmap = build_roadmap(ordered)
         total_segments = len(roadmap)
         _folder_jobs[session_id]["total_segments"] = total_segments
         segment_paths: list[Path] = []
         tracklist_lines: list[str] = ["OPUS AI — Tracklist (Set completo)", "=" * 60]
+        structures: dict = {}  # estructura por track (cada track aparece como A y como B)
         for idx, (path_a, path_b, analysis_a, analysis_b) in enumerate(roadmap):
             set_phase("rendering", current=idx + 1, total=total_segments)
             metadata_a = get_audio_metadata(path_a) if path_a.exists() else {}
             metadata_b = get_audio_metadata(path_b) if path_b.exists() else {}
-            try:
-                track_structure_a = analyze_track_structure(path_a, sr=settings.default_sr)
-                track_structure_b = analyze_track_structure(path_b, sr=settings.default_sr)
-            except Exception:
-                track_structure_a = track_structure_b = None
-            strategy = get_mix_strategy(
-                analysis_a,
-                analysis_b,
-                dj_style_prompt=None,
-                audio_metadata_a=metadata_a,
-                audio_metadata_b=metadata_b,
-                track_structure_a=track_structure_a,
-                track_structure_b=track_structure_b,
-            )
+            track_structure_a = cached_track_structure(path_a, structures, sr=settings.default_sr)
+            track_structure_b = cached_track_structure(path_b, structures, sr=settings.default_sr)
+            pair = f"{path_a.name} → {path_b.name}"
+            with memory_stage("decision", segment=idx + 1, track=pair):
+                strategy = get_mix_strategy(
+                    analysis_a,
+                    analysis_b,
+                    dj_style_prompt=None,
+                    audio_metadata_a=metadata_a,
+                    audio_metadata_b=metadata_b,
+                    track_structure_a=track_structure_a,
+                    track_structure_b=track_structure_b,
+                )
             seg_path = work_dir / f"seg_{idx}.wav"
-            render_mix(
-                path_a,
-                path_b,
-                analysis_a,
-                analysis_b,
-                strategy,
-                seg_path,
-                work_dir=work_dir,
-            )
+            with span("render_segment", session_id=session_id, segment=idx + 1), \
+                    memory_stage("render", segment=idx + 1, track=pair):
+                render_mix(
+                    path_a,
+                    path_b,
+                    analysis_a,
+                    analysis_b,
+                    strategy,
+                    seg_path,
+                    work_dir=work_dir,
+                )
             segment_paths.append(seg_path)
             tracklist_lines.append("")
             tracklist_lines.append(f"#{idx + 1}  A: {path_a.name}  →  B: {path_b.name}")
@@ -279,11 +328,10 @@ def _run_folder_pipeline(session_id: str, session_dir: Path) -> None:
             for p in segment_paths:
                 path_str = str(p.resolve()).replace("\\", "/")
                 f.write(f"file '{path_str}'\n")
-        subprocess.run(
-            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list), "-c", "copy", str(set_path)],
-            check=True,
-            capture_output=True,
-        )
+        with stage("concat"):
+            run_tool(
+                ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list), "-c", "copy", str(set_path)]
+            )
         for p in segment_paths:
             try:
                 p.unlink()
@@ -300,6 +348,7 @@ def _run_folder_pipeline(session_id: str, session_dir: Path) -> None:
     except Exception as e:
         _folder_jobs[session_id] = {"status": "failed", "error": str(e)}
     finally:
+        session_finished(session_id)
         if not succeeded:
             _delete_session_dir(session_id)
 
@@ -370,6 +419,7 @@ def _get_two_track_paths(session_id: str) -> tuple[Optional[Path], Optional[Path
 
 
 @app.post("/generate/{session_id}")
+@profile_call("generate")
 async def generate_mix(
     session_id: str,
     background_tasks: BackgroundTasks,
@@ -422,29 +472,59 @@ async def generate_mix(
         print(f"[DJ] {strategy.dj_comment}", flush=True)
 
     if settings.use_celery:
+        # Render en audio-worker (cola audio_interactive, prioridad alta: no espera detrás de sets largos)
+        from .celery_app import PRIORITY_INTERACTIVE
+        from .tasks import render_two_track, strategy_payload
+
         redis_set_job(session_id, {"status": "processing", "session_dir": str(session_dir)})
+        plan_key = put_segment_plan(session_id, {
+            "path_a": str(path_a),
+            "path_b": str(path_b),
+            "analysis_a": analysis_ref(analysis_a),
+            "analysis_b": analysis_ref(analysis_b),
+            "strategy": strategy_payload(strategy),
+            "work_dir": str(session_dir),
+        })
+        if plan_key is None:
+            raise HTTPException(503, "Could not queue render (Redis unavailable)")
+        session_started(session_id, "generate")
+        render_two_track.apply_async((session_id, plan_key), priority=PRIORITY_INTERACTIVE)
     else:
         _job_status[session_id] = "processing"
         _job_result.pop(session_id, None)
         _job_error.pop(session_id, None)
+        session_started(session_id, "generate")
+        background_tasks.add_task(
+            bind("render_two_track", _run_render_background, session_id=session_id),
+            session_id,
+            path_a,
+            path_b,
+            analysis_a,
+            analysis_b,
+            strategy,
+            session_dir,
+        )
 
-    background_tasks.add_task(
-        _run_render_background,
-        session_id,
-        path_a,
-        path_b,
-        analysis_a,
-        analysis_b,
-        strategy,
-        session_dir,
-    )
-
-    return {
+    response = {
         "session_id": session_id,
         "status": "processing",
         "status_url": f"/generate/{session_id}/status",
         "download_url": f"/download/{session_id}",
     }
+    trace_id = current_trace_id()
+    if trace_id:
+        response["trace_id"] = trace_id
+    return response
+
+
+def _job_analysis(key: Optional[str]) -> Optional[dict[str, Any]]:
+    """Análisis guardado por clave (analysis_codec) como dict JSON para la respuesta; None si expiró."""
+    if not key:
+        return None
+    try:
+        return load_analysis(key).model_dump(mode="json", exclude={"path"})
+    except KeyError:
+        return None
 
 
 @app.get("/generate/{session_id}/status", response_model=GenerateStatusResponse)
@@ -460,8 +540,8 @@ def get_generate_status(session_id: str) -> GenerateStatusResponse:
             status=status,
             download_url=f"/download/{session_id}" if status == "ready" else None,
             error=job.get("error"),
-            analysis_a=job.get("analysis_a"),
-            analysis_b=job.get("analysis_b"),
+            analysis_a=job.get("analysis_a") or _job_analysis(job.get("analysis_a_key")),
+            analysis_b=job.get("analysis_b") or _job_analysis(job.get("analysis_b_key")),
             strategy=job.get("strategy"),
         )
     if session_id not in _sessions and session_id not in _job_status:
@@ -523,6 +603,11 @@ def download_mix(session_id: str) -> StreamingResponse:
 async def process_folder(
     background_tasks: BackgroundTasks,
     files: list[UploadFile] = File(..., description="Tracks para el set (mín. 2)"),
+    energy_curve: Optional[str] = Form(
+        None,
+        description="Forma del set: ascending, descending, flat, warmup, peak, closing, warmup_peak_cooldown "
+        "o intensidades 0-1 separadas por coma (ej. 0.2,0.6,1,0.5)",
+    ),
 ) -> dict:
     """
     Sequencer Agent: sube múltiples tracks a un directorio temporal por sesión.
@@ -531,6 +616,10 @@ async def process_folder(
     """
     if len(files) < 2:
         raise HTTPException(400, "Enviá al menos 2 archivos de audio")
+    try:
+        curve = parse_energy_curve(energy_curve)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     session_id = str(uuid.uuid4())
     session_dir = _get_or_create_session_dir(session_id)
     paths: list[Path] = []
@@ -553,18 +642,24 @@ async def process_folder(
     if settings.use_celery:
         redis_set_job(session_id, {"status": "processing", "phase": "analyzing", "session_dir": str(session_dir)})
         from .tasks import run_folder_pipeline
-        run_folder_pipeline.delay(session_id, str(session_dir))
+        run_folder_pipeline.delay(session_id, str(session_dir), curve)
     else:
         _folder_jobs[session_id] = {"status": "processing", "session_dir": str(session_dir)}
-        background_tasks.add_task(_run_folder_pipeline, session_id, session_dir)
+        background_tasks.add_task(
+            bind("run_folder_pipeline", _run_folder_pipeline, session_id=session_id), session_id, session_dir, curve
+        )
 
-    return {
+    response = {
         "session_id": session_id,
         "status": "processing",
         "status_url": f"/process-folder/{session_id}/status",
         "set_url": f"/process-folder/{session_id}/set",
         "tracklist_url": f"/process-folder/{session_id}/tracklist",
     }
+    trace_id = current_trace_id()
+    if trace_id:
+        response["trace_id"] = trace_id  # para buscar la traza (scripts/trace_waterfall.py --trace, Jaeger)
+    return response
 
 
 def _folder_job_for(session_id: str) -> Optional[dict]:
@@ -580,8 +675,11 @@ def _folder_job_for(session_id: str) -> Optional[dict]:
 
 
 @app.get("/process-folder/{session_id}/status")
-def get_process_folder_status(session_id: str) -> dict:
-    """Estado del job de process-folder. phase: analyzing | sequencing | rendering | finalizing."""
+def get_process_folder_status(session_id: str, memory_stages: bool = False) -> dict:
+    """
+    Estado del job de process-folder. phase: analyzing | sequencing | rendering | finalizing.
+    memory_stages=true agrega todos los registros de memoria por etapa (por defecto solo by_stage y running).
+    """
     job = _folder_job_for(session_id)
     if job is None:
         raise HTTPException(404, "Session not found")
@@ -596,6 +694,8 @@ def get_process_folder_status(session_id: str) -> dict:
         "error": job.get("error"),
         "dj_comment": job.get("last_dj_comment"),
         "cloud_samples_used": job.get("cloud_samples_used"),
+        # Memoria por etapa (pico de RSS, buffers NumPy, tracemalloc): by_stage, running (+ stages con el flag)
+        "memory": memory_report(session_id, include_stages=memory_stages),
     }
 
 
@@ -643,6 +743,16 @@ def health() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics() -> Response:
+    """Métricas Prometheus (latencia por etapa, caches, sesiones en curso, colas). 404 si están desactivadas."""
+    latest = render_latest()
+    if latest is None:
+        raise HTTPException(404, "Metrics disabled (AUTOMIX_METRICS_ENABLED / prometheus_client)")
+    body, content_type = latest
+    return Response(content=body, media_type=content_type)
+
+
 # ---------------------------------------------------------------------------
 # Admin panel: config in real time (no restart)
 # ---------------------------------------------------------------------------
@@ -676,6 +786,50 @@ def admin_update_config(body: Optional[AdminConfigBody] = Body(default=None)) ->
     return admin_post_config(body)
 
 
+@app.get("/admin/strategy-cache")
+def admin_strategy_cache_stats() -> dict:
+    """Métricas del cache de strategies LLM: hits, misses, hit_rate, entries, evictions."""
+    return get_strategy_cache_stats()
+
+
+@app.post("/admin/strategy-cache/clear")
+def admin_strategy_cache_clear() -> dict:
+    """Vacía el cache de strategies (fuerza nuevas llamadas al LLM)."""
+    removed = invalidate_strategy_cache()
+    return {"removed": removed, **get_strategy_cache_stats()}
+
+
+@app.get("/admin/profiling")
+def admin_get_profiling() -> dict:
+    """Toggle vigente del profiler (env o admin) y cantidad de perfiles guardados."""
+    return {**get_profiling_toggle(use_cache=False), "profiles": len(list_profiles())}
+
+
+@app.post("/admin/profiling")
+def admin_set_profiling(body: ProfilingBody = Body(...)) -> dict:
+    """Prende/apaga el profiler en caliente (API y workers, vía Redis); vuelve a lo de env tras ttl_sec."""
+    try:
+        return set_profiling_toggle(body.enabled, body.session_ids, body.interval_ms, body.ttl_sec)
+    except RuntimeError as e:
+        raise HTTPException(503, str(e))
+
+
+@app.get("/admin/profiles")
+def admin_list_profiles(session_id: Optional[str] = None) -> dict:
+    """Perfiles guardados (más nuevos primero); filtrar con ?session_id=."""
+    return {"profiles": list_profiles(session_id)}
+
+
+@app.get("/admin/profiles/{session_id}/{name}")
+def admin_download_profile(session_id: str, name: str) -> FileResponse:
+    """Descarga un perfil (.collapsed: flamegraph.pl / speedscope) o su .json de metadatos."""
+    path = profile_path(session_id, name)
+    if path is None:
+        raise HTTPException(404, "Profile not found")
+    media_type = "application/json" if name.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=name)
+
+
 # ---------------------------------------------------------------------------
 # Socket.IO: real-time progress (workers publish to Redis, API forwards to client)
 # ---------------------------------------------------------------------------
@@ -0,0 +1,310 @@
+"""Contabilidad de memoria por etapa del pipeline (load, key, beat, features, structure, decision, render).
+
+Cada memory_stage registra, para la sesión en curso: pico de RSS del proceso en la etapa (VmHWM, reseteado al
+entrar vía /proc/self/clear_refs), delta/pico de asignaciones Python (tracemalloc, opcional: incluye buffers
+NumPy), el nbytes de los arrays grandes que la etapa declara con track_buffers y el pico de RSS de subprocesos
+(rubberband/ffmpeg) si creció. El registro se escribe al entrar (state "running") y se completa al salir: si el
+worker muere por OOM, el job queda con la etapa y el track que estaba corriendo. Se guarda junto al job (Redis, o
+en memoria sin Redis) y se ve en GET /process-folder/{id}/status.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Iterator, Optional
+
+from .config import settings
+
+try:
+    import resource
+except ImportError:  # Windows: sin getrusage (solo VmRSS/VmHWM, que tampoco existen: registros sin picos)
+    resource = None  # type: ignore[assignment]
+
+_MB = 1024.0 * 1024.0
+# Tasks Celery cuyas etapas se registran en el job de la sesión (args[0] = session_id)
+ACCOUNTED_TASKS = ("run_folder_pipeline", "render_segment")
+# Sin Redis: registros por sesión en memoria (las más viejas se descartan)
+_LOCAL_MAX_SESSIONS = 100
+
+_session: ContextVar[Optional[str]] = ContextVar("memory_session", default=None)
+_current: ContextVar[Optional["_Stage"]] = ContextVar("memory_stage", default=None)
+_task_tokens: dict[str, Any] = {}
+_local_records: dict[str, dict[str, dict[str, Any]]] = {}
+_seq = 0
+_clear_refs_ok: Optional[bool] = None
+# Sesiones con contabilidad activas en el proceso. clear_refs y tracemalloc.reset_peak son de todo el proceso:
+# con más de una (API sin Redis, pipelines en el threadpool) los deltas no son atribuibles a una etapa
+_active_lock = threading.Lock()
+_active_sessions = 0
+_session_starts = 0
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+    """VmRSS / VmHWM de /proc/self/status en MB (None fuera de Linux)."""
+    try:
+        with open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(field.encode() + b":"):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def rss_mb() -> Optional[float]:
+    return _proc_status_mb("VmRSS")
+
+
+def peak_rss_mb() -> float:
+    """Pico de RSS del proceso (desde el arranque o el último reset_peak_rss)."""
+    hwm = _proc_status_mb("VmHWM")
+    if hwm is not None:
+        return hwm
+    if resource is None:
+        return 0.0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (_MB if sys.platform == "darwin" else 1024.0)
+
+
+def reset_peak_rss() -> bool:
+    """Resetea VmHWM al RSS actual (Linux >= 4.0). False si no se puede: el pico queda desde el arranque."""
+    global _clear_refs_ok
+    if _clear_refs_ok is False:
+        return False
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        _clear_refs_ok = True
+    except OSError:
+        _clear_refs_ok = False
+    return bool(_clear_refs_ok)
+
+
+def _children_peak_mb() -> float:
+    if resource is None:
+        return 0.0
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss / (_MB if sys.platform == "darwin" else 1024.0)
+
+
+def _enter_session() -> None:
+    global _active_sessions, _session_starts
+    with _active_lock:
+        _active_sessions += 1
+        _session_starts += 1
+
+
+def _leave_session() -> None:
+    global _active_sessions
+    with _active_lock:
+        _active_sessions -= 1
+
+
+def _exclusive_mark() -> Optional[int]:
+    """Marca si esta es la única sesión activa (None si hay otras); igual al salir = nadie se cruzó."""
+    with _active_lock:
+        return _session_starts if _active_sessions == 1 else None
+
+
+def _mb(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 1)
+
+
+class _Stage:
+    """Una etapa en curso: acumula picos de las etapas anidadas (que resetean los contadores al entrar)."""
+
+    def __init__(self, name: str, labels: dict[str, Any], parent: Optional["_Stage"]):
+        global _seq
+        _seq += 1
+        self.field = f"{os.getpid()}:{_seq}"
+        self.name = name
+        self.labels = labels
+        self.parent = parent
+        self.buffers: dict[str, int] = {}
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        if parent is not None:
+            parent._fold_peaks()  # el reset de abajo borra el pico que llevaba la etapa de afuera
+        self.exclusive_mark = _exclusive_mark()
+        self.rss_start = rss_mb()
+        self.rss_peak = self.rss_start or 0.0
+        self.peak_reset = reset_peak_rss()
+        self.children_start = _children_peak_mb()
+        self.py_start: Optional[int] = None
+        self.py_peak = 0
+        if tracemalloc.is_tracing():
+            self.py_start = tracemalloc.get_traced_memory()[0]
+            self.py_peak = self.py_start
+            tracemalloc.reset_peak()
+
+    def _fold_peaks(self) -> None:
+        self.rss_peak = max(self.rss_peak, peak_rss_mb())
+        if self.py_start is not None:
+            self.py_peak = max(self.py_peak, tracemalloc.get_traced_memory()[1])
+
+    def add_buffers(self, arrays: dict[str, Any]) -> None:
+        for name, arr in arrays.items():
+            nbytes = getattr(arr, "nbytes", None)
+            if nbytes is not None:
+                self.buffers[name] = self.buffers.get(name, 0) + int(nbytes)
+
+    def record(self, state: str) -> dict[str, Any]:
+        record: dict[str, Any] = {
+            "stage": self.name,
+            **self.labels,
+            "state": state,
+            "pid": os.getpid(),
+            "started_at": round(self.started_at, 3),
+            "rss_start_mb": _mb(self.rss_start),
+        }
+        if state == "running":
+            return record
+        self._fold_peaks()
+        rss_end = rss_mb()
+        # Otra sesión en el proceso durante la etapa: sus resets y asignaciones se mezclan con los de esta
+        exclusive = self.exclusive_mark is not None and _exclusive_mark() == self.exclusive_mark
+        record.update({
+            "duration_sec": round(time.perf_counter() - self._t0, 3),
+            "rss_end_mb": _mb(rss_end),
+            "peak_rss_mb": _mb(self.rss_peak),
+            # Sin clear_refs el pico es el del proceso (no solo la etapa): el delta no es atribuible
+            "peak_rss_delta_mb": _mb(self.rss_peak - self.rss_start)
+            if exclusive and self.peak_reset and self.rss_start is not None else None,
+            "numpy_mb": _mb(sum(self.buffers.values()) / _MB) if self.buffers else None,
+            "buffers_mb": {k: round(v / _MB, 2) for k, v in self.buffers.items()} or None,
+        })
+        if exclusive and self.py_start is not None and tracemalloc.is_tracing():
+            current = tracemalloc.get_traced_memory()[0]
+            record["py_alloc_delta_mb"] = _mb((current - self.py_start) / _MB)
+            record["py_peak_delta_mb"] = _mb((self.py_peak - self.py_start) / _MB)
+        children_peak = _children_peak_mb()
+        if children_peak > self.children_start:
+            record["child_peak_rss_mb"] = _mb(children_peak)  # ru_maxrss de hijos: solo crece
+        if self.parent is not None:
+            self.parent.rss_peak = max(self.parent.rss_peak, self.rss_peak)
+            self.parent.py_peak = max(self.parent.py_peak, self.py_peak)
+        return record
+
+
+def _store(session_id: str, field: str, record: dict[str, Any]) -> None:
+    if settings.use_celery:
+        from .redis_store import put_memory_record
+
+        put_memory_record(session_id, field, record)
+        return
+    records = _local_records.setdefault(session_id, {})
+    records[field] = record
+    while len(_local_records) > _LOCAL_MAX_SESSIONS:
+        _local_records.pop(next(iter(_local_records)))
+
+
+@contextmanager
+def memory_stage(name: str, **labels: Any) -> Iterator[Optional[_Stage]]:
+    """
+    Registra la memoria de la etapa en el job de la sesión en curso (session_scope o task Celery).
+    No-op fuera de una sesión o con AUTOMIX_MEMORY_ACCOUNTING_ENABLED=false (yield None).
+    """
+    session_id = _session.get()
+    if session_id is None or not settings.memory_accounting_enabled:
+        yield None
+        return
+    if settings.memory_tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    mem = _Stage(name, labels, _current.get())
+    token = _current.set(mem)
+    _store(session_id, mem.field, mem.record("running"))
+    state = "done"
+    try:
+        yield mem
+    except BaseException:
+        state = "failed"
+        raise
+    finally:
+        _current.reset(token)
+        _store(session_id, mem.field, mem.record(state))
+
+
+def track_buffers(**arrays: Any) -> None:
+    """Declara arrays grandes creados en la etapa en curso (se suma su nbytes). No-op sin etapa."""
+    mem = _current.get()
+    if mem is not None:
+        mem.add_buffers(arrays)
+
+
+@contextmanager
+def session_scope(session_id: str) -> Iterator[None]:
+    """Las memory_stage del bloque se registran en el job de session_id."""
+    token = _session.set(session_id)
+    _enter_session()
+    try:
+        yield
+    finally:
+        _leave_session()
+        _session.reset(token)
+
+
+def accounted(fn: Callable) -> Callable:
+    """Decorador: session_scope con el primer argumento (session_id) de fn."""
+    @wraps(fn)
+    def wrapper(session_id: str, *args: Any, **kwargs: Any) -> Any:
+        with session_scope(session_id):
+            return fn(session_id, *args, **kwargs)
+    return wrapper
+
+
+# Celery: task_prerun / task_postrun (mismo patrón que tracing/profiling)
+def task_started(task_id: Optional[str], task: Any, args: Optional[tuple]) -> None:
+    name = str(getattr(task, "name", "")).rsplit(".", 1)[-1]
+    if task_id and name in ACCOUNTED_TASKS and args and isinstance(args[0], str):
+        _task_tokens[task_id] = _session.set(args[0])
+        _enter_session()
+
+
+def task_finished(task_id: Optional[str]) -> None:
+    token = _task_tokens.pop(task_id or "", None)
+    if token is not None:
+        _leave_session()
+        _session.reset(token)
+
+
+def memory_report(session_id: str, include_stages: bool = False) -> Optional[dict[str, Any]]:
+    """
+    Resumen por etapa: el mayor crecimiento de RSS (pico del proceso si el delta no es atribuible) y el
+    track/segmento donde se dio, para fijar límites por etapa; running: etapas en curso (o de un worker muerto).
+    include_stages: además todos los registros en orden de inicio (~7 por track + 2 por segmento).
+    None si no hay registros.
+    """
+    if settings.use_celery:
+        from .redis_store import get_memory_records
+
+        records = get_memory_records(session_id)
+    else:
+        records = list(_local_records.get(session_id, {}).values())
+    if not records:
+        return None
+    records.sort(key=lambda r: r.get("started_at") or 0)
+    by_stage: dict[str, dict[str, Any]] = {}
+    for r in records:
+        peak = r.get("peak_rss_mb")
+        if peak is None:
+            continue
+        # RSS absoluto de un worker de larga vida solo crece: se compara lo que la etapa sumó
+        growth = r.get("peak_rss_delta_mb")
+        score = (growth is not None, peak if growth is None else growth)  # deltas antes que picos absolutos
+        best = by_stage.get(r["stage"])
+        if best is None or score > best["_score"]:
+            labels = {k: r[k] for k in ("track", "segment") if k in r}
+            by_stage[r["stage"]] = {"_score": score, "peak_rss_mb": peak, "peak_rss_delta_mb": growth, **labels}
+    for summary in by_stage.values():
+        del summary["_score"]
+    running = [r for r in records if r.get("state") == "running"]
+    report: dict[str, Any] = {"by_stage": by_stage, "running": running or None}
+    if include_stages:
+        report["stages"] = records
+    return report
@@ -0,0 +1,217 @@
+"""Métricas Prometheus (opcional: sin prometheus_client todo es no-op).
+
+- opus_stage_seconds{stage}: latencia por etapa (decode, features, key, beats, structure, llm, rubberband,
+  ffmpeg_mix, concat, download). opus_stage_failures_total{stage}: excepciones dentro de la etapa.
+- opus_cache_events_total{cache, result}: strategy / sample / stem / analysis con hit, miss, stale, error.
+- opus_tool_seconds{tool, outcome}: cada ffmpeg / ffprobe / rubberband (ok, error, timeout);
+  opus_tool_slot_wait_seconds{tool}: espera por un slot del semáforo global (audio.tools).
+- opus_inflight_sessions{kind} y opus_queue_depth{queue}: se leen de Redis al scrapear (colector propio).
+
+API: GET /metrics. Workers Celery (prefork): PROMETHEUS_MULTIPROC_DIR + AUTOMIX_METRICS_WORKER_PORT levanta un
+exporter HTTP en el proceso principal que agrega los archivos de todos los hijos.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Histogram
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+from .config import settings
+from .tracing import span
+
+# Buckets en segundos: desde lecturas de cache (ms) hasta renders/LLM largos (minutos)
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Colas Celery (con priority_steps, kombu usa "<cola>" para prioridad 0 y "<cola>:<n>" para el resto)
+QUEUES = ("audio_interactive", "audio_worker", "ai_brain")
+_PRIORITY_STEPS = range(1, 10)
+
+_local_inflight: dict[str, set[str]] = {}
+
+if prometheus_client is not None:
+    STAGE_SECONDS = Histogram("opus_stage_seconds", "Duración por etapa del pipeline", ["stage"], buckets=_BUCKETS)
+    STAGE_FAILURES = Counter("opus_stage_failures_total", "Excepciones por etapa", ["stage"])
+    CACHE_EVENTS = Counter("opus_cache_events_total", "Eventos de cache", ["cache", "result"])
+    TOOL_SECONDS = Histogram(
+        "opus_tool_seconds", "Duración de herramientas externas", ["tool", "outcome"], buckets=_BUCKETS
+    )
+    TOOL_SLOT_WAIT = Histogram(
+        "opus_tool_slot_wait_seconds", "Espera por un slot de herramienta externa", ["tool"], buckets=_BUCKETS
+    )
+
+
+def enabled() -> bool:
+    return prometheus_client is not None and settings.metrics_enabled
+
+
+@contextmanager
+def stage(name: str, **attrs: Any) -> Iterator[None]:
+    """
+    Mide la etapa (histograma) y cuenta la falla si sale con excepción. Con tracing, además es un span name
+    (attrs van como atributos del span, no como labels).
+    """
+    with span(name, **attrs):
+        if not enabled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            STAGE_FAILURES.labels(name).inc()
+            raise
+        finally:
+            STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable:
+    """Decorador: la función entera como etapa name (y span, con tracing)."""
+    def deco(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def cache_event(cache: str, result: str) -> None:
+    if enabled():
+        CACHE_EVENTS.labels(cache, result).inc()
+
+
+def tool_finished(tool: str, outcome: str, seconds: float, wait_seconds: float) -> None:
+    if enabled():
+        TOOL_SECONDS.labels(tool, outcome).observe(seconds)
+        TOOL_SLOT_WAIT.labels(tool).observe(wait_seconds)
+
+
+# ---------------------------------------------------------------------------
+# Sesiones en curso (Redis si está configurado: la sesión empieza en un proceso y termina en otro)
+# ---------------------------------------------------------------------------
+
+def session_started(session_id: str, kind: str) -> None:
+    """kind: 'set' (process-folder) o 'generate' (dos tracks)."""
+    from .redis_store import inflight_add
+
+    if not inflight_add(session_id, kind):
+        _local_inflight.setdefault(kind, set()).add(session_id)
+
+
+def session_finished(session_id: str) -> None:
+    from .redis_store import inflight_remove
+
+    if not inflight_remove(session_id):
+        for ids in _local_inflight.values():
+            ids.discard(session_id)
+
+
+def queue_depths() -> Optional[dict[str, int]]:
+    """Mensajes esperando por cola Celery (suma de niveles de prioridad); None sin Redis."""
+    from .redis_store import list_lengths
+
+    keys = {q: [q] + [f"{q}:{p}" for p in _PRIORITY_STEPS] for q in QUEUES}
+    lengths = list_lengths([k for ks in keys.values() for k in ks])
+    if lengths is None:
+        return None
+    return {q: sum(lengths.get(k, 0) for k in ks) for q, ks in keys.items()}
+
+
+class _RedisGaugeCollector:
+    """Gauges calculados al scrapear: sesiones en curso y largo de colas Celery (LLEN por nivel de prioridad)."""
+
+    def collect(self):
+        from .redis_store import inflight_counts
+
+        inflight = GaugeMetricFamily("opus_inflight_sessions", "Sesiones en curso", labels=["kind"])
+        counts = inflight_counts()
+        if counts is None:
+            counts = {kind: len(ids) for kind, ids in _local_inflight.items()}
+        for kind in ("set", "generate"):
+            inflight.add_metric([kind], counts.get(kind, 0))
+        yield inflight
+
+        depths = queue_depths()
+        if depths is not None:
+            depth = GaugeMetricFamily("opus_queue_depth", "Mensajes esperando en la cola Celery", labels=["queue"])
+            for q, n in depths.items():
+                depth.add_metric([q], n)
+            yield depth
+
+
+def _registry():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+
+class _Exposition:
+    """Métricas del registry + gauges de Redis (solo al exponer: el exporter del worker no los repite)."""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def collect(self):
+        yield from self.registry.collect()
+        yield from _RedisGaugeCollector().collect()
+
+
+def render_latest() -> Optional[tuple[bytes, str]]:
+    """(cuerpo, content-type) para GET /metrics; None si las métricas están desactivadas."""
+    if not enabled():
+        return None
+    return prometheus_client.generate_latest(_Exposition(_registry())), prometheus_client.CONTENT_TYPE_LATEST
+
+
+# ---------------------------------------------------------------------------
+# Workers Celery
+# ---------------------------------------------------------------------------
+
+def prepare_multiprocess_dir() -> None:
+    """Al iniciar el worker (antes del fork): vacía PROMETHEUS_MULTIPROC_DIR de corridas anteriores."""
+    d = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not d or prometheus_client is None:
+        return
+    path = Path(d)
+    if path.exists():
+        shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True, exist_ok=True)
+
+
+def start_worker_exporter() -> None:
+    """Exporter HTTP del worker en AUTOMIX_METRICS_WORKER_PORT (0 = apagado)."""
+    port = int(settings.metrics_worker_port or 0)
+    if port <= 0 or not enabled():
+        return
+    try:
+        prometheus_client.start_http_server(port, registry=_registry())
+        print(f"[metrics] exporter del worker en :{port}", file=sys.stderr, flush=True)
+    except OSError as e:
+        print(f"[metrics] no se pudo abrir :{port}: {e}", file=sys.stderr, flush=True)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Al salir un hijo del pool: sus gauges live* dejan de contar (histogramas/counters se conservan)."""
+    if prometheus_client is None or not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return
+    from prometheus_client import multiprocess
+
+    try:
+        multiprocess.mark_process_dead(pid)
+    except OSError:
+        pass
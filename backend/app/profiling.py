@@ -0,0 +1,324 @@
+"""Profiling opt-in por task: muestreo del stack del thread que corre el task (sin dependencias).
+
+Se activa por env (AUTOMIX_PROFILING_ENABLED, ..._SESSION_IDS, ..._INTERVAL_MS) o en caliente con
+POST /admin/profiling (Redis, con TTL: los workers lo ven sin reiniciar). Perfilados: run_folder_pipeline,
+render_segment, finalize_set y render_two_track (hooks task_prerun/task_postrun de Celery) y, en la API,
+POST /generate y los pipelines en background del modo sin Redis.
+
+Un thread daemon toma sys._current_frames() cada interval_ms y cuenta stacks del thread objetivo: tiempo de reloj
+(también cuenta la espera de subprocesos/IO, que es donde suele irse el tiempo de un set). Salida en
+profiling_dir/<session_id>/: <task>-<fecha>-<pid>.collapsed (formato "stack;colapsado N" de flamegraph.pl y
+speedscope) + .json con metadatos. Con el toggle apagado el costo es un chequeo de bool (y un GET a Redis cada
+_TOGGLE_CACHE_SEC por proceso).
+"""
+from __future__ import annotations
+
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from .config import settings
+
+REDIS_KEY_PROFILING = "opus:profiling"
+# Tasks Celery perfilables (nombre corto)
+PROFILED_TASKS = ("run_folder_pipeline", "render_segment", "finalize_set", "render_two_track")
+_TOGGLE_CACHE_SEC = 5.0
+_MIN_INTERVAL_MS = 1.0
+
+_toggle_cache: Optional[tuple[float, dict[str, Any]]] = None
+# Sin Redis: toggle del admin en memoria del proceso (API local)
+_local_toggle: Optional[dict[str, Any]] = None
+# Profilers de tasks Celery en curso: task_id -> (profiler, session_id, task)
+_task_profilers: dict[str, tuple["_Sampler", str, str]] = {}
+
+
+def profiles_dir() -> Path:
+    """Directorio de perfiles (por defecto base_dir/.profiles; las sesiones se borran al descargar)."""
+    if settings.profiling_dir.strip():
+        return Path(settings.profiling_dir.strip())
+    return settings.base_dir / ".profiles"
+
+
+def _session_list(value: Any) -> list[str]:
+    if isinstance(value, str):
+        value = value.split(",")
+    return [s.strip() for s in value or [] if str(s).strip()]
+
+
+def _env_toggle() -> dict[str, Any]:
+    return {
+        "enabled": bool(settings.profiling_enabled),
+        "session_ids": _session_list(settings.profiling_session_ids),
+        "interval_ms": float(settings.profiling_interval_ms),
+        "source": "env",
+    }
+
+
+def get_toggle(use_cache: bool = True) -> dict[str, Any]:
+    """Toggle vigente: el del admin (Redis o memoria) si existe y no expiró, si no el de env."""
+    global _toggle_cache
+    now = time.monotonic()
+    if use_cache and _toggle_cache is not None and _toggle_cache[0] > now:
+        return _toggle_cache[1]
+    toggle = _env_toggle()
+    admin: Optional[dict[str, Any]] = None
+    if settings.use_celery:
+        from .redis_store import get_blob
+
+        raw = get_blob(REDIS_KEY_PROFILING)
+        if raw:
+            try:
+                admin = json.loads(raw)
+            except ValueError:
+                admin = None
+    elif _local_toggle is not None and _local_toggle.get("expires_at", 0) > time.time():
+        admin = _local_toggle
+    if admin is not None:
+        toggle = {**toggle, **{k: admin[k] for k in ("enabled", "session_ids", "interval_ms", "expires_at")
+                               if k in admin}, "source": "admin"}
+    _toggle_cache = (now + _TOGGLE_CACHE_SEC, toggle)
+    return toggle
+
+
+def set_toggle(enabled: bool, session_ids: Optional[list[str]] = None, interval_ms: Optional[float] = None,
+               ttl_sec: int = 3600) -> dict[str, Any]:
+    """Toggle del admin (pisa env hasta que expira). RuntimeError si no se pudo guardar en Redis."""
+    global _local_toggle, _toggle_cache
+    ttl_sec = max(1, int(ttl_sec))
+    data = {
+        "enabled": bool(enabled),
+        "session_ids": _session_list(session_ids),
+        "interval_ms": max(_MIN_INTERVAL_MS, float(interval_ms or settings.profiling_interval_ms)),
+        "expires_at": time.time() + ttl_sec,
+    }
+    if settings.use_celery:
+        from .redis_store import set_blob
+
+        if not set_blob(REDIS_KEY_PROFILING, json.dumps(data).encode("utf-8"), ttl_sec):
+            raise RuntimeError("Could not store profiling toggle (Redis unavailable)")
+    else:
+        _local_toggle = data
+    _toggle_cache = None
+    return get_toggle(use_cache=False)
+
+
+def should_profile(session_id: Optional[str]) -> Optional[float]:
+    """Intervalo de muestreo (s) si hay que perfilar esta sesión; None si no."""
+    if not settings.profiling_enabled and not settings.use_celery and _local_toggle is None:
+        return None  # camino rápido: nada que consultar
+    toggle = get_toggle()
+    if not toggle.get("enabled"):
+        return None
+    targets = toggle.get("session_ids") or []
+    if targets and session_id not in targets:
+        return None
+    return max(_MIN_INTERVAL_MS, float(toggle.get("interval_ms") or settings.profiling_interval_ms)) / 1000.0
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    """Path corto para el label del frame: relativo a site-packages o a la raíz del proyecto."""
+    for marker in ("site-packages/", "dist-packages/"):
+        i = filename.rfind(marker)
+        if i >= 0:
+            return filename[i + len(marker):]
+    root = str(settings.base_dir.parent)
+    if filename.startswith(root):
+        return filename[len(root):].lstrip("/")
+    return filename
+
+
+def _collapse(frame: Any) -> str:
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ","))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class _Sampler(threading.Thread):
+    """Muestrea el stack de un thread cada interval segundos hasta stop()."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="opus-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.duration = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+                self.samples += 1
+            del frame
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join(timeout=2.0)
+        self.duration = time.perf_counter() - self._t0
+
+
+def _start(interval: float) -> _Sampler:
+    sampler = _Sampler(threading.get_ident(), interval)
+    sampler.start()
+    return sampler
+
+
+def _write(sampler: _Sampler, task: str, session_id: Optional[str], error: bool = False) -> Optional[Path]:
+    """Escribe .collapsed + .json; errores de disco se loguean (el task no falla por el profiling)."""
+    sid = session_id or "_"
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(sampler.started_at))
+    base = profiles_dir() / sid / f"{task}-{stamp}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    try:
+        base.parent.mkdir(parents=True, exist_ok=True)
+        with open(base.with_suffix(".collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        meta = {
+            "session_id": session_id,
+            "task": task,
+            "started_at": sampler.started_at,
+            "duration_sec": round(sampler.duration, 3),
+            "samples": sampler.samples,
+            "interval_ms": round(sampler.interval * 1000, 3),
+            "pid": os.getpid(),
+            "error": error,
+        }
+        base.with_suffix(".json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        print(f"[profiling] {task} {sid}: {sampler.samples} muestras → {base}.collapsed", file=sys.stderr, flush=True)
+        return base.with_suffix(".collapsed")
+    except OSError as e:
+        print(f"[profiling] no se pudo escribir el perfil de {task}: {e}", file=sys.stderr, flush=True)
+        return None
+
+
+@contextmanager
+def profiled(task: str, session_id: Optional[str]) -> Iterator[None]:
+    """El bloque como un perfil (si el toggle lo pide para esta sesión); no-op si no."""
+    interval = should_profile(session_id)
+    if interval is None:
+        yield
+        return
+    sampler = _start(interval)
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        sampler.stop()
+        _write(sampler, task, session_id, error)
+
+
+def _session_arg(args: tuple, kwargs: dict) -> Optional[str]:
+    sid = kwargs.get("session_id")
+    if isinstance(sid, str):
+        return sid
+    return next((a for a in args if isinstance(a, str)), None)
+
+
+def profile_call(task: str) -> Callable:
+    """Decorador (funciones sync o async): perfila cada llamada; session_id = kwarg o primer argumento str."""
+    def deco(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with profiled(task, _session_arg(args, kwargs)):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with profiled(task, _session_arg(args, kwargs)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+# ---------------------------------------------------------------------------
+# Celery: task_prerun / task_postrun (mismo patrón que tracing)
+# ---------------------------------------------------------------------------
+
+def task_started(task_id: Optional[str], task: Any, args: Optional[tuple]) -> None:
+    name = str(getattr(task, "name", "")).rsplit(".", 1)[-1]
+    if not task_id or name not in PROFILED_TASKS:
+        return
+    session_id = args[0] if args and isinstance(args[0], str) else None
+    interval = should_profile(session_id)
+    if interval is None:
+        return
+    _task_profilers[task_id] = (_start(interval), session_id or "", name)
+
+
+def task_finished(task_id: Optional[str], state: Optional[str]) -> None:
+    entry = _task_profilers.pop(task_id or "", None)
+    if entry is None:
+        return
+    sampler, session_id, name = entry
+    sampler.stop()
+    _write(sampler, name, session_id or None, error=state not in (None, "SUCCESS"))
+
+
+# ---------------------------------------------------------------------------
+# Listado / descarga (endpoints admin)
+# ---------------------------------------------------------------------------
+
+def _safe_component(name: str) -> bool:
+    """Un solo componente de path dentro de profiles_dir (sin separadores, '..' ni ocultos; viene del admin)."""
+    return bool(name) and "/" not in name and "\\" not in name and not name.startswith(".")
+
+
+def list_profiles(session_id: Optional[str] = None) -> list[dict[str, Any]]:
+    """Perfiles guardados (más nuevos primero), con los metadatos del .json."""
+    root = profiles_dir()
+    if not root.exists() or (session_id and not _safe_component(session_id)):
+        return []
+    dirs = [root / session_id] if session_id else [d for d in root.iterdir() if d.is_dir()]
+    out = []
+    for d in dirs:
+        if not d.is_dir():
+            continue
+        for meta_path in d.glob("*.json"):
+            profile = meta_path.with_suffix(".collapsed")
+            if not profile.exists():
+                continue
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                meta = {}
+            out.append({
+                **meta,
+                "session_id": d.name,
+                "name": profile.name,
+                "size_bytes": profile.stat().st_size,
+                "download_url": f"/admin/profiles/{d.name}/{profile.name}",
+            })
+    out.sort(key=lambda p: p.get("started_at") or 0, reverse=True)
+    return out
+
+
+def profile_path(session_id: str, name: str) -> Optional[Path]:
+    """Path del perfil si existe (sin salir de profiles_dir); None si no."""
+    if not _safe_component(session_id) or not _safe_component(name):
+        return None
+    if not name.endswith((".collapsed", ".json")):
+        return None
+    path = profiles_dir() / session_id / name
+    return path if path.is_file() else None
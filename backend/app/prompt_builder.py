@@ -0,0 +1,363 @@
+"""Prompt builder para el DJ LLM: contexto JSON compacto + presupuesto de tokens.
+
+Reemplaza el user_content armado por concatenación de texto. Los datos (picos, segmentos, frases,
+samples, URLs cloud) se rankean por relevancia a la ventana de transición (outro de A, intro de B)
+y se recortan hasta entrar en el presupuesto. Reporta tokens estimados por llamada.
+"""
+from __future__ import annotations
+
+import json
+import math
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+from .analysis import harmonic_distance_camelot
+from .models import SongAnalysis
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Topes iniciales (antes de aplicar el presupuesto)
+MAX_PEAKS = 8
+MAX_SEGMENTS = 12
+MAX_PHRASES = 8
+MAX_SAMPLES = 12
+MAX_CLOUD_PER_CATEGORY = 10
+# Mínimos que el recorte nunca rompe (el LLM necesita frases para alinear el punto de mezcla)
+_MIN_KEEP = {"phrases": 2}
+# Peso de recorte cuando el prompt excede el presupuesto (mayor = se recorta antes; frases casi nunca)
+_TRIM_WEIGHT = {"segments": 1.0, "peaks": 0.9, "cloud": 0.8, "samples": 0.7, "phrases": 0.25}
+# Piso para el user_content aunque el system prompt consuma casi todo el presupuesto
+_MIN_USER_TOKENS = 300
+
+# None = sin cargar; False = la carga falló (sin red para bajar el BPE, etc.): no se reintenta en cada llamada
+_ENCODER = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokens de text: tiktoken (cl100k_base) si está instalado, si no ~3.5 chars/token."""
+    global _ENCODER
+    if not text:
+        return 0
+    if tiktoken is not None and _ENCODER is None:
+        try:
+            _ENCODER = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _ENCODER = False
+    if _ENCODER:
+        try:
+            return len(_ENCODER.encode(text))
+        except Exception:
+            pass
+    return int(math.ceil(len(text) / 3.5))
+
+
+@dataclass
+class PromptBuild:
+    """Resultado del builder: user_content listo para el LLM y conteo de tokens."""
+
+    user_content: str
+    user_tokens: int
+    system_tokens: int
+    budget: int
+    trimmed: dict[str, int] = field(default_factory=dict)  # items descartados por lista
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.user_tokens + self.system_tokens
+
+
+def _outro_start(a: SongAnalysis) -> float:
+    outro = getattr(a, "outro_start_sec", None)
+    return max(0.0, a.duration_sec - 60.0) if outro is None else float(outro)
+
+
+def _transition_windows(analysis_a: SongAnalysis, analysis_b: SongAnalysis) -> tuple[tuple[float, float], tuple[float, float]]:
+    """Ventana relevante en A (desde 30 s antes del outro hasta el final) y en B (intro: primer cuarto, máx. 120 s)."""
+    win_a = (max(0.0, _outro_start(analysis_a) - 30.0), analysis_a.duration_sec)
+    win_b = (0.0, min(analysis_b.duration_sec, max(30.0, min(120.0, analysis_b.duration_sec * 0.25))))
+    return win_a, win_b
+
+
+def _distance_to_window(t: float, window: tuple[float, float]) -> float:
+    lo, hi = window
+    if t < lo:
+        return lo - t
+    if t > hi:
+        return t - hi
+    return 0.0
+
+
+def _rank_times(times: list[float], window: tuple[float, float], limit: int) -> list[float]:
+    """Los `limit` tiempos más cercanos a la ventana, devueltos en orden cronológico."""
+    ranked = sorted(times, key=lambda t: _distance_to_window(float(t), window))[:limit]
+    return sorted(round(float(t), 1) for t in ranked)
+
+
+def _rank_peaks(metadata: Optional[dict[str, Any]], window: tuple[float, float], limit: int) -> list[Any]:
+    """
+    Picos de energía más cercanos a la ventana (a igual distancia, los más prominentes), en orden cronológico.
+    Con energy_peak_features: [t, prominencia]; si no, solo tiempos.
+    """
+    features = (metadata or {}).get("energy_peak_features")
+    if not features:
+        return _rank_times((metadata or {}).get("energy_peaks") or [], window, limit)
+    ranked = sorted(features, key=lambda f: (_distance_to_window(float(f[0]), window), -float(f[2])))[:limit]
+    ranked.sort(key=lambda f: float(f[0]))
+    return [[round(float(f[0]), 1), round(float(f[2]), 2)] for f in ranked]
+
+
+def _structure_sections(structure: Optional[dict[str, Any]]) -> tuple[list[float], str]:
+    """(bounds_sec, levels) de analyze_track_structure; acepta también el formato viejo (segments: list of dicts)."""
+    structure = structure or {}
+    bounds = list(structure.get("bounds_sec") or [])
+    levels = str(structure.get("levels") or "")
+    if len(bounds) == len(levels) + 1 and levels:
+        return [float(b) for b in bounds], levels.upper()
+    segments = structure.get("segments") or []
+    if not segments:
+        return [], ""
+    bounds = [float(s.get("start_sec", 0)) for s in segments] + [float(segments[-1].get("end_sec", 0))]
+    return bounds, "".join(str(s.get("energy_level", "mid"))[:1].upper() for s in segments)
+
+
+def _rank_segments(structure: Optional[dict[str, Any]], window: tuple[float, float], limit: int) -> list[list[Any]]:
+    """Segmentos [start, end, L|M|H] más cercanos a la ventana, en orden cronológico."""
+    bounds, levels = _structure_sections(structure)
+    if not levels:
+        return []
+    # Secciones contiguas con el mismo nivel se fusionan: misma información, menos tokens
+    keep = [0] + [i for i in range(1, len(levels)) if levels[i] != levels[i - 1]]
+    merged = [(bounds[i], bounds[j], levels[i]) for i, j in zip(keep, keep[1:] + [len(levels)])]
+
+    def dist(s: tuple[float, float, str]) -> float:
+        return min(_distance_to_window(s[0], window), _distance_to_window(s[1], window))
+
+    ranked = sorted(merged, key=dist)[:limit]
+    ranked.sort(key=lambda s: s[0])
+    return [[round(start), round(end), level] for start, end, level in ranked]
+
+
+def _track_context(
+    analysis: SongAnalysis,
+    metadata: Optional[dict[str, Any]],
+    structure: Optional[dict[str, Any]],
+    window: tuple[float, float],
+    energy_10: int,
+    *,
+    outgoing: bool,
+) -> dict[str, Any]:
+    phrases = getattr(analysis, "phrase_starts_sec", None) or []
+    ctx: dict[str, Any] = {
+        "bpm": round(analysis.bpm, 1),
+        "key": f"{analysis.key} {analysis.key_scale}",
+        "camelot": getattr(analysis, "key_camelot", None) or "",
+        "energy": energy_10,
+        "dur": round(analysis.duration_sec, 1),
+        "phrases": _rank_times(phrases, window, MAX_PHRASES),
+        "peaks": _rank_peaks(metadata, window, MAX_PEAKS),
+        "segments": _rank_segments(structure, window, MAX_SEGMENTS),
+    }
+    if outgoing:
+        ctx["outro"] = round(_outro_start(analysis))
+    if getattr(analysis, "genre", None):
+        ctx["genre"] = analysis.genre
+    if getattr(analysis, "vibe", None):
+        ctx["vibe"] = analysis.vibe
+    return ctx
+
+
+def _rank_samples(
+    compatible_overlays: list[tuple[Path, dict]],
+    avg_bpm: float,
+    camelot_mix: str,
+) -> list[list[Any]]:
+    """[filename, bpm, camelot, category] ordenados por cercanía de BPM y key a la mezcla."""
+    def score(item: tuple[Path, dict]) -> float:
+        meta = item[1]
+        bpm_diff = abs(float(meta.get("bpm", avg_bpm)) - avg_bpm)
+        return bpm_diff + 2.0 * harmonic_distance_camelot(meta.get("key_camelot") or "", camelot_mix)
+
+    ranked = sorted(compatible_overlays, key=score)[:MAX_SAMPLES]
+    return [[p.name, meta.get("bpm"), meta.get("key_camelot"), meta.get("category", "")] for p, meta in ranked]
+
+
+def _rank_cloud(cloud_compatible_overlays: list[dict[str, Any]], avg_bpm: float) -> dict[str, list[list[Any]]]:
+    """{category: [[url, name, bpm, key], ...]} ordenados por cercanía de BPM."""
+    by_cat: dict[str, list[dict[str, Any]]] = {}
+    for e in cloud_compatible_overlays:
+        cat = (e.get("category") or "").strip().lower()
+        by_cat.setdefault(cat, []).append(e)
+    out: dict[str, list[list[Any]]] = {}
+    for cat in ("instruments", "vocals"):
+        entries = sorted(by_cat.get(cat, []), key=lambda e: abs(float(e.get("bpm", avg_bpm)) - avg_bpm))
+        if entries:
+            out[cat] = [[e.get("url", ""), e.get("name"), e.get("bpm"), e.get("key", "")] for e in entries[:MAX_CLOUD_PER_CATEGORY]]
+    return out
+
+
+def _rules(
+    harmonic_dist: int,
+    energy_jump: int,
+    sensitivity: float,
+    *,
+    has_assets: bool,
+    has_cloud: bool,
+    only_two_songs: bool,
+    peak_features: bool = False,
+) -> list[str]:
+    """Instrucciones cortas dependientes del contexto (el system prompt ya tiene las reglas generales)."""
+    rules = [
+        "song_a_transition_start_sec = un valor de A.phrases (o >= A.outro)",
+        "start_offset_bars: B entra en inicio de frase",
+        "bass_swap_sec entre 0 y crossfade_sec (ej. crossfade_sec*0.5)",
+        "dj_comment: explicación técnica senior (compás del bass-swap, justificación armónica)",
+    ]
+    if peak_features:
+        rules.append("peaks = [seg, prominencia 0-1]: los prominentes son drops/entradas fuertes")
+    if sensitivity < 0.4:
+        rules.append("priorizar BPM/tempo")
+    elif sensitivity > 0.6:
+        rules.append("priorizar armonía/key")
+    else:
+        rules.append("equilibrio BPM y armonía")
+    if harmonic_dist <= 1:
+        rules.append("distancia armónica 0-1: transición larga y atmosférica (32-64 barras)")
+    else:
+        rules.append("distancia armónica >1: transición corta/rítmica o filter_fade/wash_out")
+    if energy_jump > 3:
+        rules.append("salto de energía alto: 4 u 8 barras")
+    if has_assets:
+        rules.append("overlay_instrument/overlay_vocal: filename de samples o null; si energía baja elegí uno de cada categoría")
+    if has_cloud:
+        rules.append("overlay_instrument_url/overlay_vocal_url: URL exacta de cloud o null; si energía baja elegí instrument y vocal")
+    if only_two_songs and has_cloud:
+        rules.append("Remix Live (OBLIGATORIO, solo 2 canciones): elegí 1 overlay_instrument_url y 1 overlay_vocal_url")
+    rules.append("Output ONLY the JSON object, no markdown")
+    return rules
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _trim_to_budget(context: dict[str, Any], budget_tokens: int) -> tuple[str, int, dict[str, int]]:
+    """Recorta listas de menor relevancia (última posición del ranking) hasta entrar en budget_tokens."""
+    trimmed: dict[str, int] = {}
+
+    def lists() -> list[tuple[str, list]]:
+        out: list[tuple[str, list]] = []
+        for name in ("segments", "peaks", "phrases"):
+            for track in ("A", "B"):
+                lst = context[track].get(name)
+                if lst is not None:
+                    out.append((name, lst))
+        if context.get("samples"):
+            out.append(("samples", context["samples"]))
+        for names in (context.get("assets") or {}).values():
+            out.append(("samples", names))
+        for entries in (context.get("cloud") or {}).values():
+            out.append(("cloud", entries))
+        return out
+
+    text = _dumps(context)
+    tokens = estimate_tokens(text)
+    while tokens > budget_tokens:
+        candidates = [(name, lst) for name, lst in lists() if len(lst) > _MIN_KEEP.get(name, 0)]
+        if not candidates:
+            break
+        # Recorte balanceado: la lista más larga ponderada por lo prescindible de su categoría
+        name, lst = max(candidates, key=lambda c: len(c[1]) * _TRIM_WEIGHT[c[0]])
+        if name in ("peaks", "phrases", "segments"):
+            # Listas cronológicas: el item menos relevante es el más lejano a la ventana → extremo opuesto
+            lst.pop(0 if lst is context["A"].get(name) else -1)
+        else:
+            lst.pop()
+        trimmed[name] = trimmed.get(name, 0) + 1
+        text = _dumps(context)
+        tokens = estimate_tokens(text)
+    return text, tokens, trimmed
+
+
+def build_decision_prompt(
+    analysis_a: SongAnalysis,
+    analysis_b: SongAnalysis,
+    *,
+    system_prompt: str,
+    token_budget: int,
+    energy_a_10: int,
+    energy_b_10: int,
+    harmonic_dist: int,
+    sensitivity: float,
+    dj_style_prompt: Optional[str] = None,
+    audio_metadata_a: Optional[dict[str, Any]] = None,
+    audio_metadata_b: Optional[dict[str, Any]] = None,
+    track_structure_a: Optional[dict[str, Any]] = None,
+    track_structure_b: Optional[dict[str, Any]] = None,
+    compatible_overlays: Optional[list[tuple[Path, dict]]] = None,
+    available_assets: Optional[dict[str, list[str]]] = None,
+    cloud_compatible_overlays: Optional[list[dict[str, Any]]] = None,
+    only_two_songs: bool = False,
+) -> PromptBuild:
+    """
+    Contexto JSON compacto para el LLM. token_budget es el total del prompt (system + user);
+    el user_content se recorta para que entre en token_budget - tokens(system_prompt).
+    """
+    win_a, win_b = _transition_windows(analysis_a, analysis_b)
+    avg_bpm = (analysis_a.bpm + analysis_b.bpm) / 2.0
+    camelot_mix = (getattr(analysis_a, "key_camelot", None) or getattr(analysis_b, "key_camelot", None) or "8A").strip()
+
+    context: dict[str, Any] = {}
+    if dj_style_prompt and dj_style_prompt.strip():
+        context["user_prompt"] = dj_style_prompt.strip()
+    context["A"] = _track_context(analysis_a, audio_metadata_a, track_structure_a, win_a, energy_a_10, outgoing=True)
+    context["B"] = _track_context(analysis_b, audio_metadata_b, track_structure_b, win_b, energy_b_10, outgoing=False)
+    context["harmonic_distance"] = harmonic_dist
+    context["energy_jump"] = abs(energy_a_10 - energy_b_10)
+    if available_assets:
+        context["assets"] = {cat: list(available_assets.get(cat, []))[:MAX_SAMPLES] for cat in ("instruments", "vocals")}
+    if compatible_overlays:
+        context["samples"] = _rank_samples(compatible_overlays, avg_bpm, camelot_mix)
+    if cloud_compatible_overlays:
+        cloud = _rank_cloud(cloud_compatible_overlays, avg_bpm)
+        if cloud:
+            context["cloud"] = cloud
+    context["rules"] = _rules(
+        harmonic_dist,
+        context["energy_jump"],
+        sensitivity,
+        has_assets=bool(available_assets or compatible_overlays),
+        has_cloud=bool(context.get("cloud")),
+        only_two_songs=only_two_songs,
+        peak_features=any(
+            p and isinstance(p[0], list) for p in (context["A"]["peaks"], context["B"]["peaks"])
+        ),
+    )
+
+    system_tokens = estimate_tokens(system_prompt)
+    user_budget = max(_MIN_USER_TOKENS, token_budget - system_tokens)
+    text, user_tokens, trimmed = _trim_to_budget(context, user_budget)
+    return PromptBuild(
+        user_content=text,
+        user_tokens=user_tokens,
+        system_tokens=system_tokens,
+        budget=token_budget,
+        trimmed=trimmed,
+    )
+
+
+def log_prompt_usage(build: PromptBuild, actual_prompt_tokens: Optional[int] = None, label: str = "llm") -> None:
+    """Imprime tokens del prompt (estimados y reales si la API los devuelve) para medir el costo de decisión."""
+    parts = [
+        f"[prompt:{label}] est={build.prompt_tokens} (system={build.system_tokens}, user={build.user_tokens})",
+        f"budget={build.budget}",
+    ]
+    if actual_prompt_tokens is not None:
+        parts.append(f"actual={actual_prompt_tokens}")
+    if build.trimmed:
+        parts.append("trimmed=" + ",".join(f"{k}:{v}" for k, v in sorted(build.trimmed.items())))
+    print(" ".join(parts), file=sys.stderr, flush=True)
@@ -1,11 +1,15 @@
 """Redis store: job state (process-folder), admin config, progress pub/sub. Used when redis_url is set."""
 from __future__ import annotations
 
+import hashlib
 import json
+import os
+import time
 from pathlib import Path
 from typing import Any, Optional
 
 from .config import settings
+from .tracing import carrier
 
 REDIS_KEY_JOB = "opus:job:{}"
 REDIS_KEY_ADMIN_CONFIG = "opus:admin_config"
@@ -23,6 +27,48 @@ def _client():
         return None
 
 
+_binary: Optional[tuple[int, Any]] = None
+
+
+def _binary_client():
+    """Cliente sin decode_responses (valores bytes), uno por proceso: reusa el pool de conexiones."""
+    global _binary
+    if not settings.redis_url:
+        return None
+    if _binary is not None and _binary[0] == os.getpid():
+        return _binary[1]
+    try:
+        import redis
+        client = redis.from_url(settings.redis_url, decode_responses=False)
+    except Exception:
+        return None
+    _binary = (os.getpid(), client)
+    return client
+
+
+def get_blob(key: str) -> Optional[bytes]:
+    """Valor binario crudo (analysis_codec); None si no existe o no hay Redis."""
+    c = _binary_client()
+    if not c:
+        return None
+    try:
+        return c.get(key)
+    except Exception:
+        return None
+
+
+def set_blob(key: str, data: bytes, ttl_sec: int) -> bool:
+    """Escribe un valor binario con TTL. True si quedó guardado."""
+    c = _binary_client()
+    if not c:
+        return False
+    try:
+        c.set(key, data, ex=ttl_sec)
+        return True
+    except Exception:
+        return False
+
+
 def get_job(session_id: str) -> Optional[dict[str, Any]]:
     """Job state for process-folder (status, phase, current_segment, total_segments, set_path, tracklist_path, error)."""
     c = _client()
@@ -37,33 +83,220 @@ def get_job(session_id: str) -> Optional[dict[str, Any]]:
         return None
 
 
+def _job_json(data: dict[str, Any]) -> str:
+    # Path objects -> str for JSON
+    out = {}
+    for k, v in data.items():
+        if hasattr(v, "__fspath__"):
+            out[k] = str(v)
+        elif isinstance(v, Path):
+            out[k] = str(v)
+        else:
+            out[k] = v
+    return json.dumps(out)
+
+
 def set_job(session_id: str, data: dict[str, Any]) -> None:
     """Write job state; paths stored as strings."""
     c = _client()
     if not c:
         return
     try:
-        # Path objects -> str for JSON
-        out = {}
-        for k, v in data.items():
-            if hasattr(v, "__fspath__"):
-                out[k] = str(v)
-            elif isinstance(v, Path):
-                out[k] = str(v)
-            else:
-                out[k] = v
-        c.set(REDIS_KEY_JOB.format(session_id), json.dumps(out), ex=REDIS_TTL_JOB)
+        c.set(REDIS_KEY_JOB.format(session_id), _job_json(data), ex=REDIS_TTL_JOB)
+    except Exception:
+        pass
+
+
+def update_job(session_id: str, fields: dict[str, Any]) -> bool:
+    """
+    Actualiza solo fields del job (WATCH/MULTI: read-modify-write atómico). Con el set en curso lo escriben a la
+    vez el ai_brain y los render_segment: un set_job desde una lectura vieja pisaría el 'failed' de un render.
+    No escribe sobre un job 'failed' (se conserva la causa original): devuelve False. True si escribió o si no
+    hay Redis / falló la conexión (estado best-effort, como set_job).
+    """
+    c = _client()
+    if not c:
+        return True
+    key = REDIS_KEY_JOB.format(session_id)
+
+    def merge(pipe) -> bool:
+        raw = pipe.get(key)
+        job = json.loads(raw) if raw else {}
+        if job.get("status") == "failed":
+            return False
+        job.update(fields)
+        pipe.multi()
+        pipe.set(key, _job_json(job), ex=REDIS_TTL_JOB)
+        return True
+
+    try:
+        return bool(c.transaction(merge, key, value_from_callable=True))
+    except Exception:
+        return True
+
+
+# Memoria por etapa (memory.memory_stage): hash por sesión "<pid>:<seq>" -> registro JSON, junto al job (mismo TTL).
+# Un hash y no el JSON del job: lo escriben a la vez el ai_brain y los audio workers.
+REDIS_KEY_MEMORY = "opus:job:{}:memory"
+
+
+def put_memory_record(session_id: str, field: str, record: dict[str, Any]) -> None:
+    c = _client()
+    if not c:
+        return
+    key = REDIS_KEY_MEMORY.format(session_id)
+    try:
+        pipe = c.pipeline()
+        pipe.hset(key, field, json.dumps(record))
+        pipe.expire(key, REDIS_TTL_JOB)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def get_memory_records(session_id: str) -> list[dict[str, Any]]:
+    c = _client()
+    if not c:
+        return []
+    try:
+        return [json.loads(v) for v in c.hvals(REDIS_KEY_MEMORY.format(session_id))]
+    except Exception:
+        return []
+
+
+# Plan de cada segmento (paths, claves de análisis, strategy): inmutable, por sesión. Los tasks de render reciben
+# solo (session_id, idx, plan_key) y leen el resto de acá; finalize_set borra el hash (clear_render_state).
+REDIS_KEY_PLANS = "opus:plans:{}"
+REDIS_TTL_PLANS = 6 * 3600
+
+
+def put_segment_plan(session_id: str, plan: dict[str, Any]) -> Optional[str]:
+    """Guarda el plan en el hash de la sesión; devuelve su clave (hash del contenido) o None si no hay Redis."""
+    c = _client()
+    if not c:
+        return None
+    raw = json.dumps(plan, sort_keys=True, separators=(",", ":"), default=str)
+    plan_key = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+    try:
+        pipe = c.pipeline()
+        pipe.hset(REDIS_KEY_PLANS.format(session_id), plan_key, raw)
+        pipe.expire(REDIS_KEY_PLANS.format(session_id), REDIS_TTL_PLANS)
+        pipe.execute()
+        return plan_key
+    except Exception:
+        return None
+
+
+def get_segment_plan(session_id: str, plan_key: str) -> Optional[dict[str, Any]]:
+    c = _client()
+    if not c:
+        return None
+    try:
+        raw = c.hget(REDIS_KEY_PLANS.format(session_id), plan_key)
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+# Segmentos ya renderizados (idx -> seg_path): el que completa el set encola finalize_set (sin chord)
+REDIS_KEY_DONE = "opus:done:{}"
+
+
+def mark_segment_done(session_id: str, idx: int, seg_path: str, total: int) -> bool:
+    """
+    Registra el segmento como renderizado. True solo para la llamada que completa los total segmentos (atómico:
+    HSETNX + HLEN en MULTI; una re-entrega del mismo segmento no cuenta dos veces).
+    """
+    c = _client()
+    if not c:
+        return False
+    key = REDIS_KEY_DONE.format(session_id)
+    try:
+        pipe = c.pipeline(transaction=True)
+        pipe.hsetnx(key, str(idx), seg_path)
+        pipe.hlen(key)
+        pipe.expire(key, REDIS_TTL_PLANS)
+        added, count, _ = pipe.execute()
+        return bool(added) and int(count) >= total
+    except Exception:
+        return False
+
+
+def get_done_segments(session_id: str) -> list[str]:
+    """seg_paths renderizados, en orden de segmento."""
+    c = _client()
+    if not c:
+        return []
+    try:
+        done = c.hgetall(REDIS_KEY_DONE.format(session_id)) or {}
+        return [done[k] for k in sorted(done, key=int)]
+    except Exception:
+        return []
+
+
+def clear_render_state(session_id: str) -> None:
+    """Borra planes y progreso de render de la sesión."""
+    c = _client()
+    if not c:
+        return
+    try:
+        c.delete(REDIS_KEY_PLANS.format(session_id), REDIS_KEY_DONE.format(session_id))
+    except Exception:
+        pass
+
+
+# Fair-share de renders: semáforo contado por sesión (ZSET token -> inicio). Entradas más viejas que el lease
+# (worker caído sin liberar) se descartan solas.
+REDIS_KEY_RENDER_SLOTS = "opus:slots:{}"
+
+
+def acquire_render_slot(session_id: str, token: str, limit: int, lease_sec: float) -> bool:
+    """
+    Toma uno de los limit slots de render de la sesión. False si ya hay limit renders en curso (el task reintenta
+    más tarde y deja pasar a otras sesiones). Sin Redis o con limit <= 0, siempre True.
+    """
+    if limit <= 0:
+        return True
+    c = _client()
+    if not c:
+        return True
+    key = REDIS_KEY_RENDER_SLOTS.format(session_id)
+    try:
+        now = time.time()
+        pipe = c.pipeline()
+        pipe.zremrangebyscore(key, "-inf", now - lease_sec)
+        pipe.zadd(key, {token: now}, nx=True)
+        pipe.expire(key, int(lease_sec))
+        pipe.zrank(key, token)
+        rank = pipe.execute()[-1]
+        if rank is not None and rank < limit:
+            return True
+        c.zrem(key, token)
+        return False
+    except Exception:
+        return True
+
+
+def release_render_slot(session_id: str, token: str) -> None:
+    c = _client()
+    if not c:
+        return
+    try:
+        c.zrem(REDIS_KEY_RENDER_SLOTS.format(session_id), token)
     except Exception:
         pass
 
 
 def publish_progress(session_id: str, payload: dict[str, Any]) -> None:
-    """Publish progress event for Socket.IO (phase, current_segment, total_segments, message)."""
+    """
+    Publish progress event for Socket.IO (phase, current_segment, total_segments, message).
+    Con tracing, el mensaje lleva traceparent del span actual (el cliente puede correlacionar con la traza).
+    """
     c = _client()
     if not c:
         return
     try:
-        c.publish(REDIS_CHAN_PROGRESS.format(session_id), json.dumps(payload))
+        c.publish(REDIS_CHAN_PROGRESS.format(session_id), json.dumps({**payload, **carrier()}))
     except Exception:
         pass
 
@@ -88,3 +321,163 @@ def set_admin_config_json(data: str) -> None:
         c.set(REDIS_KEY_ADMIN_CONFIG, data)
     except Exception:
         pass
+
+
+# ---------------------------------------------------------------------------
+# Strategy cache (memoized LLM decisions): TTL + LRU via sorted set, hit/miss stats
+# ---------------------------------------------------------------------------
+
+REDIS_KEY_STRATEGY = "opus:strategy:{}"
+REDIS_KEY_STRATEGY_LRU = "opus:strategy:lru"
+REDIS_KEY_STRATEGY_STATS = "opus:strategy:stats"
+
+
+def get_cached_strategy(key: str, ttl_sec: int) -> Optional[dict[str, Any]]:
+    """Strategy JSON cacheada por key; refresca TTL y posición LRU en cada hit."""
+    c = _client()
+    if not c:
+        return None
+    try:
+        raw = c.get(REDIS_KEY_STRATEGY.format(key))
+        if not raw:
+            return None
+        pipe = c.pipeline()
+        pipe.expire(REDIS_KEY_STRATEGY.format(key), ttl_sec)
+        pipe.zadd(REDIS_KEY_STRATEGY_LRU, {key: time.time()})
+        pipe.execute()
+        return json.loads(raw)
+    except Exception:
+        return None
+
+
+def set_cached_strategy(key: str, data: dict[str, Any], ttl_sec: int, max_entries: int) -> None:
+    """Guarda strategy con TTL; si se supera max_entries, desaloja las menos usadas (LRU)."""
+    c = _client()
+    if not c:
+        return
+    try:
+        now = time.time()
+        pipe = c.pipeline()
+        pipe.set(REDIS_KEY_STRATEGY.format(key), json.dumps(data), ex=ttl_sec)
+        pipe.zadd(REDIS_KEY_STRATEGY_LRU, {key: now})
+        # Entradas ya expiradas por TTL: sacarlas del índice LRU
+        pipe.zremrangebyscore(REDIS_KEY_STRATEGY_LRU, "-inf", now - ttl_sec)
+        pipe.zcard(REDIS_KEY_STRATEGY_LRU)
+        count = pipe.execute()[-1]
+        excess = int(count) - max_entries
+        if excess > 0:
+            oldest = c.zrange(REDIS_KEY_STRATEGY_LRU, 0, excess - 1)
+            if oldest:
+                pipe = c.pipeline()
+                pipe.delete(*[REDIS_KEY_STRATEGY.format(k) for k in oldest])
+                pipe.zrem(REDIS_KEY_STRATEGY_LRU, *oldest)
+                pipe.hincrby(REDIS_KEY_STRATEGY_STATS, "evictions", len(oldest))
+                pipe.execute()
+    except Exception:
+        pass
+
+
+def clear_cached_strategies() -> int:
+    """Borra todas las strategies cacheadas (p. ej. al cambiar reglas en admin). Devuelve cantidad borrada."""
+    c = _client()
+    if not c:
+        return 0
+    try:
+        keys = c.zrange(REDIS_KEY_STRATEGY_LRU, 0, -1)
+        pipe = c.pipeline()
+        if keys:
+            pipe.delete(*[REDIS_KEY_STRATEGY.format(k) for k in keys])
+        pipe.delete(REDIS_KEY_STRATEGY_LRU)
+        pipe.hincrby(REDIS_KEY_STRATEGY_STATS, "invalidations", 1)
+        pipe.execute()
+        return len(keys)
+    except Exception:
+        return 0
+
+
+def incr_strategy_cache_stat(field: str, amount: int = 1) -> None:
+    """Contador de métricas del cache (hits, misses, stores)."""
+    c = _client()
+    if not c:
+        return
+    try:
+        c.hincrby(REDIS_KEY_STRATEGY_STATS, field, amount)
+    except Exception:
+        pass
+
+
+def get_strategy_cache_stats() -> Optional[dict[str, int]]:
+    """Contadores del cache + cantidad de entradas en el índice LRU."""
+    c = _client()
+    if not c:
+        return None
+    try:
+        raw = c.hgetall(REDIS_KEY_STRATEGY_STATS) or {}
+        stats = {k: int(v) for k, v in raw.items()}
+        stats["entries"] = int(c.zcard(REDIS_KEY_STRATEGY_LRU))
+        return stats
+    except Exception:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Métricas: sesiones en curso (ZSET "kind:session_id" -> inicio) y largo de colas Celery
+# ---------------------------------------------------------------------------
+
+REDIS_KEY_INFLIGHT = "opus:inflight"
+
+
+def inflight_add(session_id: str, kind: str) -> bool:
+    """Registra la sesión en curso. False si no hay Redis (el llamador cuenta en memoria)."""
+    c = _client()
+    if not c:
+        return False
+    try:
+        c.zadd(REDIS_KEY_INFLIGHT, {f"{kind}:{session_id}": time.time()})
+        return True
+    except Exception:
+        return False
+
+
+def inflight_remove(session_id: str) -> bool:
+    c = _client()
+    if not c:
+        return False
+    try:
+        pipe = c.pipeline()
+        for kind in ("set", "generate"):
+            pipe.zrem(REDIS_KEY_INFLIGHT, f"{kind}:{session_id}")
+        pipe.execute()
+        return True
+    except Exception:
+        return False
+
+
+def inflight_counts() -> Optional[dict[str, int]]:
+    """{kind: sesiones en curso}; descarta entradas más viejas que REDIS_TTL_PLANS (sesiones que nunca cerraron)."""
+    c = _client()
+    if not c:
+        return None
+    try:
+        c.zremrangebyscore(REDIS_KEY_INFLIGHT, "-inf", time.time() - REDIS_TTL_PLANS)
+        counts: dict[str, int] = {}
+        for member in c.zrange(REDIS_KEY_INFLIGHT, 0, -1):
+            kind = member.split(":", 1)[0]
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+    except Exception:
+        return None
+
+
+def list_lengths(keys: list[str]) -> Optional[dict[str, int]]:
+    """LLEN de cada key en un pipeline (colas Celery en el broker)."""
+    c = _client()
+    if not c:
+        return None
+    try:
+        pipe = c.pipeline()
+        for k in keys:
+            pipe.llen(k)
+        return {k: int(n) for k, n in zip(keys, pipe.execute())}
+    except Exception:
+        return None
@@ -1,22 +1,21 @@
-"""Offline audio render: Rubber Band (stretch/pitch) + processor (acrossfade sin -t/-to/atrim). Cloud overlays: download to temp, then cleanup."""
-import subprocess
+"""Offline audio render: Rubber Band (stretch/pitch) + processor (acrossfade sin -t/-to/atrim). Cloud overlays: cache local en disco (sample_cache)."""
 import tempfile
 from pathlib import Path
 from typing import List, Optional
 
 from .audio.processor import render_professional_mix as processor_mix
-from .audio.cloud_downloader import download_urls_to_temp, cleanup_temp_dir
+from .audio.sample_cache import cached_sample_paths
+from .audio.stem_cache import conformed_stem
+from .audio.tools import run_tool
+from .metrics import stage
 from .models import MixStrategy, SongAnalysis
+from .tracing import span, traced
 
 # Redondeo de tiempos (evita errores de precisión)
 def _t(x: float) -> float:
     return round(float(x), 3)
 
 
-def _run(cmd: list[str], cwd: Optional[Path] = None) -> None:
-    subprocess.run(cmd, cwd=cwd, check=True)
-
-
 def _rubberband(
     input_path: Path,
     output_path: Path,
@@ -27,53 +26,49 @@ def _rubberband(
 ) -> None:
     """Run Rubber Band: time stretch and pitch shift. If skip_stretch True, only copy (no processing)."""
     if skip_stretch or (abs(stretch_ratio - 1.0) < 1e-6 and abs(pitch_semitones) < 1e-6):
-        _run([
-            "ffmpeg", "-y",
-            "-i", str(input_path),
-            "-acodec", "pcm_s16le",
-            str(output_path),
-        ])
+        with span("ffmpeg_copy"):
+            run_tool([
+                "ffmpeg", "-y",
+                "-i", str(input_path),
+                "-acodec", "pcm_s16le",
+                str(output_path),
+            ])
         return
 
-    _run([
-        "rubberband",
-        "-t", str(stretch_ratio),
-        "-p", str(pitch_semitones),
-        str(input_path),
-        str(output_path),
-    ])
+    with stage("rubberband", stretch=round(stretch_ratio, 4), pitch=round(pitch_semitones, 2)):
+        run_tool([
+            "rubberband",
+            "-t", str(stretch_ratio),
+            "-p", str(pitch_semitones),
+            str(input_path),
+            str(output_path),
+        ])
 
 
+@traced("ffprobe")
 def _duration(path: Path) -> float:
-    result = subprocess.run(
-        [
-            "ffprobe",
-            "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            str(path),
-        ],
-        capture_output=True,
-        text=True,
-        check=True,
-    )
+    result = run_tool([
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(path),
+    ])
     return float(result.stdout.strip())
 
 
+@traced("ffmpeg_silence")
 def _create_silent_wav(work_dir: Path, name: str = "silent.wav") -> Path:
     """Crea un WAV silencioso corto (0.1 s) para usar como placeholder cuando no hay cloud sample."""
     out = work_dir / name
-    subprocess.run(
-        [
-            "ffmpeg", "-y", "-f", "lavfi", "-i", "anullsrc=r=44100:cl=mono",
-            "-t", "0.1", "-acodec", "pcm_s16le", str(out),
-        ],
-        capture_output=True,
-        check=True,
-    )
+    run_tool([
+        "ffmpeg", "-y", "-f", "lavfi", "-i", "anullsrc=r=44100:cl=mono",
+        "-t", "0.1", "-acodec", "pcm_s16le", str(out),
+    ])
     return out
 
 
+@traced("render_mix")
 def render_mix(
     path_a: Path,
     path_b: Path,
@@ -87,7 +82,7 @@ def render_mix(
     Offline DJ-style mix:
     - Rubber Band for stretch/pitch
     - Real overlap crossfade (A fades out, B fades in)
-    - overlay_instrument / overlay_vocal: nombres de archivo (local); overlay_instrument_url / overlay_vocal_url: cloud (se descargan a temp, cleanup tras FFmpeg).
+    - overlay_instrument / overlay_vocal: nombres de archivo (local); overlay_instrument_url / overlay_vocal_url: cloud (cache en disco del worker; no se borran tras FFmpeg).
     - Si work_dir es None, se usa tempfile.TemporaryDirectory; al terminar se borra (stateless).
     """
     use_temp = work_dir is None
@@ -159,11 +154,10 @@ def render_mix(
 
         path_cloud_vocal: Optional[Path] = None
         path_cloud_instrument: Optional[Path] = None
-        cloud_temp_dir: Optional[Path] = None
 
         if urls:
-            overlay_paths_cloud, cloud_temp_dir = download_urls_to_temp(urls)
-            # Confirmación de descarga: verificar que los archivos están en /tmp antes de FFmpeg
+            overlay_paths_cloud = cached_sample_paths(urls)
+            # Confirmación de descarga: verificar que los archivos están en la cache antes de FFmpeg
             for i, p in enumerate(overlay_paths_cloud):
                 if not p.exists():
                     raise RuntimeError(
@@ -190,23 +184,26 @@ def render_mix(
             path_cloud_instrument = _create_silent_wav(work_dir, "silent_instrument.wav")
 
         target_bpm = (analysis_a.bpm + analysis_b.bpm) / 2.0
-        try:
-            processor_mix(
-                a_proc,
-                b_proc,
-                path_cloud_vocal,
-                path_cloud_instrument,
-                output_path,
-                cross_d,
-                apply_highpass_a=apply_highpass_a,
-                overlay_entry_sec=overlay_entry_sec,
-                target_bpm=target_bpm,
-                vocal_bpm=float(overlay_vocal_bpm or 120),
-                instrument_bpm=float(overlay_instrument_bpm or 120),
-            )
-        finally:
-            if cloud_temp_dir is not None:
-                cleanup_temp_dir(cloud_temp_dir)
+        vocal_bpm = float(overlay_vocal_bpm or 120)
+        instrument_bpm = float(overlay_instrument_bpm or 120)
+        # Overlays cloud ya conformados al BPM del set (stem_cache): el mixer no aplica atempo
+        if had_vocal:
+            path_cloud_vocal, vocal_bpm = conformed_stem(path_cloud_vocal, vocal_bpm, target_bpm)
+        if had_instrument:
+            path_cloud_instrument, instrument_bpm = conformed_stem(path_cloud_instrument, instrument_bpm, target_bpm)
+        processor_mix(
+            a_proc,
+            b_proc,
+            path_cloud_vocal,
+            path_cloud_instrument,
+            output_path,
+            cross_d,
+            apply_highpass_a=apply_highpass_a,
+            overlay_entry_sec=overlay_entry_sec,
+            target_bpm=target_bpm,
+            vocal_bpm=vocal_bpm,
+            instrument_bpm=instrument_bpm,
+        )
 
         # Limpieza: si no usamos temp dir, borrar archivos intermedios (stateless)
         if not use_temp:
@@ -0,0 +1,174 @@
+"""Índice persistente de la librería de samples (SQLite): metadata de todos los samples en un solo archivo.
+
+Tabla ordenada por (category, camelot_num, bpm): una búsqueda por rango de BPM en los buckets Camelot
+vecinos es un range scan del índice, O(log n + k), sin abrir sidecars ni listar directorios.
+Lo escribe scripts/index_samples.py (incremental por mtime/size, reemplazo atómico); los requests solo leen.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .config import settings
+
+INDEX_FILENAME = ".sample_index.sqlite"
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    rel_path TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    camelot_num INTEGER NOT NULL,
+    key_camelot TEXT NOT NULL,
+    bpm REAL NOT NULL,
+    key TEXT,
+    key_scale TEXT,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+-- Índice cubriente: la búsqueda no toca la tabla (todas las columnas del SELECT están en el índice)
+CREATE INDEX IF NOT EXISTS samples_lookup ON samples (category, camelot_num, bpm, rel_path, key_camelot, key, key_scale);
+CREATE TABLE IF NOT EXISTS dirs (category TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL);
+"""
+
+# Conexión por thread (sqlite3 no comparte conexiones entre threads); se reabre tras fork o si cambia el archivo
+_local = threading.local()
+
+
+def index_path() -> Path:
+    """AUTOMIX_SAMPLE_INDEX_PATH o assets/samples/.sample_index.sqlite."""
+    custom = (settings.sample_index_path or "").strip()
+    return Path(custom) if custom else Path(settings.assets_samples_dir) / INDEX_FILENAME
+
+
+def camelot_number(key_camelot: Optional[str]) -> int:
+    """'8A' → 8; 0 si es inválida (no matchea en búsquedas)."""
+    c = (key_camelot or "").strip().upper()
+    try:
+        n = int(c[:-1])
+    except (ValueError, IndexError):
+        return 0
+    return n if 1 <= n <= 12 else 0
+
+
+def camelot_neighbours(key_camelot: str, max_distance: int) -> list[int]:
+    """Números Camelot a distancia <= max_distance en la rueda (la letra A/B no cuenta, igual que _camelot_distance)."""
+    n = camelot_number(key_camelot)
+    if n == 0 or max_distance < 0:
+        return []
+    d = min(max_distance, 6)
+    return sorted({(n - 1 + k) % 12 + 1 for k in range(-d, d + 1)})
+
+
+def open_index(path: Optional[Path] = None) -> sqlite3.Connection:
+    """Conexión de escritura con el schema creado (indexer); los lectores usan connection()."""
+    path = path or index_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30.0)
+    conn.executescript(_SCHEMA)
+    conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+    conn.commit()
+    return conn
+
+
+def connection() -> sqlite3.Connection:
+    """
+    Conexión de solo lectura cacheada por thread; se reabre si cambió el pid o el inode del archivo
+    (el indexer reemplaza el archivo atómicamente). FileNotFoundError si el índice no existe.
+    """
+    path = index_path()
+    inode = path.stat().st_ino
+    conn = getattr(_local, "conn", None)
+    if conn is not None and (_local.pid != os.getpid() or _local.path != path or _local.inode != inode):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        conn = None
+    if conn is None:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30.0)
+        _local.conn, _local.pid, _local.path, _local.inode = conn, os.getpid(), path, inode
+    return conn
+
+
+def stored_dir_mtime(conn: sqlite3.Connection, category: str) -> Optional[int]:
+    row = conn.execute("SELECT mtime_ns FROM dirs WHERE category = ?", (category,)).fetchone()
+    return int(row[0]) if row else None
+
+
+def set_dir_mtime(conn: sqlite3.Connection, category: str, mtime_ns: int) -> None:
+    conn.execute("INSERT OR REPLACE INTO dirs (category, mtime_ns) VALUES (?, ?)", (category, mtime_ns))
+
+
+def file_stats(conn: sqlite3.Connection, category: str) -> dict[str, tuple[int, int]]:
+    """rel_path → (mtime_ns, size) de lo indexado en la categoría."""
+    rows = conn.execute("SELECT rel_path, mtime_ns, size FROM samples WHERE category = ?", (category,))
+    return {r[0]: (int(r[1]), int(r[2])) for r in rows}
+
+
+def upsert_sample(
+    conn: sqlite3.Connection,
+    rel_path: str,
+    category: str,
+    meta: dict,
+    mtime_ns: int,
+    size: int,
+) -> None:
+    camelot = (meta.get("key_camelot") or "").strip().upper()
+    conn.execute(
+        "INSERT OR REPLACE INTO samples (rel_path, category, camelot_num, key_camelot, bpm, key, key_scale, mtime_ns, size) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            rel_path,
+            category,
+            camelot_number(camelot),
+            camelot,
+            float(meta.get("bpm", 120.0)),
+            meta.get("key"),
+            meta.get("key_scale"),
+            int(mtime_ns),
+            int(size),
+        ),
+    )
+
+
+def delete_samples(conn: sqlite3.Connection, rel_paths: Iterable[str]) -> None:
+    conn.executemany("DELETE FROM samples WHERE rel_path = ?", ((p,) for p in rel_paths))
+
+
+def query_compatible(
+    categories: list[str],
+    bpm_min: float,
+    bpm_max: float,
+    camelot_nums: list[int],
+    conn: Optional[sqlite3.Connection] = None,
+) -> list[tuple[str, dict]]:
+    """
+    (rel_path, metadata) con category ∈ categories, camelot_num ∈ camelot_nums y bpm en [bpm_min, bpm_max].
+    Orden: por categoría (el de categories) y luego por ruta, igual que el listado de directorios.
+    """
+    if not categories or not camelot_nums:
+        return []
+    conn = conn or connection()
+    cat_marks = ",".join("?" * len(categories))
+    num_marks = ",".join("?" * len(camelot_nums))
+    rows = conn.execute(
+        f"SELECT rel_path, category, bpm, key, key_scale, key_camelot FROM samples "
+        f"WHERE category IN ({cat_marks}) AND camelot_num IN ({num_marks}) AND bpm BETWEEN ? AND ?",
+        (*categories, *camelot_nums, bpm_min, bpm_max),
+    ).fetchall()
+    rank = {c: i for i, c in enumerate(categories)}
+    rows.sort(key=lambda r: (rank.get(r[1], len(rank)), r[0]))
+    return [
+        (r[0], {"bpm": r[2], "key": r[3], "key_scale": r[4], "key_camelot": r[5], "category": r[1]})
+        for r in rows
+    ]
+
+
+def count_samples(conn: Optional[sqlite3.Connection] = None) -> int:
+    conn = conn or connection()
+    return int(conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0])
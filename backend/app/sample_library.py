@@ -1,15 +1,24 @@
-"""Librería de samples para overlays IA: percussion, instruments, vocals. BPM/Key compatibles."""
+"""Librería de samples para overlays IA: percussion, instruments, vocals. BPM/Key compatibles.
+
+Las búsquedas solo leen el índice SQLite (sample_index); nunca analizan audio en el request.
+El índice lo construye scripts/index_samples.py (incremental por mtime/size, análisis en paralelo).
+"""
 from __future__ import annotations
 
 import json
+import os
+import sqlite3
+import sys
 from pathlib import Path
 from typing import Optional
 
+from . import sample_index
 from .analysis import analyze_song, key_to_camelot
 from .config import settings
 
 SAMPLE_CATEGORIES = ("percussion", "instruments", "vocals")
 _AUDIO_EXT = {".wav", ".mp3", ".flac", ".ogg", ".m4a"}
+_INDEX_WARNED = False
 
 
 def get_samples_dir() -> Path:
@@ -22,20 +31,31 @@ def _metadata_path(audio_path: Path) -> Path:
     return audio_path.with_suffix(audio_path.suffix + ".json")
 
 
-def get_sample_metadata(audio_path: Path, sr: Optional[int] = None) -> dict:
-    """
-    BPM y key_camelot de un sample. Lee sidecar .json si existe; si no, analiza y escribe cache.
-    Returns dict con bpm, key_camelot, key, key_scale.
-    """
+def read_sample_metadata(audio_path: Path) -> Optional[dict]:
+    """Metadata del sidecar .json si existe, es válido y no es más viejo que el audio; None si no (sin analizar)."""
     meta_path = _metadata_path(audio_path)
     if meta_path.exists():
         try:
+            if meta_path.stat().st_mtime_ns < audio_path.stat().st_mtime_ns:
+                return None  # audio reemplazado/editado in situ después del análisis
             with open(meta_path, "r", encoding="utf-8") as f:
                 data = json.load(f)
             if "bpm" in data and "key_camelot" in data:
                 return data
         except Exception:
             pass
+    return None
+
+
+def get_sample_metadata(audio_path: Path, sr: Optional[int] = None) -> dict:
+    """
+    BPM y key_camelot de un sample. Lee sidecar .json si existe; si no, analiza y escribe cache.
+    Returns dict con bpm, key_camelot, key, key_scale. Solo para el indexer (scripts/index_samples.py).
+    """
+    cached = read_sample_metadata(audio_path)
+    if cached is not None:
+        return cached
+    meta_path = _metadata_path(audio_path)
     try:
         analysis = analyze_song(audio_path, sr=sr or settings.default_sr)
         camelot = getattr(analysis, "key_camelot", None) or key_to_camelot(analysis.key, analysis.key_scale)
@@ -70,6 +90,34 @@ def list_samples(category: str) -> list[Path]:
     return out
 
 
+def scan_category(category: str) -> dict[str, tuple[Path, int, int]]:
+    """rel_path → (path, mtime_ns, size) de los audios en assets/samples/{category} (un solo scandir)."""
+    folder = get_samples_dir() / category
+    out: dict[str, tuple[Path, int, int]] = {}
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return out
+    for entry in entries:
+        if Path(entry.name).suffix.lower() not in _AUDIO_EXT:
+            continue
+        try:
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+        except OSError:
+            continue
+        out[f"{category}/{entry.name}"] = (Path(entry.path), st.st_mtime_ns, st.st_size)
+    return out
+
+
+def dir_mtime_ns(category: str) -> int:
+    try:
+        return (get_samples_dir() / category).stat().st_mtime_ns
+    except OSError:
+        return 0
+
+
 def _camelot_distance(c1: str, c2: str) -> int:
     """Distancia en rueda Camelot (0 = mismo/relativo, 1 = vecino, 2+ = lejano)."""
     if not c1 or not c2:
@@ -99,17 +147,54 @@ def get_compatible_samples(
     - BPM dentro de [bpm - bpm_tolerance, bpm + bpm_tolerance].
     - Key: misma o vecina en Camelot (distance <= max_camelot_distance).
     Returns list of (path, metadata) for use in overlay selection.
+    Búsqueda por rango en el índice SQLite (solo lectura); si el índice no está disponible,
+    escanea directorios leyendo solo sidecars (samples sin analizar se ignoran).
     """
-    result: list[tuple[Path, dict]] = []
+    global _INDEX_WARNED
     bpm_min = max(1.0, bpm - bpm_tolerance)
     bpm_max = bpm + bpm_tolerance
     key_camelot = (key_camelot or "").strip().upper() or "8A"
-
+    cats = [c for c in categories if c in SAMPLE_CATEGORIES]
+    try:
+        rows = sample_index.query_compatible(
+            cats, bpm_min, bpm_max, sample_index.camelot_neighbours(key_camelot, max_camelot_distance)
+        )
+        if not rows and not _INDEX_WARNED and sample_index.count_samples() == 0:
+            _INDEX_WARNED = True
+            print(
+                f"[sample_library] índice vacío ({sample_index.index_path()}); correr scripts/index_samples.py",
+                file=sys.stderr,
+                flush=True,
+            )
+        base = get_samples_dir()
+        return [(base / rel, meta) for rel, meta in rows]
+    except (sqlite3.Error, OSError) as e:
+        if not _INDEX_WARNED:
+            _INDEX_WARNED = True
+            print(
+                f"[sample_library] índice no disponible ({e}); escaneando sidecars. Correr scripts/index_samples.py",
+                file=sys.stderr,
+                flush=True,
+            )
+    return _scan_compatible_samples(bpm_min, bpm_max, key_camelot, cats, max_camelot_distance)
+
+
+def _scan_compatible_samples(
+    bpm_min: float,
+    bpm_max: float,
+    key_camelot: str,
+    categories: list[str],
+    max_camelot_distance: int,
+) -> list[tuple[Path, dict]]:
+    """Búsqueda sin índice: lista cada categoría y lee el sidecar de cada sample (sin analizar)."""
+    result: list[tuple[Path, dict]] = []
     for cat in categories:
         if cat not in SAMPLE_CATEGORIES:
             continue
         for path in list_samples(cat):
-            meta = get_sample_metadata(path)
+            meta = read_sample_metadata(path)
+            if meta is None:
+                continue
             meta_bpm = float(meta.get("bpm", 120))
             meta_key = (meta.get("key_camelot") or "").strip().upper()
             if not (bpm_min <= meta_bpm <= bpm_max):
@@ -1,12 +1,13 @@
-"""Sequencer Agent: ordena tracks por curva de energía (BPM) y transiciones armónicas (Camelot)."""
+"""Sequencer Agent: ordena tracks por curva de energía (BPM) y transiciones armónicas (Camelot) vía set_planner."""
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Sequence, Union
 
-from .analysis import analyze_song, harmonic_distance_camelot
+from .analysis import analyze_song
 from .config import settings
 from .models import SongAnalysis
+from .set_planner import plan_order, plan_to_curve, track_features, transition_cost_matrix
 
 
 def analyze_tracks(paths: list[Path], sr: Optional[int] = None) -> list[tuple[Path, SongAnalysis]]:
@@ -27,43 +28,30 @@ def analyze_tracks(paths: list[Path], sr: Optional[int] = None) -> list[tuple[Pa
 def sort_playlist(
     analyzed: list[tuple[Path, SongAnalysis]],
     energy_curve_ascending: bool = True,
+    time_budget_sec: Optional[float] = None,
+    energy_curve: Optional[Union[str, Sequence[float]]] = None,
 ) -> list[tuple[Path, SongAnalysis]]:
     """
-    Ordena la lista: curva de energía (BPM ascendente por defecto) y transiciones armónicas.
-    - Primario: BPM (ascendente = subida de energía).
-    - Secundario: preferir siguiente track con menor distancia Camelot (greedy).
+    Ordena la lista minimizando el costo total del set (set_planner): distancia Camelot, delta de BPM,
+    stretch necesario y dirección de la curva de energía (BPM/energía ascendente por defecto).
+    Exacto (DP) para crates chicos; 2-opt/Or-opt bajo presupuesto de tiempo para crates grandes.
+    energy_curve: preset (warmup_peak_cooldown, peak, closing, ...) o lista de intensidades 0-1;
+    si se pasa, el orden sigue esa forma en lugar de la curva ascendente/descendente.
     """
     if len(analyzed) <= 1:
         return list(analyzed)
 
-    # Orden inicial por BPM
-    sorted_by_bpm = sorted(
-        analyzed,
-        key=lambda x: x[1].bpm,
-        reverse=not energy_curve_ascending,
-    )
+    features = track_features([a for _, a in analyzed])
+    budget = settings.planner_time_budget_sec if time_budget_sec is None else time_budget_sec
+    if energy_curve is not None:
+        order = plan_to_curve(features, energy_curve, time_budget_sec=budget)
+        return [analyzed[i] for i in order]
 
-    # Ajuste greedy por Camelot: para cada posición, elegir el siguiente que minimice harmonic_distance
-    ordered: list[tuple[Path, SongAnalysis]] = [sorted_by_bpm[0]]
-    remaining = list(sorted_by_bpm[1:])
-
-    while remaining:
-        last_analysis = ordered[-1][1]
-        camelot_last = getattr(last_analysis, "key_camelot", None) or ""
-        best_idx = 0
-        best_dist = 10
-        best_bpm_diff = 999.0
-        for i, (_, a) in enumerate(remaining):
-            camelot_a = getattr(a, "key_camelot", None) or ""
-            dist = harmonic_distance_camelot(camelot_last, camelot_a)
-            bpm_diff = abs(a.bpm - last_analysis.bpm)
-            if dist < best_dist or (dist == best_dist and bpm_diff < best_bpm_diff):
-                best_dist = dist
-                best_bpm_diff = bpm_diff
-                best_idx = i
-        ordered.append(remaining.pop(best_idx))
-
-    return ordered
+    cost = transition_cost_matrix(features, ascending=energy_curve_ascending)
+    # Orden por BPM como candidato inicial (equivale al comportamiento previo sin el ajuste Camelot)
+    by_bpm = sorted(range(len(analyzed)), key=lambda i: analyzed[i][1].bpm, reverse=not energy_curve_ascending)
+    order = plan_order(cost, time_budget_sec=budget, initial=by_bpm)
+    return [analyzed[i] for i in order]
 
 
 def build_roadmap(
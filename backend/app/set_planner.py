@@ -0,0 +1,431 @@
+"""Set planner: orden global de tracks como camino de costo mínimo (TSP abierto).
+
+Matriz de costos vectorizada sobre todos los pares (distancia Camelot, delta de BPM, stretch necesario,
+dirección de la curva de energía). Resuelve exacto con DP (Held-Karp) para crates chicos y con
+nearest-neighbour + 2-opt + Or-opt (búsqueda local vectorizada) bajo presupuesto de tiempo para crates grandes.
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .models import SongAnalysis
+
+# Hasta este tamaño el DP exacto es barato (O(n² 2ⁿ) vectorizado por capas de popcount)
+EXACT_DP_MAX_TRACKS = 12
+DEFAULT_TIME_BUDGET_SEC = 0.5
+# Distancia Camelot cuando la key es desconocida (igual que analysis.harmonic_distance_camelot)
+UNKNOWN_CAMELOT_DISTANCE = 6
+
+
+@dataclass
+class PlannerWeights:
+    """Pesos del costo de transición (unidades: ~1 = un paso en la rueda Camelot)."""
+
+    key: float = 1.0
+    bpm: float = 0.25  # por BPM de diferencia (4 BPM ≈ un paso Camelot)
+    stretch: float = 40.0  # por unidad de stretch por encima de stretch_free
+    stretch_free: float = 0.06  # hasta 6% de time-stretch no se penaliza
+    direction: float = 0.5  # por BPM en contra de la curva (bajar en una subida)
+    energy: float = 3.0  # por caída/subida de energía (0-1) en contra de la curva
+    curve: float = 8.0  # por unidad de desvío (0-1) entre la intensidad del track y la curva objetivo
+
+
+@dataclass
+class TrackFeatures:
+    """Matriz de features por track (precomputada una vez; replanificar no re-analiza)."""
+
+    bpm: np.ndarray  # float64 (n,)
+    energy: np.ndarray  # float64 (n,) 0-1
+    camelot_num: np.ndarray  # int16 (n,) 1-12, 0 = desconocida
+
+    def __len__(self) -> int:
+        return int(self.bpm.shape[0])
+
+
+def _camelot_number(camelot: Optional[str]) -> int:
+    c = (camelot or "").strip().upper()
+    try:
+        n = int(c[:-1])
+    except (ValueError, IndexError):
+        return 0
+    return n if 1 <= n <= 12 else 0
+
+
+def track_features(analyses: Sequence[SongAnalysis]) -> TrackFeatures:
+    """Extrae BPM, energía y número Camelot de cada análisis en arrays NumPy."""
+    return TrackFeatures(
+        bpm=np.array([float(a.bpm) for a in analyses], dtype=np.float64),
+        energy=np.array([float(a.energy) for a in analyses], dtype=np.float64),
+        camelot_num=np.array([_camelot_number(getattr(a, "key_camelot", None)) for a in analyses], dtype=np.int16),
+    )
+
+
+def camelot_distance_matrix(camelot_num: np.ndarray) -> np.ndarray:
+    """Distancias Camelot par a par (mismo número = 0, relativo incluido; circular en 12)."""
+    n = camelot_num.astype(np.int32)
+    d = np.abs(n[:, None] - n[None, :])
+    d = np.minimum(d, 12 - d)
+    unknown = (n[:, None] == 0) | (n[None, :] == 0)
+    return np.where(unknown, UNKNOWN_CAMELOT_DISTANCE, d).astype(np.float64)
+
+
+def transition_cost_matrix(
+    features: TrackFeatures,
+    ascending: Optional[bool] = True,
+    weights: Optional[PlannerWeights] = None,
+) -> np.ndarray:
+    """
+    C[i, j] = costo de mezclar i → j. Asimétrica: la dirección de BPM/energía respecto de la curva
+    (ascendente o descendente) se penaliza solo en contra. ascending=None: sin término de dirección
+    (la forma del set la impone una curva objetivo, ver plan_to_curve). Diagonal = inf.
+    """
+    w = weights or PlannerWeights()
+    bpm, energy = features.bpm, features.energy
+    d_bpm = bpm[None, :] - bpm[:, None]  # bpm_j - bpm_i
+    d_energy = energy[None, :] - energy[:, None]
+    safe_bpm = np.where(bpm > 0, bpm, 1.0)
+    stretch = np.abs(1.0 - bpm[:, None] / safe_bpm[None, :])
+
+    cost = w.key * camelot_distance_matrix(features.camelot_num)
+    cost += w.bpm * np.abs(d_bpm)
+    cost += w.stretch * np.maximum(0.0, stretch - w.stretch_free)
+    if ascending is not None:
+        sign = 1.0 if ascending else -1.0
+        cost += w.direction * np.maximum(0.0, -sign * d_bpm)
+        cost += w.energy * np.maximum(0.0, -sign * d_energy)
+    np.fill_diagonal(cost, np.inf)
+    return cost
+
+
+def path_cost(cost: np.ndarray, order: Sequence[int]) -> float:
+    """Costo total del camino (suma de transiciones consecutivas)."""
+    idx = np.asarray(order, dtype=np.intp)
+    if idx.size < 2:
+        return 0.0
+    return float(cost[idx[:-1], idx[1:]].sum())
+
+
+# ---------------------------------------------------------------------------
+# Exacto: Held-Karp (camino abierto, inicio libre)
+# ---------------------------------------------------------------------------
+
+def _held_karp_path(cost: np.ndarray) -> list[int]:
+    n = cost.shape[0]
+    full = (1 << n) - 1
+    dp = np.full((1 << n, n), np.inf)
+    parent = np.full((1 << n, n), -1, dtype=np.int16)
+    bits = 1 << np.arange(n)
+    dp[bits, np.arange(n)] = 0.0
+    cost_t = cost.T  # cost_t[j, i] = cost[i, j]
+    masks = np.arange(1 << n)
+    popcount = np.array([bin(m).count("1") for m in range(1 << n)])
+    for k in range(2, n + 1):
+        layer = masks[popcount == k]  # (m,)
+        prev = layer[:, None] ^ bits[None, :]  # (m, n): máscara sin j
+        in_mask = (layer[:, None] & bits[None, :]) != 0  # j ∈ mask
+        cand = dp[prev] + cost_t[None, :, :]  # (m, j, i)
+        best_i = np.argmin(cand, axis=2)
+        best = np.take_along_axis(cand, best_i[:, :, None], axis=2)[:, :, 0]
+        best = np.where(in_mask, best, np.inf)
+        dp[layer] = best
+        parent[layer] = np.where(in_mask, best_i, -1)
+    last = int(np.argmin(dp[full]))
+    order = [last]
+    mask = full
+    while len(order) < n:
+        prev = int(parent[mask, last])
+        mask ^= 1 << last
+        last = prev
+        order.append(last)
+    order.reverse()
+    return order
+
+
+# ---------------------------------------------------------------------------
+# Heurístico: nearest neighbour + 2-opt + Or-opt (vectorizados), con presupuesto de tiempo
+# ---------------------------------------------------------------------------
+
+def _nearest_neighbour(cost: np.ndarray, start: int) -> list[int]:
+    n = cost.shape[0]
+    visited = np.zeros(n, dtype=bool)
+    order = [start]
+    visited[start] = True
+    current = start
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, cost[current])
+        current = int(np.argmin(row))
+        visited[current] = True
+        order.append(current)
+    return order
+
+
+def _with_dummy(cost: np.ndarray) -> np.ndarray:
+    """Agrega un nodo ficticio (último índice) con costo 0: el camino abierto se vuelve un tour fijo en sus extremos."""
+    n = cost.shape[0]
+    ext = np.zeros((n + 1, n + 1))
+    ext[:n, :n] = np.where(np.isfinite(cost), cost, 1e9)
+    return ext
+
+
+def _two_opt_pass(c: np.ndarray, t: np.ndarray, deadline: float) -> bool:
+    """Una pasada de 2-opt asimétrico sobre t = [d, ..., d]. Devuelve True si mejoró algo."""
+    improved = False
+    m = t.shape[0] - 1  # último índice (dummy)
+    i = 0
+    while i < m - 2:
+        if time.perf_counter() > deadline:
+            return improved
+        fwd = c[t[:-1], t[1:]]  # fwd[k] = c[t_k, t_k+1]
+        bwd = c[t[1:], t[:-1]]
+        prefix = np.concatenate(([0.0], np.cumsum(bwd - fwd)))
+        j = np.arange(i + 2, m)  # segmento invertido t[i+1..j], j+1 <= m
+        delta = (
+            c[t[i], t[j]]
+            + c[t[i + 1], t[j + 1]]
+            - fwd[i]
+            - fwd[j]
+            + prefix[j]
+            - prefix[i + 1]
+        )
+        best = int(np.argmin(delta))
+        if delta[best] < -1e-9:
+            jb = int(j[best])
+            t[i + 1: jb + 1] = t[i + 1: jb + 1][::-1].copy()
+            improved = True
+            continue  # re-evaluar el mismo i con el tour nuevo
+        i += 1
+    return improved
+
+
+def _or_opt_pass(c: np.ndarray, t: np.ndarray, deadline: float, max_len: int = 3) -> bool:
+    """Una pasada de Or-opt: mover segmentos de 1..max_len tracks a la mejor posición (vectorizado sobre destinos)."""
+    improved = False
+    m = t.shape[0] - 1
+    for seg_len in range(1, max_len + 1):
+        a = 1
+        while a + seg_len - 1 <= m - 1:
+            if time.perf_counter() > deadline:
+                return improved
+            b = a + seg_len - 1  # segmento t[a..b]
+            first, last = t[a], t[b]
+            removal = c[t[a - 1], t[b + 1]] - c[t[a - 1], first] - c[last, t[b + 1]]
+            p = np.arange(0, m)  # insertar entre t[p] y t[p+1]
+            p = p[(p < a - 1) | (p > b)]
+            if p.size:
+                insertion = c[t[p], first] + c[last, t[p + 1]] - c[t[p], t[p + 1]]
+                delta = removal + insertion
+                best = int(np.argmin(delta))
+                if delta[best] < -1e-9:
+                    pb = int(p[best])
+                    seg = t[a: b + 1].copy()
+                    rest = np.concatenate((t[:a], t[b + 1:]))
+                    pos = pb + 1 if pb < a else pb + 1 - seg_len
+                    t[:] = np.concatenate((rest[:pos], seg, rest[pos:]))
+                    improved = True
+                    continue
+            a += 1
+    return improved
+
+
+def _local_search(cost: np.ndarray, order: list[int], deadline: float) -> list[int]:
+    n = cost.shape[0]
+    c = _with_dummy(cost)
+    t = np.array([n, *order, n], dtype=np.intp)
+    while time.perf_counter() < deadline:
+        improved = _two_opt_pass(c, t, deadline)
+        improved = _or_opt_pass(c, t, deadline) or improved
+        if not improved:
+            break
+    return [int(x) for x in t[1:-1]]
+
+
+def plan_order(
+    cost: np.ndarray,
+    time_budget_sec: float = DEFAULT_TIME_BUDGET_SEC,
+    initial: Optional[Sequence[int]] = None,
+) -> list[int]:
+    """
+    Orden de índices que minimiza path_cost(cost, order).
+    n <= EXACT_DP_MAX_TRACKS: óptimo exacto. Si no: mejor de (initial, nearest-neighbour) + 2-opt/Or-opt hasta time_budget_sec.
+    """
+    n = cost.shape[0]
+    if n <= 2:
+        if n == 2 and cost[1, 0] < cost[0, 1]:
+            return [1, 0]
+        return list(range(n))
+    if n <= EXACT_DP_MAX_TRACKS:
+        return _held_karp_path(cost)
+
+    deadline = time.perf_counter() + max(0.0, time_budget_sec)
+    # Arranque: nearest-neighbour desde el track con menor costo de salida promedio, vs. el orden inicial dado
+    finite = np.where(np.isfinite(cost), cost, np.nan)
+    start = int(np.nanargmin(np.nanmean(finite, axis=1)))
+    candidates = [_nearest_neighbour(cost, start)]
+    if initial is not None and len(initial) == n:
+        candidates.append([int(x) for x in initial])
+    order = min(candidates, key=lambda o: path_cost(cost, o))
+    return _local_search(cost, order, deadline)
+
+
+# ---------------------------------------------------------------------------
+# Curvas objetivo de energía/BPM (warm-up → peak → cool-down, custom)
+# ---------------------------------------------------------------------------
+
+# Puntos de control (posición 0-1 en el set → intensidad objetivo 0-1); se interpolan a n posiciones
+ENERGY_CURVE_PRESETS: dict[str, tuple[tuple[float, ...], tuple[float, ...]]] = {
+    "ascending": ((0.0, 1.0), (0.1, 1.0)),
+    "descending": ((0.0, 1.0), (1.0, 0.1)),
+    "flat": ((0.0, 1.0), (0.5, 0.5)),
+    "warmup": ((0.0, 0.6, 1.0), (0.1, 0.5, 0.7)),
+    "peak": ((0.0, 0.2, 0.8, 1.0), (0.6, 0.9, 1.0, 0.9)),
+    "closing": ((0.0, 0.3, 1.0), (0.9, 0.7, 0.1)),
+    "warmup_peak_cooldown": ((0.0, 0.35, 0.7, 0.85, 1.0), (0.1, 0.55, 1.0, 0.8, 0.3)),
+}
+
+
+def energy_curve_targets(curve: str | Sequence[float], n: int) -> np.ndarray:
+    """
+    Intensidad objetivo (0-1) por posición del set. curve: nombre de preset o lista de valores
+    (cualquier largo, se re-muestrea a n posiciones; se normaliza si excede 0-1). ValueError si es inválida.
+    """
+    if n <= 0:
+        return np.zeros(0)
+    positions = np.linspace(0.0, 1.0, n)
+    if isinstance(curve, str):
+        key = curve.strip().lower().replace("-", "_")
+        if key not in ENERGY_CURVE_PRESETS:
+            raise ValueError(f"Unknown energy curve preset: {curve!r} (options: {', '.join(ENERGY_CURVE_PRESETS)})")
+        xp, fp = ENERGY_CURVE_PRESETS[key]
+        return np.interp(positions, xp, fp)
+    values = np.asarray(list(curve), dtype=np.float64)
+    if values.size == 0 or not np.all(np.isfinite(values)):
+        raise ValueError("Custom energy curve must be a non-empty list of numbers")
+    if values.min() < 0.0 or values.max() > 1.0:
+        span = values.max() - values.min()
+        values = (values - values.min()) / span if span > 0 else np.full_like(values, 0.5)
+    if values.size == 1:
+        return np.full(n, float(values[0]))
+    return np.interp(positions, np.linspace(0.0, 1.0, values.size), values)
+
+
+def parse_energy_curve(value: Optional[str]) -> Optional[str | list[float]]:
+    """
+    Curva desde un parámetro de request: nombre de preset, "0.2,0.8,0.4" o JSON "[0.2, 0.8, 0.4]".
+    None/"" → None (curva ascendente clásica). ValueError si es inválida.
+    """
+    text = (value or "").strip()
+    if not text:
+        return None
+    if text[0].isalpha():
+        energy_curve_targets(text, 2)  # valida el preset
+        return text.lower().replace("-", "_")
+    try:
+        values = [float(v) for v in text.strip("[]").split(",") if v.strip()]
+    except ValueError:
+        raise ValueError(f"Invalid energy curve: {value!r}") from None
+    energy_curve_targets(values, 2)
+    return values
+
+
+def track_intensity(features: TrackFeatures) -> np.ndarray:
+    """Intensidad 0-1 por track: promedio de energía y BPM normalizados (min-max dentro del crate)."""
+    def norm(x: np.ndarray) -> np.ndarray:
+        span = float(x.max() - x.min()) if x.size else 0.0
+        return (x - x.min()) / span if span > 0 else np.full_like(x, 0.5)
+
+    return 0.5 * norm(features.energy) + 0.5 * norm(features.bpm)
+
+
+def curve_cost_matrix(features: TrackFeatures, targets: np.ndarray, weight: float) -> np.ndarray:
+    """P[i, p] = costo de poner el track i en la posición p (desvío respecto de la curva)."""
+    return weight * np.abs(track_intensity(features)[:, None] - targets[None, :])
+
+
+def curve_path_cost(cost: np.ndarray, position_cost: np.ndarray, order: Sequence[int]) -> float:
+    """Costo total con curva: transiciones + desvío de cada track respecto de su posición."""
+    idx = np.asarray(order, dtype=np.intp)
+    return path_cost(cost, order) + float(position_cost[idx, np.arange(idx.size)].sum())
+
+
+def _swap_pass(c: np.ndarray, pc: np.ndarray, t: np.ndarray, deadline: float) -> bool:
+    """
+    Pasada de swaps (vectorizada sobre el segundo índice) con costo por posición.
+    t = [d, ..., d] con dummy en los extremos; el track en t[k] ocupa la posición k-1.
+    """
+    improved = False
+    m = t.shape[0] - 1
+    a = 1
+    while a <= m - 2:
+        if time.perf_counter() > deadline:
+            return improved
+        ta = t[a]
+        # b = a + 1 (adyacentes)
+        b = a + 1
+        tb = t[b]
+        delta_adj = (
+            c[t[a - 1], tb] + c[tb, ta] + c[ta, t[b + 1]]
+            - c[t[a - 1], ta] - c[ta, tb] - c[tb, t[b + 1]]
+            + pc[tb, a - 1] + pc[ta, b - 1] - pc[ta, a - 1] - pc[tb, b - 1]
+        )
+        best_delta, best_b = delta_adj, b
+        # b >= a + 2 (no adyacentes)
+        bs = np.arange(a + 2, m)
+        if bs.size:
+            tbs = t[bs]
+            delta = (
+                c[t[a - 1], tbs] + c[tbs, t[a + 1]] + c[t[bs - 1], ta] + c[ta, t[bs + 1]]
+                - c[t[a - 1], ta] - c[ta, t[a + 1]] - c[t[bs - 1], tbs] - c[tbs, t[bs + 1]]
+                + pc[tbs, a - 1] + pc[ta, bs - 1] - pc[ta, a - 1] - pc[tbs, bs - 1]
+            )
+            k = int(np.argmin(delta))
+            if delta[k] < best_delta:
+                best_delta, best_b = float(delta[k]), int(bs[k])
+        if best_delta < -1e-9:
+            t[a], t[best_b] = t[best_b], t[a]
+            improved = True
+            continue
+        a += 1
+    return improved
+
+
+def plan_to_curve(
+    features: TrackFeatures,
+    curve: str | Sequence[float],
+    cost: Optional[np.ndarray] = None,
+    weights: Optional[PlannerWeights] = None,
+    time_budget_sec: float = DEFAULT_TIME_BUDGET_SEC,
+) -> list[int]:
+    """
+    Orden que sigue una curva objetivo de intensidad (energía + BPM) minimizando además el costo de transición.
+    cost: matriz de transición precomputada sin dirección (transition_cost_matrix(..., ascending=None));
+    pasarla permite re-planificar a otra curva en milisegundos sin recalcular nada del crate.
+    Arranque: asignación óptima track→posición (Hungarian); luego swaps vectorizados bajo presupuesto.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    w = weights or PlannerWeights()
+    n = len(features)
+    if n <= 1:
+        return list(range(n))
+    if cost is None:
+        cost = transition_cost_matrix(features, ascending=None, weights=w)
+    targets = energy_curve_targets(curve, n)
+    pc = curve_cost_matrix(features, targets, w.curve)
+    deadline = time.perf_counter() + max(0.0, time_budget_sec)
+
+    rows, cols = linear_sum_assignment(pc)
+    order = [0] * n
+    for track, pos in zip(rows, cols):
+        order[pos] = int(track)
+
+    c = _with_dummy(cost)
+    pc_ext = np.vstack([pc, np.zeros((1, n))])  # dummy sin costo de posición
+    t = np.array([n, *order, n], dtype=np.intp)
+    while time.perf_counter() < deadline:
+        if not _swap_pass(c, pc_ext, t, deadline):
+            break
+    return [int(x) for x in t[1:-1]]
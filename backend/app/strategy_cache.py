@@ -0,0 +1,153 @@
+"""Cache de strategies: memoiza la decisión del LLM por (análisis A, análisis B, prompt armado, reglas admin).
+
+Redis (TTL + LRU) cuando redis_url está configurado; si no, LRU en memoria del proceso.
+Se invalida al cambiar las reglas en admin (set_admin_config) y además la key incluye el hash de las reglas.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+from .admin_config import get_admin_config, get_system_prompt
+from .config import settings
+from .metrics import cache_event
+from .models import MixStrategy, SongAnalysis
+
+# Claves de admin_config que cambian la decisión (presets no se usan en decision.py)
+_RULE_KEYS = (
+    "mix_sensitivity",
+    "default_bars",
+    "bass_swap_intensity",
+    "allow_instruments_ai",
+    "allow_vocals_ai",
+)
+
+# Fallback sin Redis: key -> (stored_at, strategy_json). Lo usan a la vez los pipelines del threadpool de la API:
+# move_to_end/popitem sobre un OrderedDict no son atómicos entre sí
+_MEMORY_LOCK = threading.Lock()
+_MEMORY: "OrderedDict[str, tuple[float, dict[str, Any]]]" = OrderedDict()
+_MEMORY_STATS: dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+
+def _sha(obj: Any) -> str:
+    raw = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def analysis_fingerprint(analysis: SongAnalysis) -> str:
+    """Hash del contenido del análisis (sin path: el mismo track subido en otra sesión da el mismo hash)."""
+    return _sha(analysis.model_dump(mode="json", exclude={"path"}))
+
+
+def rules_fingerprint() -> str:
+    """Hash del system prompt activo + sliders relevantes de admin_config."""
+    cfg = get_admin_config()
+    return _sha({"system_prompt": get_system_prompt(), **{k: cfg.get(k) for k in _RULE_KEYS}})
+
+
+def strategy_cache_key(
+    analysis_a: SongAnalysis,
+    analysis_b: SongAnalysis,
+    messages: list[dict[str, str]],
+    *,
+    only_two_songs: bool = False,
+    compatible_overlays: Optional[list[tuple[Path, dict]]] = None,
+    cloud_compatible_overlays: Optional[list[dict[str, Any]]] = None,
+) -> str:
+    """
+    Key determinística del cache. messages = prompt ya armado (system + user): cubre todo lo que el builder
+    consume (metadata, estructura, assets disponibles, estilo). Análisis, reglas y overlays se suman porque el
+    post-proceso de la respuesta los usa (clamps, paths de overlays).
+    """
+    return _sha({
+        "a": analysis_fingerprint(analysis_a),
+        "b": analysis_fingerprint(analysis_b),
+        "prompt": _sha(messages),
+        "rules": rules_fingerprint(),
+        "model": settings.mix_decision_model,
+        "only_two_songs": bool(only_two_songs),
+        "overlays": sorted(p.name for p, _ in (compatible_overlays or [])),
+        "cloud": sorted(str(e.get("url", "")) for e in (cloud_compatible_overlays or [])),
+    })
+
+
+def get_cached_strategy(key: str) -> Optional[MixStrategy]:
+    """Strategy cacheada o None. Cuenta hit/miss para las métricas."""
+    if not settings.strategy_cache_enabled:
+        return None
+    ttl = settings.strategy_cache_ttl_sec
+    data: Optional[dict[str, Any]] = None
+    if settings.use_celery:
+        from .redis_store import get_cached_strategy as redis_get, incr_strategy_cache_stat
+        data = redis_get(key, ttl)
+        incr_strategy_cache_stat("hits" if data is not None else "misses")
+    else:
+        with _MEMORY_LOCK:
+            entry = _MEMORY.get(key)
+            if entry is not None and time.time() - entry[0] <= ttl:
+                _MEMORY.move_to_end(key)
+                data = entry[1]
+            elif entry is not None:
+                _MEMORY.pop(key, None)
+            _MEMORY_STATS["hits" if data is not None else "misses"] += 1
+    cache_event("strategy", "hit" if data is not None else "miss")
+    if data is None:
+        return None
+    try:
+        return MixStrategy.model_validate(data)
+    except Exception:
+        return None
+
+
+def store_strategy(key: str, strategy: MixStrategy) -> None:
+    """Guarda la strategy (JSON) con TTL y desalojo LRU."""
+    if not settings.strategy_cache_enabled:
+        return
+    data = strategy.model_dump(mode="json")
+    max_entries = max(1, settings.strategy_cache_max_entries)
+    if settings.use_celery:
+        from .redis_store import incr_strategy_cache_stat, set_cached_strategy
+        set_cached_strategy(key, data, settings.strategy_cache_ttl_sec, max_entries)
+        incr_strategy_cache_stat("stores")
+        return
+    with _MEMORY_LOCK:
+        _MEMORY[key] = (time.time(), data)
+        _MEMORY.move_to_end(key)
+        _MEMORY_STATS["stores"] += 1
+        while len(_MEMORY) > max_entries:
+            _MEMORY.popitem(last=False)
+            _MEMORY_STATS["evictions"] += 1
+
+
+def invalidate_strategy_cache() -> int:
+    """Vacía el cache (llamado desde set_admin_config). Devuelve cantidad de entradas borradas."""
+    if settings.use_celery:
+        from .redis_store import clear_cached_strategies
+        return clear_cached_strategies()
+    with _MEMORY_LOCK:
+        removed = len(_MEMORY)
+        _MEMORY.clear()
+        _MEMORY_STATS["invalidations"] += 1
+    return removed
+
+
+def get_strategy_cache_stats() -> dict[str, Any]:
+    """hits, misses, stores, evictions, invalidations, entries y hit_rate (0-1)."""
+    stats: dict[str, Any]
+    if settings.use_celery:
+        from .redis_store import get_strategy_cache_stats as redis_stats
+        stats = redis_stats() or {}
+    else:
+        with _MEMORY_LOCK:
+            stats = {**_MEMORY_STATS, "entries": len(_MEMORY)}
+    for k in ("hits", "misses", "stores", "evictions", "invalidations", "entries"):
+        stats.setdefault(k, 0)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    stats["enabled"] = settings.strategy_cache_enabled
+    return stats
@@ -2,14 +2,28 @@
 from __future__ import annotations
 
 import shutil
-import subprocess
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Union
 
-from celery import chord, group
-from .celery_app import app
+from .analysis_codec import analysis_from_ref, analysis_ref
+from .celery_app import QUEUE_INTERACTIVE, app
 from .config import settings
-from .redis_store import get_job, publish_progress, set_job
+from .redis_store import (
+    acquire_render_slot,
+    clear_render_state,
+    get_done_segments,
+    get_job,
+    get_segment_plan,
+    mark_segment_done,
+    publish_progress,
+    put_segment_plan,
+    release_render_slot,
+    set_job,
+    update_job,
+)
+from .memory import memory_stage
+from .metrics import session_finished, session_started, stage
+from .tracing import set_attributes
 from .render import render_mix
 from .models import MixStrategy, SongAnalysis
 from .sequencer import analyze_tracks, build_roadmap, sort_playlist
@@ -19,7 +33,8 @@ from .sample_library import get_compatible_samples
 from .utils.scanner import scan_assets
 from .audio.cloud_assets import get_cloud_compatible_samples
 from .audio.analyzer import get_audio_metadata
-from .audio_analyzer import analyze_track_structure
+from .audio.tools import run_tool
+from .audio_analyzer import cached_track_structure
 
 
 def _delete_session_dir(session_dir: Path) -> None:
@@ -31,11 +46,29 @@ def _delete_session_dir(session_dir: Path) -> None:
             pass
 
 
+def strategy_payload(strategy: MixStrategy) -> dict:
+    """MixStrategy como dict JSON para el plan de render (overlays con paths como str)."""
+    strategy_dict = strategy.model_dump(mode="json")
+    if getattr(strategy, "overlay_paths", None):
+        strategy_dict["overlay_paths"] = [str(p) for p in strategy.overlay_paths]
+    if getattr(strategy, "overlay_instrument_url", None):
+        strategy_dict["overlay_instrument_url"] = strategy.overlay_instrument_url
+    if getattr(strategy, "overlay_vocal_url", None):
+        strategy_dict["overlay_vocal_url"] = strategy.overlay_vocal_url
+    if getattr(strategy, "overlay_instrument_bpm", None) is not None:
+        strategy_dict["overlay_instrument_bpm"] = strategy.overlay_instrument_bpm
+    if getattr(strategy, "overlay_vocal_bpm", None) is not None:
+        strategy_dict["overlay_vocal_bpm"] = strategy.overlay_vocal_bpm
+    return strategy_dict
+
+
 @app.task(bind=True, name="app.tasks.run_folder_pipeline", queue="ai_brain")
-def run_folder_pipeline(self, session_id: str, session_dir_str: str) -> None:
+def run_folder_pipeline(self, session_id: str, session_dir_str: str, energy_curve: Optional[Union[str, list]] = None) -> None:
     """
     AI-brain / Sequencer: trabaja en session_dir (temp). Try/finally: si falla, borra session_dir.
-    Encola render_segment en audio_worker y finalize_set al terminar.
+    Pipeline: cada render_segment se encola apenas su MixStrategy está decidida (la decisión del segmento i+1
+    se solapa con el render del i); el render que completa el set encola finalize_set (ensamblado en orden).
+    energy_curve: preset o lista de intensidades (ver set_planner.parse_energy_curve); None = ascendente.
     """
     work_dir = Path(session_dir_str)
     if not work_dir.exists():
@@ -48,6 +81,7 @@ def run_folder_pipeline(self, session_id: str, session_dir_str: str) -> None:
     publish_progress(session_id, {"phase": "analyzing", "message": "Analizando armonía y BPM de los tracks..."})
 
     succeeded = False
+    session_started(session_id, "set")
     try:
         if len(paths) < 2:
             set_job(session_id, {"status": "failed", "error": "Need at least 2 tracks"})
@@ -60,21 +94,20 @@ def run_folder_pipeline(self, session_id: str, session_dir_str: str) -> None:
 
         publish_progress(session_id, {"phase": "sequencing", "message": "Calculando secuencia óptima (Opus Engine)..."})
         set_job(session_id, {"status": "processing", "phase": "sequencing", "session_dir": session_dir_str})
-        ordered = sort_playlist(analyzed, energy_curve_ascending=True)
+        ordered = sort_playlist(analyzed, energy_curve_ascending=True, energy_curve=energy_curve)
         roadmap = build_roadmap(ordered)
         total_segments = len(roadmap)
+        set_attributes(tracks=len(analyzed), total_segments=total_segments)
         set_job(session_id, {"status": "processing", "phase": "rendering", "total_segments": total_segments, "session_dir": session_dir_str})
 
         tracklist_lines: List[str] = ["OPUS AI — Tracklist (Set completo)", "=" * 60]
-        segment_tasks = []
+        structures: dict = {}  # estructura por track (cada track aparece como A y como B)
+        refs: dict = {}  # clave de análisis por track
         for idx, (path_a, path_b, analysis_a, analysis_b) in enumerate(roadmap):
             metadata_a = get_audio_metadata(path_a) if path_a.exists() else {}
             metadata_b = get_audio_metadata(path_b) if path_b.exists() else {}
-            try:
-                track_structure_a = analyze_track_structure(path_a, sr=settings.default_sr)
-                track_structure_b = analyze_track_structure(path_b, sr=settings.default_sr)
-            except Exception:
-                track_structure_a = track_structure_b = None
+            track_structure_a = cached_track_structure(path_a, structures, sr=settings.default_sr)
+            track_structure_b = cached_track_structure(path_b, structures, sr=settings.default_sr)
             # Scanner de assets: antes de la IA, listar samples disponibles (local + cloud) e inyectar en el prompt (Productor Opus Quad)
             available_assets = scan_assets() if (get_allow_instruments_ai() or get_allow_vocals_ai()) else None
             compatible_overlays = None
@@ -94,17 +127,22 @@ def run_folder_pipeline(self, session_id: str, session_dir_str: str) -> None:
                     cloud_compatible_overlays = get_cloud_compatible_samples(
                         avg_bpm, camelot_mix, categories, bpm_tolerance=5.0, max_camelot_distance=1
                     )
-            strategy = get_mix_strategy(
-                analysis_a, analysis_b,
-                dj_style_prompt=None,
-                audio_metadata_a=metadata_a, audio_metadata_b=metadata_b,
-                track_structure_a=track_structure_a, track_structure_b=track_structure_b,
-                compatible_overlays=compatible_overlays,
-                available_assets=available_assets,
-                cloud_compatible_overlays=cloud_compatible_overlays,
-                only_two_songs=(total_segments == 1),
-            )
+            with memory_stage("decision", segment=idx + 1, track=f"{path_a.name} → {path_b.name}"):
+                strategy = get_mix_strategy(
+                    analysis_a, analysis_b,
+                    dj_style_prompt=None,
+                    audio_metadata_a=metadata_a, audio_metadata_b=metadata_b,
+                    track_structure_a=track_structure_a, track_structure_b=track_structure_b,
+                    compatible_overlays=compatible_overlays,
+                    available_assets=available_assets,
+                    cloud_compatible_overlays=cloud_compatible_overlays,
+                    only_two_songs=(total_segments == 1),
+                )
             seg_path = work_dir / f"seg_{idx}.wav"
+            # Análisis por clave (Redis, float32 binario): el task lleva ~32 bytes en vez de miles de floats
+            for p, a in ((path_a, analysis_a), (path_b, analysis_b)):
+                if str(p) not in refs:
+                    refs[str(p)] = analysis_ref(a)
             tracklist_lines.append("")
             tracklist_lines.append(f"#{idx + 1}  A: {path_a.name}  →  B: {path_b.name}")
             tracklist_lines.append(f"  BPM A={analysis_a.bpm:.1f}  B={analysis_b.bpm:.1f}  |  Key A={analysis_a.key} {analysis_a.key_scale}  B={analysis_b.key} {analysis_b.key_scale}")
@@ -112,95 +150,144 @@ def run_folder_pipeline(self, session_id: str, session_dir_str: str) -> None:
             if strategy.dj_comment:
                 tracklist_lines.append(f"  DJ: {strategy.dj_comment}")
 
-            job_state = get_job(session_id) or {}
-            job_state["last_dj_comment"] = strategy.dj_comment
+            job_fields = {"last_dj_comment": strategy.dj_comment, "tracklist_lines": tracklist_lines}
             cloud_used: List[str] = []
             if getattr(strategy, "overlay_instrument_url", None):
                 cloud_used.append(strategy.overlay_instrument_url)
             if getattr(strategy, "overlay_vocal_url", None):
                 cloud_used.append(strategy.overlay_vocal_url)
             if cloud_used:
-                job_state["cloud_samples_used"] = cloud_used
-            set_job(session_id, job_state)
+                job_fields["cloud_samples_used"] = cloud_used
+            if not update_job(session_id, job_fields):
+                return  # falló un render ya encolado: no seguir decidiendo (finally limpia)
 
-            strategy_dict = strategy.model_dump(mode="json")
-            if getattr(strategy, "overlay_paths", None):
-                strategy_dict["overlay_paths"] = [str(p) for p in strategy.overlay_paths]
-            if getattr(strategy, "overlay_instrument_url", None):
-                strategy_dict["overlay_instrument_url"] = strategy.overlay_instrument_url
-            if getattr(strategy, "overlay_vocal_url", None):
-                strategy_dict["overlay_vocal_url"] = strategy.overlay_vocal_url
-            if getattr(strategy, "overlay_instrument_bpm", None) is not None:
-                strategy_dict["overlay_instrument_bpm"] = strategy.overlay_instrument_bpm
-            if getattr(strategy, "overlay_vocal_bpm", None) is not None:
-                strategy_dict["overlay_vocal_bpm"] = strategy.overlay_vocal_bpm
-        segment_tasks.append(
-            render_segment.s(
-                session_id,
-                idx,
-                total_segments,
-                str(path_a),
-                str(path_b),
-                analysis_a.model_dump(mode="json"),
-                analysis_b.model_dump(mode="json"),
-                strategy_dict,
-                str(seg_path),
-                str(work_dir),
-            )
-        )
+            strategy_dict = strategy_payload(strategy)
+            plan_key = put_segment_plan(session_id, {
+                "total_segments": total_segments,
+                "path_a": str(path_a),
+                "path_b": str(path_b),
+                "analysis_a": refs[str(path_a)],
+                "analysis_b": refs[str(path_b)],
+                "strategy": strategy_dict,
+                "seg_path": str(seg_path),
+                "work_dir": str(work_dir),
+            })
+            if plan_key is None:
+                raise RuntimeError("Could not store segment plan in Redis")
+            render_segment.apply_async((session_id, idx, plan_key))
 
-        job_state = get_job(session_id) or {}
-        job_state["tracklist_lines"] = tracklist_lines
-        job_state["total_segments"] = total_segments
-        job_state["session_dir"] = session_dir_str
-        set_job(session_id, job_state)
-
-        chord(group(*segment_tasks))(finalize_set.s(session_id))
-        succeeded = True  # chord encolado; finalize_set borra session_dir si falla
+        succeeded = True  # renders encolados; finalize_set (o el render que falle) borra session_dir
+    except Exception as e:
+        update_job(session_id, {"status": "failed", "error": str(e)})  # no pisa el error de un render
+        raise
     finally:
         if not succeeded:
+            session_finished(session_id)
+            clear_render_state(session_id)
             _delete_session_dir(work_dir)
 
 
+def _plan_inputs(plan: dict) -> tuple[Path, Path, SongAnalysis, SongAnalysis, MixStrategy]:
+    """(path_a, path_b, analysis_a, analysis_b, strategy) de un plan guardado con put_segment_plan."""
+    strategy_dict = dict(plan["strategy"])
+    # overlay_paths: list of str -> Path
+    if strategy_dict.get("overlay_paths"):
+        strategy_dict["overlay_paths"] = [Path(p) for p in strategy_dict["overlay_paths"]]
+    return (
+        Path(plan["path_a"]),
+        Path(plan["path_b"]),
+        analysis_from_ref(plan["analysis_a"]),
+        analysis_from_ref(plan["analysis_b"]),
+        MixStrategy.model_validate(strategy_dict),
+    )
+
+
 @app.task(bind=True, name="app.tasks.render_segment", queue="audio_worker")
-def render_segment(
-    self,
-    session_id: str,
-    idx: int,
-    total_segments: int,
-    path_a_str: str,
-    path_b_str: str,
-    analysis_a_dict: dict,
-    analysis_b_dict: dict,
-    strategy_dict: dict,
-    seg_path_str: str,
-    work_dir_str: str,
-) -> str:
+def render_segment(self, session_id: str, idx: int, plan_key: str) -> str:
     """
     Audio worker: mezcla un segmento (Rubber Band + processor hsin/loudnorm/amix).
-    Devuelve seg_path para que finalize_set concatene.
+    El plan (paths, análisis por clave, strategy) se lee del store de la sesión (put_segment_plan): el mensaje
+    del broker lleva solo ids. Registra seg_path en el store; el último segmento en terminar encola finalize_set.
+    Si el render falla, el job queda 'failed' y se borra session_dir (el pipeline deja de encolar).
+    Fair-share: si la sesión ya tiene render_slots_per_session renders en curso, reintenta más tarde (vuelve al
+    final de la cola y pasan primero los de otras sesiones).
     """
-    path_a = Path(path_a_str)
-    path_b = Path(path_b_str)
-    seg_path = Path(seg_path_str)
-    work_dir = Path(work_dir_str)
-    analysis_a = SongAnalysis.model_validate(analysis_a_dict)
-    analysis_b = SongAnalysis.model_validate(analysis_b_dict)
-    # overlay_paths: list of str -> Path
-    if "overlay_paths" in strategy_dict and strategy_dict["overlay_paths"]:
-        strategy_dict["overlay_paths"] = [Path(p) for p in strategy_dict["overlay_paths"]]
-    strategy = MixStrategy.model_validate(strategy_dict)
+    token = self.request.id or f"{session_id}:{idx}"
+    if not acquire_render_slot(
+        session_id, token, settings.render_slots_per_session, settings.celery_visibility_timeout_sec
+    ):
+        raise self.retry(countdown=settings.render_slot_retry_sec, max_retries=None)
+    plan = None
+    try:
+        plan = get_segment_plan(session_id, plan_key)
+        if plan is None:
+            raise RuntimeError(f"Segment plan {plan_key} not found for session {session_id}")
+        total_segments = int(plan["total_segments"])
+        seg_path = Path(plan["seg_path"])
+        set_attributes(segment=idx + 1, total_segments=total_segments)
+        path_a, path_b, analysis_a, analysis_b, strategy = _plan_inputs(plan)
 
-    msg = f"Mezclando Track {idx + 1} de {total_segments} (Applying Bass-Swap)..."
-    publish_progress(session_id, {"phase": "rendering", "current_segment": idx + 1, "total_segments": total_segments, "message": msg})
+        msg = f"Mezclando Track {idx + 1} de {total_segments} (Applying Bass-Swap)..."
+        publish_progress(session_id, {"phase": "rendering", "current_segment": idx + 1, "total_segments": total_segments, "message": msg})
 
-    render_mix(path_a, path_b, analysis_a, analysis_b, strategy, seg_path, work_dir=work_dir)
+        with memory_stage("render", segment=idx + 1, track=f"{path_a.name} → {path_b.name}"):
+            render_mix(path_a, path_b, analysis_a, analysis_b, strategy, seg_path, work_dir=Path(plan["work_dir"]))
+    except Exception as e:
+        # Solo status/error (tracklist_lines y demás quedan); si ya estaba 'failed' se conserva la causa original
+        update_job(session_id, {"status": "failed", "error": f"Segment {idx + 1}: {e}"})
+        session_finished(session_id)
+        clear_render_state(session_id)
+        if plan:
+            _delete_session_dir(Path(plan["work_dir"]))
+        raise
+    finally:
+        release_render_slot(session_id, token)
+    if mark_segment_done(session_id, idx, str(seg_path), total_segments):
+        finalize_set.delay(session_id)
     return str(seg_path)
 
 
+@app.task(bind=True, name="app.tasks.render_two_track", queue=QUEUE_INTERACTIVE)
+def render_two_track(self, session_id: str, plan_key: str) -> str:
+    """
+    Render interactivo de /generate (cola audio_interactive, prioridad alta): session_dir/mix.wav.
+    Deja el job en 'ready' (análisis por clave + strategy, como espera GET /generate/{id}/status) o 'failed'.
+    Si falla, borra session_dir.
+    """
+    plan = get_segment_plan(session_id, plan_key)
+    if plan is None:
+        set_job(session_id, {"status": "failed", "error": "Render plan not found"})
+        session_finished(session_id)
+        return ""
+    session_dir = Path(plan["work_dir"])
+    out_path = session_dir / "mix.wav"
+    succeeded = False
+    try:
+        path_a, path_b, analysis_a, analysis_b, strategy = _plan_inputs(plan)
+        render_mix(path_a, path_b, analysis_a, analysis_b, strategy, out_path, work_dir=session_dir)
+        payload = {"status": "ready", "set_path": str(out_path), "session_dir": str(session_dir), "strategy": plan["strategy"]}
+        for name in ("analysis_a", "analysis_b"):
+            ref = plan[name]
+            payload[f"{name}_key" if isinstance(ref, str) else name] = ref
+        set_job(session_id, payload)
+        succeeded = True
+        return str(out_path)
+    except Exception as e:
+        set_job(session_id, {"status": "failed", "error": str(e)})
+        raise
+    finally:
+        session_finished(session_id)
+        clear_render_state(session_id)
+        if not succeeded:
+            _delete_session_dir(session_dir)
+
+
 @app.task(bind=True, name="app.tasks.finalize_set", queue="ai_brain")
-def finalize_set(self, session_id: str, segment_path_results: List[str]) -> None:
-    """Concatena segmentos WAV y escribe tracklist en session_dir. Try/finally: si falla, borra session_dir."""
+def finalize_set(self, session_id: str) -> None:
+    """
+    Concatena los segmentos WAV en orden (get_done_segments) y escribe tracklist en session_dir.
+    Try/finally: si falla, borra session_dir.
+    """
     job = get_job(session_id) or {}
     session_dir_str = job.get("session_dir")
     if not session_dir_str:
@@ -215,7 +302,7 @@ def finalize_set(self, session_id: str, segment_path_results: List[str]) -> None
 
     succeeded = False
     try:
-        segment_paths = [Path(p) for p in segment_path_results if p]
+        segment_paths = [Path(p) for p in get_done_segments(session_id) if p]
         if not segment_paths:
             set_job(session_id, {"status": "failed", "error": "No segments rendered"})
             return
@@ -226,10 +313,10 @@ def finalize_set(self, session_id: str, segment_path_results: List[str]) -> None
                 if p.exists():
                     path_str = str(p.resolve()).replace("\\", "/")
                     f.write(f"file '{path_str}'\n")
-        subprocess.run(
-            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list), "-c", "copy", str(set_path)],
-            check=True, capture_output=True,
-        )
+        with stage("concat"):
+            run_tool(
+                ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list), "-c", "copy", str(set_path)]
+            )
         for p in segment_paths:
             try:
                 p.unlink()
@@ -248,5 +335,20 @@ def finalize_set(self, session_id: str, segment_path_results: List[str]) -> None
         publish_progress(session_id, {"phase": "ready", "message": "Set listo."})
         succeeded = True
     finally:
+        session_finished(session_id)
+        clear_render_state(session_id)
         if not succeeded:
             _delete_session_dir(work_dir)
+
+
+@app.task(name="app.tasks.warm_overlay_stems", queue="audio_worker")
+def warm_overlay_stems(target_bpms: List[float], items: Optional[List[list]] = None) -> dict:
+    """
+    Warm-up de stems conformados (stem_cache) a target_bpms. items = [[url, bpm], ...]; sin items,
+    todo cloud_assets.json. Llamar antes de un set con BPMs conocidos para que los renders no hagan atempo.
+    """
+    from .audio.stem_cache import warm_catalogue, warm_stems
+
+    if items:
+        return warm_stems([(str(u), float(b)) for u, b in items], target_bpms)
+    return warm_catalogue(target_bpms)
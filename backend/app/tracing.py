@@ -0,0 +1,279 @@
+"""Trazas distribuidas OpenTelemetry (opcional: sin opentelemetry-sdk o con AUTOMIX_TRACING_EXPORTER vacío, no-op).
+
+Una traza por request: POST /process-folder → run_folder_pipeline (ai_brain) → render_segment × N (audio_worker) →
+finalize_set. El contexto (W3C traceparent) viaja en los headers de los mensajes Celery (before_task_publish /
+task_prerun) y en los mensajes de progreso de Redis. Spans: cada etapa de metrics.stage (decode, key, beats,
+features, structure, llm, rubberband, ffmpeg_mix, concat, download), análisis, decisiones, subprocesos, tasks y la
+espera en cola de cada task (queue_wait).
+
+Export: file (JSON lines en AUTOMIX_TRACING_FILE, ver scripts/trace_waterfall.py) u otlp (collector local,
+requiere opentelemetry-exporter-otlp-proto-http).
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+try:
+    from opentelemetry import context as otel_context
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:
+    trace = None
+
+from .config import settings
+
+_tracer = None
+_init_lock = threading.Lock()
+# Spans de tasks Celery en curso: task_id -> (span, token de context.attach)
+_task_spans: dict[str, tuple[Any, Any]] = {}
+# Header propio con la hora de encolado (para el span queue_wait)
+HEADER_ENQUEUED_AT = "opus_enqueued_at"
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def trace_file() -> Path:
+    """Archivo JSON lines del exporter file (por defecto base_dir/.traces/spans.jsonl, compartido entre procesos)."""
+    if settings.tracing_file.strip():
+        return Path(settings.tracing_file.strip())
+    return settings.base_dir / ".traces" / "spans.jsonl"
+
+
+if trace is not None:
+
+    class _JsonLinesExporter(SpanExporter):
+        """Un span por línea (append, una escritura por span: varios procesos pueden compartir el archivo)."""
+
+        def __init__(self, path: Path):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        def export(self, spans) -> "SpanExportResult":
+            try:
+                for s in spans:
+                    parent = s.parent.span_id if s.parent is not None else None
+                    line = json.dumps({
+                        "trace_id": f"{s.context.trace_id:032x}",
+                        "span_id": f"{s.context.span_id:016x}",
+                        "parent_id": f"{parent:016x}" if parent else None,
+                        "name": s.name,
+                        "service": s.resource.attributes.get("service.name"),
+                        "start_ns": s.start_time,
+                        "end_ns": s.end_time,
+                        "error": s.status.status_code == StatusCode.ERROR,
+                        "attrs": dict(s.attributes or {}),
+                    }, separators=(",", ":"), default=str)
+                    os.write(self._fd, (line + "\n").encode("utf-8"))
+            except OSError:
+                return SpanExportResult.FAILURE
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self) -> None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+
+
+def _exporter():
+    kind = settings.tracing_exporter.strip().lower()
+    if kind == "file":
+        return _JsonLinesExporter(trace_file())
+    if kind == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            print("[tracing] otlp requiere opentelemetry-exporter-otlp-proto-http; trazas apagadas", file=sys.stderr)
+            return None
+        return OTLPSpanExporter(endpoint=settings.tracing_otlp_endpoint)
+    if kind:
+        print(f"[tracing] exporter desconocido: {kind!r} (file | otlp); trazas apagadas", file=sys.stderr)
+    return None
+
+
+def init_tracing(service_name: str) -> bool:
+    """
+    Configura el TracerProvider del proceso (idempotente). OTEL_SERVICE_NAME pisa service_name (un nombre por
+    servicio de docker-compose). Antes del fork del pool Celery está bien: el SDK reinicia el batch en cada hijo.
+    """
+    global _tracer
+    if trace is None or _tracer is not None:
+        return _tracer is not None
+    with _init_lock:
+        if _tracer is not None:
+            return True
+        exporter = _exporter()
+        if exporter is None:
+            return False
+        resource = Resource.create({"service.name": os.environ.get("OTEL_SERVICE_NAME") or service_name})
+        provider = TracerProvider(resource=resource)
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _tracer = trace.get_tracer("opus")
+    return True
+
+
+def flush() -> None:
+    """Exporta los spans pendientes (al terminar un proceso del pool, que no corre atexit)."""
+    if _tracer is None:
+        return
+    try:
+        trace.get_tracer_provider().force_flush(timeout_millis=2000)
+    except Exception:
+        pass
+
+
+def _attributes(attrs: dict[str, Any]) -> dict[str, Any]:
+    """Atributos con prefijo opus. (None se omite; tipos no soportados por OTel como str)."""
+    out: dict[str, Any] = {}
+    for k, v in attrs.items():
+        if v is None:
+            continue
+        out[k if "." in k else f"opus.{k}"] = v if isinstance(v, (str, bool, int, float)) else str(v)
+    return out
+
+
+@contextmanager
+def span(name: str, parent: Optional[dict[str, str]] = None, **attrs: Any) -> Iterator[Any]:
+    """
+    Span hijo del actual (o de parent: carrier con traceparent, p. ej. capturado con carrier()). La excepción
+    que salga se registra en el span y lo marca como error. Sin tracing: yield None.
+    """
+    if _tracer is None:
+        yield None
+        return
+    ctx = propagate.extract(parent) if parent else None
+    with _tracer.start_as_current_span(name, context=ctx, attributes=_attributes(attrs)) as s:
+        yield s
+
+
+def traced(name: str) -> Callable:
+    """Decorador: la función entera como span name."""
+    def deco(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def set_attributes(**attrs: Any) -> None:
+    """Agrega atributos al span actual (no-op sin tracing)."""
+    if _tracer is None:
+        return
+    current = trace.get_current_span()
+    if current.is_recording():
+        current.set_attributes(_attributes(attrs))
+
+
+def carrier() -> dict[str, str]:
+    """Contexto actual como dict W3C ({"traceparent": ...}); vacío sin tracing o sin span activo."""
+    out: dict[str, str] = {}
+    if _tracer is not None:
+        propagate.inject(out)
+    return out
+
+
+def current_trace_id() -> Optional[str]:
+    if _tracer is None:
+        return None
+    ctx = trace.get_current_span().get_span_context()
+    return f"{ctx.trace_id:032x}" if ctx.is_valid else None
+
+
+def bind(name: str, fn: Callable, **attrs: Any) -> Callable:
+    """
+    fn envuelta en un span name hijo del contexto de ahora: para BackgroundTasks / threads, que corren cuando
+    el span del request ya cerró.
+    """
+    if _tracer is None:
+        return fn
+    parent = carrier()
+
+    @wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with span(name, parent=parent, **attrs):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# ---------------------------------------------------------------------------
+# Celery: contexto en headers del mensaje; un span por ejecución de task
+# ---------------------------------------------------------------------------
+
+def inject_task_headers(headers: Optional[dict]) -> None:
+    """before_task_publish: traceparent del contexto actual + hora de encolado."""
+    if _tracer is None or headers is None:
+        return
+    headers.update(carrier())
+    headers[HEADER_ENQUEUED_AT] = time.time()
+
+
+def task_started(task_id: str, task: Any, args: Optional[tuple] = None) -> None:
+    """task_prerun: span queue_wait (encolado → inicio) y span del task, activo mientras corre."""
+    if _tracer is None or not task_id:
+        return
+    request = task.request
+    headers = {}
+    for key in ("traceparent", "tracestate"):
+        value = getattr(request, key, None)
+        if isinstance(value, str):
+            headers[key] = value
+    parent = propagate.extract(headers)
+    name = str(task.name).rsplit(".", 1)[-1]
+    attrs = _attributes({
+        "celery.task_id": task_id,
+        "celery.task": task.name,
+        "celery.retries": int(getattr(request, "retries", 0) or 0),
+        "session_id": args[0] if args and isinstance(args[0], str) else None,
+    })
+    enqueued_at = getattr(request, HEADER_ENQUEUED_AT, None)
+    if isinstance(enqueued_at, (int, float)):
+        queue = (getattr(request, "delivery_info", None) or {}).get("routing_key")
+        _tracer.start_span(
+            "queue_wait", context=parent, start_time=int(enqueued_at * 1e9),
+            attributes=_attributes({**attrs, "celery.queue": queue}),
+        ).end()
+    s = _tracer.start_span(name, context=parent, kind=SpanKind.CONSUMER, attributes=attrs)
+    token = otel_context.attach(trace.set_span_in_context(s))
+    _task_spans[task_id] = (s, token)
+
+
+def task_failed(task_id: str, exception: Optional[BaseException]) -> None:
+    """task_failure (se emite antes de task_postrun): excepción y estado de error en el span del task."""
+    entry = _task_spans.get(task_id or "")
+    if entry is None or exception is None:
+        return
+    entry[0].record_exception(exception)
+    entry[0].set_status(Status(StatusCode.ERROR, str(exception)[:200]))
+
+
+def task_finished(task_id: str, state: Optional[str]) -> None:
+    """task_postrun: cierra el span del task y restaura el contexto."""
+    entry = _task_spans.pop(task_id or "", None)
+    if entry is None:
+        return
+    s, token = entry
+    if state:
+        s.set_attribute("celery.state", state)
+    s.end()
+    try:
+        otel_context.detach(token)
+    except Exception:
+        pass
@@ -76,11 +76,13 @@ export function getDownloadUrl(sessionId) {
 /**
  * Procesa una carpeta de tracks: sube archivos y arranca el pipeline del set.
  * @param {File[]} files — lista de archivos (p. ej. desde input webkitdirectory)
+ * @param {string} [energyCurve] — preset (warmup_peak_cooldown, peak, closing, ...) o "0.2,0.8,0.4"
  * @returns {Promise<{ session_id: string, status: string, status_url: string, set_url: string, tracklist_url: string }>}
  */
-export async function processFolder(files) {
+export async function processFolder(files, energyCurve) {
   const fd = new FormData();
   files.forEach((file) => fd.append('files', file));
+  if (energyCurve) fd.append('energy_curve', energyCurve);
   const r = await fetch(`${getBaseUrl()}/process-folder`, {
     method: 'POST',
     body: fd,
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Benchmark del análisis con audio sintético de ground truth conocido (scripts/synth_audio.py: click track + pad de
+acordes + ruido, en varios largos). Mide analyze_song, get_audio_metadata, analyze_track_structure, detect_key y
+get_compatible_samples (índice SQLite temporal con una librería sintética):
+
+- throughput: segundos de audio analizados por segundo de reloj (queries/s para get_compatible_samples)
+- CPU y pico de RSS por función (VmHWM, reseteado con /proc/self/clear_refs entre funciones; Linux)
+- precisión contra el ground truth: BPM (±2 %, y con error de octava), tonalidad exacta y vecina en Camelot,
+  F-measure de beats (±70 ms) y de fronteras de sección (±3 s), resultados idénticos a búsqueda exhaustiva
+
+Contra un baseline guardado falla (exit 1) si cae la precisión o, en la misma máquina, el throughput o sube el RSS:
+cada optimización de velocidad se valida contra la precisión.
+
+Uso (desde la raíz del proyecto, con venv activado):
+  python scripts/bench_analysis.py                          # compara con scripts/baselines/bench_analysis.json
+  python scripts/bench_analysis.py --save-baseline          # guarda el baseline (tras un cambio aceptado)
+  python scripts/bench_analysis.py --lengths 30 120 480 --only analyze_song detect_key --json out.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+# Permitir importar backend.app (ejecutar desde raíz del proyecto)
+_root = Path(__file__).resolve().parent.parent
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+
+from backend.app import sample_index
+from backend.app.analysis import analyze_song, detect_key, harmonic_distance_camelot, key_to_camelot
+from backend.app.audio.analyzer import get_audio_metadata
+from backend.app.audio_analyzer import analyze_track_structure
+from backend.app.config import settings
+from backend.app.sample_library import SAMPLE_CATEGORIES, get_compatible_samples
+
+from synth_audio import GroundTruth, default_specs, f_measure, write_track
+
+FUNCTIONS = ("analyze_song", "get_audio_metadata", "analyze_track_structure", "detect_key", "get_compatible_samples")
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baselines" / "bench_analysis.json"
+BPM_TOLERANCE = 0.02
+BEAT_TOLERANCE_SEC = 0.07
+BOUNDARY_TOLERANCE_SEC = 3.0
+
+
+# ---------------------------------------------------------------------------
+# Memoria y máquina
+# ---------------------------------------------------------------------------
+
+def reset_peak_rss() -> bool:
+    """Resetea VmHWM al RSS actual (Linux >= 4.0); False si no se puede (el pico queda acumulado)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss: KB en Linux, bytes en macOS (y nunca se resetea)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def fingerprint() -> dict[str, Any]:
+    """Identifica la máquina/entorno: los tiempos solo se comparan contra un baseline de la misma."""
+    import librosa
+
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    return {
+        "cpu": cpu,
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "librosa": librosa.__version__,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Precisión
+# ---------------------------------------------------------------------------
+
+def _bpm_scores(estimates: list[float], truths: list[GroundTruth]) -> dict[str, float]:
+    strict = octave = 0
+    for est, gt in zip(estimates, truths):
+        if abs(est - gt.bpm) <= BPM_TOLERANCE * gt.bpm:
+            strict += 1
+        if any(abs(est * m - gt.bpm) <= BPM_TOLERANCE * gt.bpm for m in (0.5, 1.0, 2.0, 2 / 3, 1.5)):
+            octave += 1
+    n = max(1, len(truths))
+    return {"bpm_acc": strict / n, "bpm_acc_octave": octave / n}
+
+
+def _key_scores(keys: list[tuple[str, str]], truths: list[GroundTruth]) -> dict[str, float]:
+    exact = close = 0
+    for (key, scale), gt in zip(keys, truths):
+        if key == gt.key and scale == gt.scale:
+            exact += 1
+        if harmonic_distance_camelot(key_to_camelot(key, scale), key_to_camelot(gt.key, gt.scale)) <= 1:
+            close += 1
+    n = max(1, len(truths))
+    return {"key_acc": exact / n, "key_camelot_close": close / n}
+
+
+def score_analyze_song(outs: list, truths: list[GroundTruth]) -> dict[str, float]:
+    return {
+        **_bpm_scores([a.bpm for a in outs], truths),
+        **_key_scores([(a.key, a.key_scale) for a in outs], truths),
+        "beat_f": float(np.mean([f_measure(a.beats, gt.beats, BEAT_TOLERANCE_SEC) for a, gt in zip(outs, truths)])),
+    }
+
+
+def score_metadata(outs: list, truths: list[GroundTruth]) -> dict[str, float]:
+    dur_ok = sum(abs(m["duration"] - gt.duration_sec) <= 0.05 for m, gt in zip(outs, truths))
+    return {**_bpm_scores([m["bpm"] for m in outs], truths), "duration_acc": dur_ok / max(1, len(truths))}
+
+
+def score_structure(outs: list, truths: list[GroundTruth]) -> dict[str, float]:
+    return {
+        **_bpm_scores([s["bpm"] for s in outs], truths),
+        "boundary_f": float(np.mean([
+            f_measure(s["bounds_sec"][1:-1], gt.section_bounds, BOUNDARY_TOLERANCE_SEC) for s, gt in zip(outs, truths)
+        ])),
+    }
+
+
+def score_key(outs: list, truths: list[GroundTruth]) -> dict[str, float]:
+    return _key_scores([(k[0], k[1]) for k in outs], truths)
+
+
+# ---------------------------------------------------------------------------
+# Corridas
+# ---------------------------------------------------------------------------
+
+def run_audio_bench(
+    fn: Callable[[Path, np.ndarray], Any],
+    scorer: Callable[[list, list[GroundTruth]], dict[str, float]],
+    tracks: list[tuple[Path, np.ndarray, GroundTruth]],
+    repeat: int,
+) -> dict[str, Any]:
+    """Mejor de repeat por track; throughput = audio total / suma de los mejores tiempos."""
+    reset_peak_rss()
+    wall = cpu = 0.0
+    outs = []
+    for path, y, _truth in tracks:
+        best_wall, best_cpu, out = float("inf"), 0.0, None
+        for _ in range(max(1, repeat)):
+            w0, c0 = time.perf_counter(), time.process_time()
+            out = fn(path, y)
+            w, c = time.perf_counter() - w0, time.process_time() - c0
+            if w < best_wall:
+                best_wall, best_cpu = w, c
+        wall += best_wall
+        cpu += best_cpu
+        outs.append(out)
+    audio_sec = sum(gt.duration_sec for _, _, gt in tracks)
+    return {
+        "throughput": round(audio_sec / max(wall, 1e-9), 2),
+        "unit": "audio_s/s",
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "accuracy": {k: round(v, 4) for k, v in scorer(outs, [gt for _, _, gt in tracks]).items()},
+    }
+
+
+def _brute_force(library: list[tuple[str, str, float, str]], cats: list[str], bpm: float, camelot: str,
+                 tol: float, max_dist: int) -> list[str]:
+    """Referencia: filtro exhaustivo (misma semántica que get_compatible_samples: la letra Camelot no cuenta)."""
+    n = int(camelot[:-1])
+    out = []
+    for rel, cat, b, key in library:
+        d = abs(int(key[:-1]) - n)
+        if cat in cats and max(1.0, bpm - tol) <= b <= bpm + tol and min(d, 12 - d) <= max_dist:
+            out.append(rel)
+    return sorted(out)
+
+
+def run_library_bench(work: Path, size: int, queries: int, seed: int) -> dict[str, Any]:
+    """get_compatible_samples sobre un índice temporal de size samples (sin audio: solo metadata)."""
+    rng = random.Random(seed)
+    library = []
+    for i in range(size):
+        cat = SAMPLE_CATEGORIES[i % len(SAMPLE_CATEGORIES)]
+        key = f"{rng.randint(1, 12)}{rng.choice('AB')}"
+        library.append((f"{cat}/s{i:06d}.wav", cat, round(rng.uniform(70, 180), 1), key))
+
+    old_index, old_samples = settings.sample_index_path, settings.assets_samples_dir
+    settings.sample_index_path = str(work / "bench_index.sqlite")
+    settings.assets_samples_dir = work / "samples"
+    try:
+        conn = sample_index.open_index()
+        for rel, cat, bpm, key in library:
+            sample_index.upsert_sample(conn, rel, cat, {"bpm": bpm, "key_camelot": key}, 0, 0)
+        conn.commit()
+        conn.close()
+
+        cases = []
+        for _ in range(queries):
+            cats = rng.sample(list(SAMPLE_CATEGORIES), rng.randint(1, 3))
+            cases.append((cats, rng.uniform(80, 170), f"{rng.randint(1, 12)}{rng.choice('AB')}"))
+        reset_peak_rss()
+        w0, c0 = time.perf_counter(), time.process_time()
+        results = [get_compatible_samples(bpm, key, cats, 5.0, 1) for cats, bpm, key in cases]
+        wall, cpu = time.perf_counter() - w0, time.process_time() - c0
+        matches = sum(
+            sorted(str(p.relative_to(settings.assets_samples_dir)) for p, _ in res)
+            == _brute_force(library, cats, bpm, key, 5.0, 1)
+            for res, (cats, bpm, key) in zip(results, cases)
+        )
+    finally:
+        settings.sample_index_path, settings.assets_samples_dir = old_index, old_samples
+    return {
+        "throughput": round(queries / max(wall, 1e-9), 1),
+        "unit": "queries/s",
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "accuracy": {"exact_match": round(matches / max(1, queries), 4)},
+    }
+
+
+# ---------------------------------------------------------------------------
+# Baseline
+# ---------------------------------------------------------------------------
+
+def compare(current: dict, baseline: dict, args: argparse.Namespace) -> tuple[list[str], bool]:
+    """(regresiones, se compararon tiempos). Precisión siempre; throughput/RSS solo en la misma máquina."""
+    timing = args.strict_timing or current["fingerprint"] == baseline.get("fingerprint")
+    failures = []
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        for metric, value in cur["accuracy"].items():
+            ref = base.get("accuracy", {}).get(metric)
+            if ref is not None and value < ref - args.max_accuracy_drop:
+                failures.append(f"{name}: {metric} {value:.3f} < baseline {ref:.3f}")
+        if timing:
+            if cur["throughput"] < base["throughput"] * (1 - args.max_slowdown):
+                failures.append(
+                    f"{name}: throughput {cur['throughput']} {cur['unit']} < baseline {base['throughput']} "
+                    f"(-{(1 - cur['throughput'] / base['throughput']) * 100:.0f} %)"
+                )
+            if cur["peak_rss_mb"] > base["peak_rss_mb"] * (1 + args.max_rss_growth):
+                failures.append(f"{name}: pico RSS {cur['peak_rss_mb']} MB > baseline {base['peak_rss_mb']} MB")
+    return failures, timing
+
+
+def print_table(results: dict[str, dict], baseline: Optional[dict]) -> None:
+    base_results = (baseline or {}).get("results", {})
+    print(f"\n{'función':<25} {'throughput':>12} {'unidad':<10} {'vs base':>8} {'cpu s':>7} {'RSS MB':>7}  precisión")
+    for name, r in results.items():
+        base = base_results.get(name)
+        delta = f"{(r['throughput'] / base['throughput'] - 1) * 100:+.0f}%" if base else "—"
+        acc = " ".join(f"{k}={v:.2f}" for k, v in r["accuracy"].items())
+        print(
+            f"{name:<25} {r['throughput']:>12.1f} {r['unit']:<10} {delta:>8} {r['cpu_s']:>7.2f} "
+            f"{r['peak_rss_mb']:>7.0f}  {acc}"
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del análisis con ground truth sintético")
+    parser.add_argument("--lengths", type=float, nargs="+", default=[30.0, 120.0], help="largos de track (s)")
+    parser.add_argument("--noise", type=float, nargs="+", default=[0.0, 0.02, 0.06], help="niveles de ruido")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="corridas por track (se toma la mejor)")
+    parser.add_argument("--only", nargs="+", choices=FUNCTIONS, default=list(FUNCTIONS))
+    parser.add_argument("--library-size", type=int, default=20000, help="samples del índice sintético")
+    parser.add_argument("--queries", type=int, default=500, help="búsquedas de get_compatible_samples")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="guardar resultados como baseline")
+    parser.add_argument("--json", type=Path, default=None, help="escribir resultados en este archivo")
+    parser.add_argument("--max-slowdown", type=float, default=0.20, help="caída de throughput tolerada (fracción)")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.02, help="caída de precisión tolerada (absoluta)")
+    parser.add_argument("--max-rss-growth", type=float, default=0.25, help="aumento de pico RSS tolerado (fracción)")
+    parser.add_argument("--strict-timing", action="store_true", help="comparar tiempos aunque cambie la máquina")
+    args = parser.parse_args(argv)
+
+    import librosa
+
+    sr = settings.default_sr
+    specs = default_specs(args.lengths, seed=args.seed, noise_levels=args.noise)
+    cases = [vars(s) for s in specs]
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="opus_bench_") as tmp:
+        work = Path(tmp)
+        tracks = []
+        for i, spec in enumerate(specs):
+            path = work / f"track_{i}_{int(spec.bpm)}_{spec.key.replace('#', 's')}{spec.scale[:3]}.wav"
+            truth = write_track(path, spec, sr=sr)
+            y = librosa.load(str(path), sr=sr, mono=True)[0] if "detect_key" in args.only else np.zeros(0)
+            tracks.append((path, y, truth))
+        total = sum(gt.duration_sec for _, _, gt in tracks)
+        print(f"{len(tracks)} tracks sintéticos ({total:.0f} s de audio, sr={sr})")
+
+        runners = {
+            "analyze_song": lambda: run_audio_bench(
+                lambda p, y: analyze_song(p, sr), score_analyze_song, tracks, args.repeat),
+            "get_audio_metadata": lambda: run_audio_bench(
+                lambda p, y: get_audio_metadata(p, sr=sr), score_metadata, tracks, args.repeat),
+            "analyze_track_structure": lambda: run_audio_bench(
+                lambda p, y: analyze_track_structure(p, sr=sr), score_structure, tracks, args.repeat),
+            "detect_key": lambda: run_audio_bench(
+                lambda p, y: detect_key(y, sr), score_key, tracks, args.repeat),
+            "get_compatible_samples": lambda: run_library_bench(work, args.library_size, args.queries, args.seed),
+        }
+        for name in FUNCTIONS:
+            if name in args.only:
+                print(f"  {name}...", flush=True)
+                results[name] = runners[name]()
+
+    current = {"fingerprint": fingerprint(), "cases": cases, "library_size": args.library_size, "results": results}
+    baseline = None
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    print_table(results, baseline)
+
+    if args.json:
+        args.json.write_text(json.dumps(current, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(current, indent=2) + "\n", encoding="utf-8")
+        print(f"\nBaseline guardado en {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"\nSin baseline ({args.baseline}); correr con --save-baseline para crearlo")
+        return 0
+    if baseline.get("cases") != cases or baseline.get("library_size") != args.library_size:
+        print("\nEl baseline se generó con otros casos (--lengths/--noise/--seed/--library-size): no comparable",
+              file=sys.stderr)
+        return 2
+    failures, timing = compare(current, baseline, args)
+    if not timing:
+        print("\nOtra máquina/entorno que el baseline: solo se compara precisión (--strict-timing para tiempos)")
+    if failures:
+        print("\nREGRESIONES:", file=sys.stderr)
+        for f in failures:
+            print(f"  {f}", file=sys.stderr)
+        return 1
+    print("\nSin regresiones contra el baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del picking de picos de energía (audio.analyzer.pick_energy_peaks) contra el loop original
+(argsort + chequeo de distancia contra cada pico ya elegido, O(frames × picos) en Python). Dos tiempos nuevos:
+"picking" es lo comparable con el loop original (solo los tiempos de los picos); "total" suma prominencia y ancho
+de cada pico, que el loop original no calculaba.
+
+Envolventes RMS (mide solo el picking, no librosa.load):
+- audio: RMS de librosa sobre un track de scripts/synth_audio.py (kick, hats, pad y frases): el caso típico.
+- sections / drops: envolventes sintéticas (drops = peor caso del loop original).
+- --files: RMS de archivos de audio reales (mismo hop que get_audio_metadata).
+Por defecto largos de track reales (3.5, 5 y 7 min) y un set de 60 min.
+
+Uso (desde la raíz del proyecto, con venv activado):
+  python scripts/bench_energy_peaks.py
+  python scripts/bench_energy_peaks.py --minutes 10 60 --repeat 5
+  python scripts/bench_energy_peaks.py --files ~/Music/*.mp3
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Permitir importar backend.app (ejecutar desde raíz del proyecto)
+_root = Path(__file__).resolve().parent.parent
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+
+from backend.app.audio.analyzer import MIN_PEAK_GAP_SEC, _pick_candidates, pick_energy_peaks
+
+SR = 44100
+HOP = 512
+
+
+def legacy_peaks(rms: np.ndarray, frame_sec: float, duration: float, top_peaks: int) -> list[float]:
+    """Implementación previa de get_audio_metadata (referencia)."""
+    frame_times = np.arange(len(rms)) * frame_sec
+    order = np.argsort(rms)[::-1]
+    peak_times = []
+    seen_sec = set()
+    for i in order:
+        t = float(frame_times[i])
+        if t < 0 or t > duration:
+            continue
+        if any(abs(t - s) < MIN_PEAK_GAP_SEC for s in seen_sec):
+            continue
+        peak_times.append(round(t, 2))
+        seen_sec.add(t)
+        if len(peak_times) >= top_peaks:
+            break
+    peak_times.sort()
+    return peak_times
+
+
+def synthetic_rms(minutes: float, shape: str = "sections", seed: int = 0) -> np.ndarray:
+    """
+    Envolvente sintética (float32, como librosa.feature.rms):
+    - sections: secciones de ~16 s con niveles distintos + golpes por beat + ruido.
+    - drops: drops largos (~60 s) que crecen de a poco; los frames más altos quedan juntos al final de cada drop
+      y el loop original descarta miles antes de encontrar el siguiente pico (su peor caso).
+    """
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * SR / HOP)
+    t = np.arange(n) * HOP / SR
+    if shape == "drops":
+        section = 5168  # ~60 s
+        levels = np.repeat(rng.uniform(0.5, 1.0, n // section + 1), section)[:n]
+        ramp = 0.2 * (np.arange(n) % section) / section
+        return (levels + ramp + 0.01 * rng.random(n)).astype(np.float32)
+    sections = np.repeat(rng.uniform(0.2, 1.0, n // 1400 + 1), 1400)[:n]
+    beats = 0.3 * np.maximum(0.0, np.cos(2 * np.pi * t * 2.1)) ** 8
+    return (sections + beats + 0.05 * rng.random(n)).astype(np.float32)
+
+
+def audio_rms(minutes: float, seed: int = 0) -> np.ndarray:
+    """RMS (librosa, hop HOP) de un track sintético de synth_audio con el largo pedido."""
+    import librosa
+    from synth_audio import default_specs, synth_track
+
+    spec = default_specs([minutes * 60.0], seed=seed, noise_levels=[0.02])[0]
+    y, _ = synth_track(spec, SR)
+    return librosa.feature.rms(y=y, hop_length=HOP)[0]
+
+
+def file_rms(path: Path) -> np.ndarray:
+    """RMS de un archivo como en get_audio_metadata (mono, 44.1 kHz)."""
+    import librosa
+
+    y, _ = librosa.load(str(path), sr=SR, mono=True)
+    return librosa.feature.rms(y=y, hop_length=HOP)[0]
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de picking de picos de energía")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[3.5, 5.0, 7.0, 60.0])
+    parser.add_argument("--top", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--shapes", nargs="+", default=["audio", "sections", "drops"], choices=["audio", "sections", "drops"]
+    )
+    parser.add_argument("--files", type=Path, nargs="+", default=[], help="Archivos de audio (en vez de sintéticos)")
+    args = parser.parse_args(argv)
+
+    frame_sec = HOP / SR
+    if args.files:
+        inputs = [(p.name[:24], lambda p=p: file_rms(p)) for p in args.files]
+    else:
+        inputs = [
+            (shape, lambda sh=shape, m=minutes: audio_rms(m) if sh == "audio" else synthetic_rms(m, sh))
+            for shape in args.shapes for minutes in args.minutes
+        ]
+    print(
+        f"{'input':>24} {'min':>6} {'frames':>9} {'legacy ms':>10} {'picking ms':>11} {'x':>6} "
+        f"{'total ms':>9} {'x':>6} {'gap ok':>7}"
+    )
+    for name, load in inputs:
+        rms = load()
+        duration = len(rms) * frame_sec
+        minutes = duration / 60.0
+        t_old = _best_of(lambda: legacy_peaks(rms, frame_sec, duration, args.top), args.repeat)
+        t_pick = _best_of(lambda: _pick_candidates(rms, frame_sec, args.top, MIN_PEAK_GAP_SEC), args.repeat)
+        t_new = _best_of(lambda: pick_energy_peaks(rms, frame_sec, top_peaks=args.top), args.repeat)
+        times = pick_energy_peaks(rms, frame_sec, top_peaks=args.top)["times"]
+        gap_ok = bool(np.all(np.diff(times) >= MIN_PEAK_GAP_SEC - frame_sec)) and len(times) <= args.top
+        print(
+            f"{name:>24} {minutes:>6.1f} {len(rms):>9d} {t_old * 1000:>10.2f} {t_pick * 1000:>11.2f} "
+            f"{t_old / max(t_pick, 1e-9):>5.1f}x {t_new * 1000:>9.2f} {t_old / max(t_new, 1e-9):>5.1f}x "
+            f"{str(gap_ok):>7}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
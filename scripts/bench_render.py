@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+Benchmark y test diferencial del render (render.render_mix → Rubber Band + processor.render_professional_mix).
+Renderiza pares de tracks sintéticos (scripts/synth_audio.py, estéreo) bajo una matriz de MixStrategy: stretch,
+pitch, largo del crossfade, overlays cloud (servidos por HTTP local, pasan por sample_cache y stem_cache) y
+highpass (harmonic_distance > 1).
+
+Por caso y por etapa (rubberband, ffmpeg_copy, ffprobe, ffmpeg_silence, ffmpeg_stem, ffmpeg_mix, python): tiempo
+de reloj, CPU y pico de memoria (wait4 de cada subproceso; VmHWM para el proceso Python).
+
+Comparación numérica de salidas (ganancia igualada por mínimos cuadrados: loudnorm cambia el nivel absoluto):
+- rms_error_db: energía del residuo relativa a la señal (dB; -60 = prácticamente idénticas)
+- spectral_diff_db: diferencia media de log-magnitud STFT (dB)
+- length_diff_ms
+entre engines (processor vs reference: implementación numpy/librosa de la misma cadena sin loudnorm, ganancia igualada por
+ventanas de 3 s; solo informativa: Rubber Band y loudnorm no se replican exactamente) y entre versiones (--save-reference / --reference: falla con
+exit 1 si el residuo o la diferencia espectral superan los umbrales). Casos cuyo binario falta se saltean.
+
+Uso (desde la raíz del proyecto, con venv activado):
+  python scripts/bench_render.py                                 # matriz un-factor-a-la-vez, ambos engines
+  python scripts/bench_render.py --save-reference /tmp/render_ref   # antes del cambio
+  python scripts/bench_render.py --reference /tmp/render_ref        # después: diferencias y tiempos
+  python scripts/bench_render.py --matrix full --engines processor --json out.json
+"""
+from __future__ import annotations
+
+import argparse
+import functools
+import http.server
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+# Permitir importar backend.app (ejecutar desde raíz del proyecto)
+_root = Path(__file__).resolve().parent.parent
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+
+from backend.app.config import settings
+from backend.app.models import MixStrategy, SongAnalysis
+
+from bench_analysis import fingerprint, peak_rss_mb, reset_peak_rss
+from synth_audio import NOTES, TrackSpec, write_track
+
+ENGINES = ("processor", "reference")
+BASE_CASE = {"stretch": 1.0, "pitch": 0.0, "crossfade": 8.0, "overlays": False, "highpass": False}
+# Un factor a la vez sobre BASE_CASE (el stretch/pitch se aplica a B, como cuando se conforma B al tempo de A)
+VARIATIONS = {
+    "stretch": [1.02, 0.97],
+    "pitch": [1.0, -2.0],
+    "crossfade": [2.0, 16.0],
+    "overlays": [True],
+    "highpass": [True],
+}
+OVERLAY_BPM = 120.0
+OVERLAY_ENTRY_SEC = 4.0
+HIGHPASS_HZ = 80.0
+AMIX_DROPOUT_SEC = 2.0
+# loudnorm dinámico ajusta la ganancia en ventanas de 3 s: processor vs reference se compara con ganancia local
+LOUDNORM_WINDOW_SEC = 3.0
+
+
+# ---------------------------------------------------------------------------
+# Matriz de casos
+# ---------------------------------------------------------------------------
+
+def case_name(case: dict[str, Any]) -> str:
+    parts = [f"{k}={v:g}" if isinstance(v, float) else k for k, v in case.items()
+             if v != BASE_CASE[k] and v is not False]
+    return ",".join(parts) or "base"
+
+
+def build_cases(matrix: str) -> list[dict[str, Any]]:
+    if matrix == "full":
+        keys = list(BASE_CASE)
+        values = [sorted({BASE_CASE[k], *VARIATIONS[k]}, key=float) for k in keys]
+        return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    cases = [dict(BASE_CASE)]
+    for key, values in VARIATIONS.items():
+        cases.extend({**BASE_CASE, key: v} for v in values)
+    return cases
+
+
+def strategy_for(case: dict[str, Any], overlay_url: Optional[str]) -> MixStrategy:
+    return MixStrategy(
+        transition_type="crossfade",
+        crossfade_sec=case["crossfade"],
+        song_a_stretch_ratio=1.0,
+        song_a_pitch_semitones=0.0,
+        song_a_transition_start_sec=0.0,
+        song_b_stretch_ratio=case["stretch"],
+        song_b_pitch_semitones=case["pitch"],
+        song_b_transition_start_sec=0.0,
+        harmonic_distance=2 if case["highpass"] else 0,
+        overlay_entry_sec=OVERLAY_ENTRY_SEC if case["overlays"] else None,
+        overlay_vocal_url=f"{overlay_url}/vocal.wav" if case["overlays"] and overlay_url else None,
+        overlay_instrument_url=f"{overlay_url}/instrument.wav" if case["overlays"] and overlay_url else None,
+        overlay_vocal_bpm=OVERLAY_BPM if case["overlays"] else None,
+        overlay_instrument_bpm=OVERLAY_BPM if case["overlays"] else None,
+    )
+
+
+def missing_binaries(case: dict[str, Any], engine: str) -> list[str]:
+    if engine != "processor":
+        return []  # reference: numpy/librosa
+    needed = ["ffmpeg", "ffprobe"]
+    if case["stretch"] != 1.0 or case["pitch"] != 0.0:
+        needed.append("rubberband")
+    return [b for b in needed if shutil.which(b) is None]
+
+
+# ---------------------------------------------------------------------------
+# Etapas: wall/CPU/pico de memoria de cada subproceso (wait4 en lugar de waitpid)
+# ---------------------------------------------------------------------------
+
+_stages: list[dict[str, Any]] = []
+
+
+# Prefijo de prioridad de audio.tools.run_tool (AUTOMIX_TOOL_NICE / AUTOMIX_TOOL_IONICE_CLASS): opción -> lleva valor
+_PRIORITY_WRAPPERS = {"nice": ("-n",), "ionice": ("-c", "-n")}
+
+
+def _strip_priority_prefix(argv: list[str]) -> list[str]:
+    """Saca `nice -n N` / `ionice -c C` del principio: la etapa se nombra por la herramienta real."""
+    while argv and Path(argv[0]).name in _PRIORITY_WRAPPERS:
+        with_value = _PRIORITY_WRAPPERS[Path(argv[0]).name]
+        i = 1
+        while i < len(argv) and argv[i].startswith("-"):
+            i += 2 if argv[i] in with_value else 1
+        argv = argv[i:]
+    return argv
+
+
+def classify(args: Any) -> str:
+    argv = [str(a) for a in (args if isinstance(args, (list, tuple)) else [args])]
+    argv = _strip_priority_prefix(argv)
+    tool = Path(argv[0]).name if argv else "?"
+    if tool != "ffmpeg":
+        return tool
+    if "-filter_complex" in argv:
+        return "ffmpeg_mix"
+    if "lavfi" in argv:
+        return "ffmpeg_silence"
+    if "-af" in argv:
+        return "ffmpeg_stem"
+    return "ffmpeg_copy"
+
+
+class _MeasuredPopen(subprocess.Popen):
+    """Popen que cosecha al hijo con os.wait4 y registra su rusage (CPU y ru_maxrss del propio hijo)."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        self._bench_start = time.perf_counter()
+        super().__init__(*args, **kwargs)
+
+    def _try_wait(self, wait_flags: int):  # noqa: D401 (override de CPython)
+        try:
+            pid, sts, usage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return super()._try_wait(wait_flags)
+        if pid == self.pid:
+            _stages.append({
+                "stage": classify(self.args),
+                "wall_s": time.perf_counter() - self._bench_start,
+                "cpu_s": usage.ru_utime + usage.ru_stime,
+                "peak_mb": usage.ru_maxrss / 1024,
+            })
+        return pid, sts
+
+
+def summarize_stages(records: list[dict[str, Any]], total_wall: float, self_cpu: float,
+                     self_peak: float) -> dict[str, dict[str, float]]:
+    out: dict[str, dict[str, float]] = {}
+    for r in records:
+        s = out.setdefault(r["stage"], {"n": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_mb": 0.0})
+        s["n"] += 1
+        s["wall_s"] += r["wall_s"]
+        s["cpu_s"] += r["cpu_s"]
+        s["peak_mb"] = max(s["peak_mb"], r["peak_mb"])
+    sub_wall = sum(s["wall_s"] for s in out.values())
+    out["python"] = {"n": 1, "wall_s": max(0.0, total_wall - sub_wall), "cpu_s": self_cpu, "peak_mb": self_peak}
+    for s in out.values():
+        for k in ("wall_s", "cpu_s", "peak_mb"):
+            s[k] = round(s[k], 3)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Engines
+# ---------------------------------------------------------------------------
+
+def render_processor(path_a: Path, path_b: Path, an_a: SongAnalysis, an_b: SongAnalysis,
+                     strategy: MixStrategy, out: Path) -> None:
+    from backend.app.render import render_mix
+
+    real_popen = subprocess.Popen
+    subprocess.Popen = _MeasuredPopen
+    try:
+        render_mix(path_a, path_b, an_a, an_b, strategy, out)
+    finally:
+        subprocess.Popen = real_popen
+
+
+def _hsin(x: np.ndarray) -> np.ndarray:
+    return (1.0 - np.cos(np.pi * x)) / 2.0
+
+
+def _amix(main: np.ndarray, other: np.ndarray, sr: int) -> np.ndarray:
+    """amix inputs=2 duration=first: 1/2 cada uno; al terminar other, la escala de main sube a 1 en dropout_transition."""
+    out = main * 0.5
+    n = min(len(other), len(main))
+    out[:n] += other[:n] * 0.5
+    if n < len(main):
+        t = np.arange(len(main) - n) / sr
+        norm = np.maximum(1.0, 2.0 - t / AMIX_DROPOUT_SEC)
+        out[n:] = main[n:] / norm[:, None]
+    return out
+
+
+def render_reference(path_a: Path, path_b: Path, an_a: SongAnalysis, an_b: SongAnalysis,
+                     strategy: MixStrategy, out: Path, overlays: Optional[tuple[Path, Path]]) -> None:
+    """La misma cadena que render_mix + processor, en numpy: stretch/pitch (librosa), crossfade hsin, highpass
+    Butterworth de 2.º orden, overlays con adelay y amix 1/n. Sin loudnorm (la comparación iguala ganancia)."""
+    import librosa
+    import soundfile as sf
+    from scipy.signal import butter, lfilter
+
+    from backend.app.audio.stem_cache import grid_bpm
+
+    sr = settings.default_sr
+
+    def load(path: Path) -> np.ndarray:
+        y, file_sr = sf.read(str(path), dtype="float32", always_2d=True)
+        if file_sr != sr:
+            y = librosa.resample(y.T, orig_sr=file_sr, target_sr=sr).T
+        return y if y.shape[1] == 2 else np.repeat(y[:, :1], 2, axis=1)
+
+    def stretch_pitch(y: np.ndarray, ratio: float, semitones: float) -> np.ndarray:
+        chans = []
+        for ch in y.T:
+            # rubberband -t es factor de duración; librosa rate es el inverso
+            if abs(ratio - 1.0) > 1e-6:
+                ch = librosa.effects.time_stretch(ch, rate=1.0 / ratio)
+            if abs(semitones) > 1e-6:
+                ch = librosa.effects.pitch_shift(ch, sr=sr, n_steps=semitones)
+            chans.append(ch)
+        return np.stack(chans, axis=1)
+
+    a = stretch_pitch(load(path_a), strategy.song_a_stretch_ratio, strategy.song_a_pitch_semitones)
+    b = stretch_pitch(load(path_b), strategy.song_b_stretch_ratio, strategy.song_b_pitch_semitones)
+    dur_a, dur_b = len(a) / sr, len(b) / sr
+    cross_d = min(max(0.5, float(strategy.crossfade_sec)), dur_a * 0.2, dur_b * 0.2, 120.0)
+    cross_d = max(0.1, round(cross_d, 3))
+
+    if (strategy.harmonic_distance or 0) > 1:
+        bb, aa = butter(2, HIGHPASS_HZ, btype="highpass", fs=sr)
+        a = lfilter(bb, aa, a, axis=0).astype(np.float32)
+
+    n = int(round(cross_d * sr))
+    x = (np.arange(n) / n)[:, None]
+    mixed = np.concatenate([a[:-n], a[-n:] * _hsin(1.0 - x) + b[:n] * _hsin(x), b[n:]])
+
+    silence = np.zeros((int(0.1 * sr), 2), dtype=np.float32)
+    vocal = instrument = silence
+    if overlays is not None:
+        target = grid_bpm((an_a.bpm + an_b.bpm) / 2.0)
+        delay = np.zeros((int(round(OVERLAY_ENTRY_SEC * sr)), 2), dtype=np.float32)
+        # atempo = target/bpm acelera: librosa rate = target/bpm
+        vocal, instrument = (
+            np.concatenate([delay, np.stack([librosa.effects.time_stretch(ch, rate=target / OVERLAY_BPM)
+                                             for ch in load(p).T], axis=1)])
+            for p in overlays
+        )
+    mixed = _amix(_amix(mixed, vocal, sr), instrument, sr)
+    sf.write(str(out), np.clip(mixed, -1.0, 1.0), sr, subtype="PCM_16")
+
+
+# ---------------------------------------------------------------------------
+# Comparación numérica
+# ---------------------------------------------------------------------------
+
+def _load_mono(path: Path, sr: int) -> np.ndarray:
+    import librosa
+    import soundfile as sf
+
+    y, file_sr = sf.read(str(path), dtype="float32", always_2d=True)
+    y = y.mean(axis=1)
+    return librosa.resample(y, orig_sr=file_sr, target_sr=sr) if file_sr != sr else y
+
+
+def diff_audio(path_x: Path, path_y: Path, gain_window_sec: Optional[float] = None) -> dict[str, float]:
+    """
+    x es la referencia. Ganancia de y igualada por mínimos cuadrados antes de medir: global, o local en ventanas
+    de gain_window_sec (para comparar contra una salida sin loudnorm, que en modo dinámico varía la ganancia).
+    """
+    import librosa
+    from scipy.ndimage import uniform_filter1d
+
+    sr = settings.default_sr
+    x, y = _load_mono(path_x, sr), _load_mono(path_y, sr)
+    length_diff_ms = (len(y) - len(x)) / sr * 1000
+    n = min(len(x), len(y))
+    x, y = x[:n].astype(np.float64), y[:n].astype(np.float64)
+    gain = float(np.dot(x, y) / max(np.dot(y, y), 1e-12))
+    if gain_window_sec:
+        size = max(1, int(gain_window_sec * sr))
+        local = uniform_filter1d(x * y, size) / np.maximum(uniform_filter1d(y * y, size), 1e-12)
+        y = y * local
+        gain = 1.0
+    residual = x - gain * y
+    rms_x = float(np.sqrt(np.mean(x ** 2))) or 1e-12
+    rms_error_db = 20 * np.log10(max(float(np.sqrt(np.mean(residual ** 2))), 1e-12) / rms_x)
+    sx = 20 * np.log10(np.abs(librosa.stft(x, n_fft=2048, hop_length=512)) + 1e-9)
+    sy = 20 * np.log10(np.abs(librosa.stft(gain * y, n_fft=2048, hop_length=512)) + 1e-9)
+    mask = sx > sx.max() - 60  # solo bins con energía (el piso de ruido de cuantización no cuenta)
+    spectral_diff_db = float(np.mean(np.abs(sx - sy)[mask])) if mask.any() else 0.0
+    return {
+        "rms_error_db": round(float(rms_error_db), 2),
+        "spectral_diff_db": round(spectral_diff_db, 2),
+        "length_diff_ms": round(length_diff_ms, 1),
+        "gain": round(gain, 4),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Fixtures: tracks, overlays y servidor HTTP local
+# ---------------------------------------------------------------------------
+
+def _analysis(spec: TrackSpec, path: Path) -> SongAnalysis:
+    return SongAnalysis(bpm=spec.bpm, key=f"{spec.key} {spec.scale}", key_scale=spec.scale, energy=0.7,
+                        duration_sec=spec.duration_sec, path=path)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def serve_dir(directory: Path) -> tuple[http.server.ThreadingHTTPServer, str]:
+    handler = functools.partial(_QuietHandler, directory=str(directory))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def run_case(engine: str, case: dict[str, Any], fixtures: dict[str, Any], out: Path) -> dict[str, Any]:
+    overlay_url = fixtures["overlay_url"]
+    strategy = strategy_for(case, overlay_url)
+    _stages.clear()
+    reset_peak_rss()
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    if engine == "processor":
+        render_processor(fixtures["path_a"], fixtures["path_b"], fixtures["an_a"], fixtures["an_b"], strategy, out)
+    else:
+        overlays = fixtures["overlay_files"] if case["overlays"] else None
+        render_reference(fixtures["path_a"], fixtures["path_b"], fixtures["an_a"], fixtures["an_b"],
+                         strategy, out, overlays)
+    wall = time.perf_counter() - t0
+    stages = summarize_stages(list(_stages), wall, time.process_time() - cpu0, peak_rss_mb())
+    import soundfile as sf
+
+    info = sf.info(str(out))
+    return {
+        "wall_s": round(wall, 3),
+        "cpu_s": round(sum(s["cpu_s"] for s in stages.values()), 3),
+        "peak_mb": round(max(s["peak_mb"] for s in stages.values()), 1),
+        "stages": stages,
+        "output": {"sr": info.samplerate, "channels": info.channels, "duration_sec": round(info.duration, 3),
+                   "bytes": out.stat().st_size},
+    }
+
+
+# ---------------------------------------------------------------------------
+# Reporte
+# ---------------------------------------------------------------------------
+
+def print_results(results: dict[str, dict[str, Any]]) -> None:
+    print(f"\n{'caso':<24} {'engine':<10} {'wall s':>7} {'cpu s':>7} {'pico MB':>8} {'sr':>7}  etapas (wall s)")
+    for name, by_engine in results.items():
+        for engine, r in by_engine.items():
+            if "skipped" in r or "error" in r:
+                print(f"{name[:24]:<24} {engine:<10} {r.get('skipped') or 'ERROR: ' + r['error'][:60]}")
+                continue
+            stages = " ".join(f"{k}={v['wall_s']:.2f}" for k, v in
+                              sorted(r["stages"].items(), key=lambda kv: -kv[1]["wall_s"]))
+            print(f"{name[:24]:<24} {engine:<10} {r['wall_s']:>7.2f} {r['cpu_s']:>7.2f} {r['peak_mb']:>8.0f} "
+                  f"{r['output']['sr']:>7}  {stages}")
+
+
+def print_diffs(title: str, diffs: dict[str, dict[str, float]]) -> None:
+    if not diffs:
+        return
+    print(f"\n{title}")
+    print(f"{'caso':<24} {'rms err dB':>11} {'spec dB':>8} {'Δlen ms':>8} {'gain':>7}")
+    for name, d in diffs.items():
+        print(f"{name[:24]:<24} {d['rms_error_db']:>11.1f} {d['spectral_diff_db']:>8.2f} "
+              f"{d['length_diff_ms']:>8.1f} {d['gain']:>7.3f}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark y test diferencial del render")
+    parser.add_argument("--length", type=float, default=120.0, help="largo de cada track (s)")
+    parser.add_argument("--matrix", choices=("ofat", "full"), default="ofat",
+                        help="ofat: un factor a la vez sobre el caso base; full: producto completo")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--only", nargs="+", default=None, help="nombres de caso (ver la tabla)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-reference", type=Path, default=None,
+                        help="guardar salidas y tiempos del engine processor en este directorio")
+    parser.add_argument("--reference", type=Path, default=None,
+                        help="comparar salidas del engine processor contra una --save-reference previa")
+    parser.add_argument("--max-rms-error-db", type=float, default=-40.0, help="residuo máximo contra la referencia")
+    parser.add_argument("--max-spectral-diff-db", type=float, default=1.0, help="diferencia espectral máxima")
+    parser.add_argument("--max-length-diff-ms", type=float, default=50.0)
+    parser.add_argument("--max-slowdown", type=float, default=None,
+                        help="fracción de wall time tolerada contra la referencia (misma máquina)")
+    parser.add_argument("--json", type=Path, default=None, help="escribir resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    if (args.save_reference or args.reference) and "processor" not in args.engines:
+        parser.error("--save-reference/--reference requieren el engine processor")
+    cases = {case_name(c): c for c in build_cases(args.matrix)}
+    if args.only:
+        unknown = set(args.only) - set(cases)
+        if unknown:
+            parser.error(f"casos desconocidos: {', '.join(sorted(unknown))} (disponibles: {', '.join(cases)})")
+        cases = {k: v for k, v in cases.items() if k in args.only}
+
+    reference_manifest = None
+    if args.reference:
+        manifest_path = args.reference / "manifest.json"
+        if not manifest_path.exists():
+            print(f"No existe {manifest_path}", file=sys.stderr)
+            return 1
+        reference_manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if reference_manifest.get("length") != args.length or reference_manifest.get("seed") != args.seed:
+            print("La referencia se generó con otro --length/--seed: no comparable", file=sys.stderr)
+            return 2
+
+    sr = settings.default_sr
+    results: dict[str, dict[str, Any]] = {}
+    engine_diffs: dict[str, dict[str, float]] = {}
+    version_diffs: dict[str, dict[str, float]] = {}
+    failures: list[str] = []
+    with tempfile.TemporaryDirectory(prefix="opus_bench_render_") as tmp:
+        work = Path(tmp)
+        # Cache de samples/stems aislada: los overlays se bajan del servidor local como en producción
+        settings.cloud_cache_dir = str(work / "cloud_cache")
+        spec_a = TrackSpec(bpm=124.0, key="A", scale="minor", duration_sec=args.length, noise=0.02, seed=args.seed)
+        spec_b = TrackSpec(bpm=126.0, key=NOTES[4], scale="minor", duration_sec=args.length, noise=0.02,
+                           seed=args.seed + 1)
+        path_a, path_b = work / "track_a.wav", work / "track_b.wav"
+        write_track(path_a, spec_a, sr=sr, stereo=True)
+        write_track(path_b, spec_b, sr=sr, stereo=True)
+        served = work / "served"
+        overlay_files = (served / "vocal.wav", served / "instrument.wav")
+        write_track(overlay_files[0], TrackSpec(bpm=OVERLAY_BPM, key="A", scale="minor", duration_sec=16.0,
+                                                phrase_bars=2, seed=args.seed + 2), sr=sr, stereo=True)
+        write_track(overlay_files[1], TrackSpec(bpm=OVERLAY_BPM, key="E", scale="minor", duration_sec=16.0,
+                                                noise=0.05, phrase_bars=4, seed=args.seed + 3), sr=sr, stereo=True)
+        server, overlay_url = serve_dir(served)
+        fixtures = {
+            "path_a": path_a, "path_b": path_b, "an_a": _analysis(spec_a, path_a), "an_b": _analysis(spec_b, path_b),
+            "overlay_url": overlay_url, "overlay_files": overlay_files,
+        }
+        print(f"{len(cases)} casos × {len(args.engines)} engines, tracks de {args.length:.0f} s (sr={sr})")
+        try:
+            for i, (name, case) in enumerate(cases.items()):
+                results[name] = {}
+                outputs: dict[str, Path] = {}
+                for engine in args.engines:
+                    missing = missing_binaries(case, engine)
+                    if missing:
+                        results[name][engine] = {"skipped": f"sin {', '.join(missing)}"}
+                        continue
+                    print(f"  {name} [{engine}]...", flush=True)
+                    out = work / f"{engine}_{i}.wav"
+                    try:
+                        results[name][engine] = run_case(engine, case, fixtures, out)
+                        outputs[engine] = out
+                    except Exception as e:
+                        results[name][engine] = {"error": str(e)}
+                        failures.append(f"{name} [{engine}]: {str(e)[:200]}")
+                if len(outputs) == 2:
+                    engine_diffs[name] = diff_audio(outputs["reference"], outputs["processor"],
+                                                    gain_window_sec=LOUDNORM_WINDOW_SEC)
+                if "processor" in outputs and args.save_reference:
+                    args.save_reference.mkdir(parents=True, exist_ok=True)
+                    shutil.copyfile(outputs["processor"], args.save_reference / f"{name}.wav")
+                if "processor" in outputs and reference_manifest is not None:
+                    ref_wav = args.reference / f"{name}.wav"
+                    if not ref_wav.exists():
+                        print(f"  (sin {ref_wav.name} en la referencia)")
+                        continue
+                    d = version_diffs[name] = diff_audio(ref_wav, outputs["processor"])
+                    if d["rms_error_db"] > args.max_rms_error_db:
+                        failures.append(f"{name}: residuo {d['rms_error_db']:.1f} dB > {args.max_rms_error_db} dB")
+                    if d["spectral_diff_db"] > args.max_spectral_diff_db:
+                        failures.append(f"{name}: diferencia espectral {d['spectral_diff_db']:.2f} dB "
+                                        f"> {args.max_spectral_diff_db} dB")
+                    if abs(d["length_diff_ms"]) > args.max_length_diff_ms:
+                        failures.append(f"{name}: largo {d['length_diff_ms']:+.1f} ms")
+                    ref_r = (reference_manifest.get("results") or {}).get(name, {}).get("processor") or {}
+                    same_machine = reference_manifest.get("fingerprint") == fingerprint()
+                    if args.max_slowdown is not None and same_machine and ref_r.get("wall_s"):
+                        cur = results[name]["processor"]["wall_s"]
+                        if cur > ref_r["wall_s"] * (1 + args.max_slowdown):
+                            failures.append(f"{name}: wall {cur:.2f} s vs {ref_r['wall_s']:.2f} s")
+        finally:
+            server.shutdown()
+
+    print_results(results)
+    print_diffs("processor vs reference (informativo)", engine_diffs)
+    print_diffs(f"processor vs referencia guardada ({args.reference})", version_diffs)
+    current = {
+        "fingerprint": fingerprint(), "length": args.length, "seed": args.seed, "matrix": args.matrix,
+        "cases": cases, "results": results, "engine_diffs": engine_diffs, "version_diffs": version_diffs,
+    }
+    if args.json:
+        args.json.write_text(json.dumps(current, indent=2), encoding="utf-8")
+    if args.save_reference:
+        args.save_reference.mkdir(parents=True, exist_ok=True)
+        (args.save_reference / "manifest.json").write_text(json.dumps(current, indent=2) + "\n", encoding="utf-8")
+        print(f"\nReferencia guardada en {args.save_reference}")
+    if failures:
+        print("\nFALLAS:", file=sys.stderr)
+        for f in failures:
+            print(f"  {f}", file=sys.stderr)
+        return 1
+    if reference_manifest is not None:
+        print("\nSalidas equivalentes a la referencia")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
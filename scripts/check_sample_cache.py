@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Chequeo end-to-end de la cache de samples cloud (audio.sample_cache) contra un http.server local con ETag.
+
+Verifica, sobre un cache_dir temporal:
+  - hit: dentro de revalidate_sec el segundo get no toca la red
+  - revalidación: pasado revalidate_sec, If-None-Match → 304 y se sirve el mismo blob
+  - contenido nuevo: el servidor cambia el archivo (ETag nuevo) → blob nuevo
+  - evicción LRU: con max_bytes chico, el blob menos usado (y más viejo que _EVICT_MIN_AGE_SEC) se borra
+  - carrera: varios procesos piden la misma URL a la vez → una sola descarga (flock por URL), mismo blob
+
+Sale con código 1 si algún chequeo falla.
+
+Uso (desde la raíz del proyecto, con venv activado):
+  python scripts/check_sample_cache.py
+  python scripts/check_sample_cache.py --processes 4 --delay 0.5
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Permitir importar backend.app (ejecutar desde raíz del proyecto)
+_root = Path(__file__).resolve().parent.parent
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+
+from backend.app.audio.sample_cache import _EVICT_MIN_AGE_SEC, SampleCache
+
+SAMPLE_BYTES = 64 * 1024
+
+
+class _Files:
+    """Contenido servido por path + contadores de respuestas (200 / 304) por path."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.content: dict[str, bytes] = {}
+        self.sent: dict[str, int] = {}
+        self.not_modified: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def put(self, path: str, seed: int) -> None:
+        self.content[path] = bytes((seed + i) % 251 for i in range(SAMPLE_BYTES))
+
+
+def _handler(files: _Files) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = files.content.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                with files.lock:
+                    files.not_modified[self.path] = files.not_modified.get(self.path, 0) + 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            with files.lock:
+                files.sent[self.path] = files.sent.get(self.path, 0) + 1
+            time.sleep(files.delay)  # ventana para que la carrera entre procesos se solape
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    return Handler
+
+
+def _race_worker(root: str, url: str, barrier, out) -> None:
+    cache = SampleCache(Path(root), max_bytes=1 << 30, revalidate_sec=3600)
+    barrier.wait()
+    out.put(str(cache.get(url)))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Chequeo de la cache de samples cloud contra un servidor local")
+    parser.add_argument("--processes", type=int, default=3, help="Procesos en la carrera por la misma URL")
+    parser.add_argument("--delay", type=float, default=0.3, help="Demora (s) del servidor en cada respuesta 200")
+    args = parser.parse_args(argv)
+
+    files = _Files(args.delay)
+    for i, name in enumerate(("/hit.wav", "/reval.wav", "/changed.wav", "/old.wav", "/new.wav", "/race.wav")):
+        files.put(name, i)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(files))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    failures: list[str] = []
+
+    def check(name: str, ok: bool, detail: str = "") -> None:
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}" + (f" ({detail})" if detail else ""))
+        if not ok:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory(prefix="opus_sample_cache_check_") as tmp:
+        cache = SampleCache(Path(tmp) / "fresh", max_bytes=1 << 30, revalidate_sec=3600)
+        stale = SampleCache(Path(tmp) / "stale", max_bytes=1 << 30, revalidate_sec=0)
+
+        first = cache.get(base + "/hit.wav")
+        second = cache.get(base + "/hit.wav")
+        check("hit", first == second and files.sent.get("/hit.wav") == 1,
+              f"descargas={files.sent.get('/hit.wav')}")
+
+        first = stale.get(base + "/reval.wav")
+        second = stale.get(base + "/reval.wav")
+        check("revalidación 304", first == second and files.sent.get("/reval.wav") == 1
+              and files.not_modified.get("/reval.wav") == 1,
+              f"200={files.sent.get('/reval.wav')} 304={files.not_modified.get('/reval.wav')}")
+
+        first = stale.get(base + "/changed.wav")
+        files.put("/changed.wav", 99)
+        second = stale.get(base + "/changed.wav")
+        check("contenido nuevo → blob nuevo", first != second and second.read_bytes() == files.content["/changed.wav"],
+              f"{first.name} → {second.name}")
+
+        lru = SampleCache(Path(tmp) / "lru", max_bytes=SAMPLE_BYTES + SAMPLE_BYTES // 2, revalidate_sec=3600)
+        old = lru.get(base + "/old.wav")
+        past = time.time() - _EVICT_MIN_AGE_SEC - 60  # los blobs recién usados no se evictan (FFmpeg en curso)
+        os.utime(old, (past, past))
+        new = lru.get(base + "/new.wav")
+        check("evicción LRU", not old.exists() and new.exists() and lru.total_bytes() <= lru.max_bytes,
+              f"bytes={lru.total_bytes()} max={lru.max_bytes}")
+
+        # spawn: los hijos no heredan el cliente HTTP compartido del padre
+        ctx = mp.get_context("spawn")
+        barrier = ctx.Barrier(args.processes)
+        out = ctx.Queue()
+        race_root = str(Path(tmp) / "race")
+        procs = [ctx.Process(target=_race_worker, args=(race_root, base + "/race.wav", barrier, out))
+                 for _ in range(args.processes)]
+        for p in procs:
+            p.start()
+        paths = [out.get(timeout=60) for _ in procs]
+        for p in procs:
+            p.join(timeout=10)
+        check("carrera entre procesos", len(set(paths)) == 1 and files.sent.get("/race.wav") == 1
+              and all(p.exitcode == 0 for p in procs),
+              f"procesos={args.processes} descargas={files.sent.get('/race.wav')}")
+
+    server.shutdown()
+    if failures:
+        print(f"{len(failures)} chequeo(s) fallaron: {', '.join(failures)}")
+        return 1
+    print("Cache de samples OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
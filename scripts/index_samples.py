@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Indexer de la librería de samples: recorre assets/samples/{percussion,instruments,vocals}, analiza en paralelo
+los archivos nuevos o modificados (mtime/size) y escribe el índice SQLite de forma atómica (os.replace).
+Los requests solo leen este índice; nunca analizan samples.
+
+Reanudable: cada análisis terminado se agrega a un checkpoint (.jsonl junto al índice); si se corta,
+la próxima corrida no repite lo ya analizado. El checkpoint se borra al escribir el índice.
+
+Uso (desde la raíz del proyecto, con venv activado):
+  python scripts/index_samples.py
+  python scripts/index_samples.py --workers 8 --force
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional
+
+# Permitir importar backend.app (ejecutar desde raíz del proyecto)
+_root = Path(__file__).resolve().parent.parent
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+
+from backend.app import sample_index
+from backend.app.config import settings
+from backend.app.sample_library import (
+    SAMPLE_CATEGORIES,
+    dir_mtime_ns,
+    get_sample_metadata,
+    get_samples_dir,
+    scan_category,
+)
+
+
+def _analyze(path_str: str, sr: int) -> dict:
+    """Worker del pool: sidecar si existe, si no analyze_song (y escribe el sidecar)."""
+    return get_sample_metadata(Path(path_str), sr=sr)
+
+
+def _load_index(path: Path) -> tuple[dict[str, tuple], dict[str, int]]:
+    """Filas y mtimes de directorio del índice actual (vacío si no existe)."""
+    if not path.exists():
+        return {}, {}
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        rows = conn.execute(
+            "SELECT rel_path, category, bpm, key, key_scale, key_camelot, mtime_ns, size FROM samples"
+        ).fetchall()
+        dirs = dict(conn.execute("SELECT category, mtime_ns FROM dirs").fetchall())
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"  Índice actual ilegible ({e}); se reconstruye completo", file=sys.stderr)
+        return {}, {}
+    return {r[0]: r for r in rows}, dirs
+
+
+def _load_checkpoint(path: Path) -> dict[str, dict]:
+    """rel_path → {mtime_ns, size, meta} de análisis ya hechos en una corrida interrumpida."""
+    done: dict[str, dict] = {}
+    if not path.exists():
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                done[entry["rel"]] = entry
+            except (ValueError, KeyError):
+                continue  # última línea cortada
+    return done
+
+
+def _stat_known(cat: str, old_rows: dict[str, tuple]) -> Optional[dict[str, tuple[Path, int, int]]]:
+    """
+    Directorio sin altas/bajas (mismo mtime): stat de los archivos ya indexados, sin listar. Detecta ediciones in
+    situ (el mtime del directorio no cambia). None si alguno desapareció: hay que listar.
+    """
+    base = get_samples_dir()
+    files: dict[str, tuple[Path, int, int]] = {}
+    for rel, r in old_rows.items():
+        if r[1] != cat:
+            continue
+        path = base / rel
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        files[rel] = (path, st.st_mtime_ns, st.st_size)
+    return files
+
+
+def _write_index(path: Path, entries: list[tuple[str, str, dict, int, int]], dir_mtimes: dict[str, int]) -> None:
+    """Escribe el índice completo en un archivo temporal y lo reemplaza atómicamente."""
+    tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    tmp.unlink(missing_ok=True)
+    conn = sample_index.open_index(tmp)
+    try:
+        for rel, cat, meta, mtime_ns, size in entries:
+            sample_index.upsert_sample(conn, rel, cat, meta, mtime_ns, size)
+        for cat, mtime_ns in dir_mtimes.items():
+            sample_index.set_dir_mtime(conn, cat, mtime_ns)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Indexa assets/samples (BPM/Key) en el índice SQLite.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos de análisis")
+    parser.add_argument("--force", action="store_true", help="listar todas las categorías aunque su mtime no cambió")
+    parser.add_argument("--index", type=Path, default=None, help="ruta del índice (default: AUTOMIX_SAMPLE_INDEX_PATH)")
+    args = parser.parse_args(argv)
+
+    index = args.index or sample_index.index_path()
+    checkpoint = index.with_name(index.name + ".checkpoint.jsonl")
+    print(f"Indexando {settings.assets_samples_dir} → {index}")
+
+    old_rows, old_dirs = _load_index(index)
+    done = _load_checkpoint(checkpoint)
+    if done:
+        print(f"  Reanudando: {len(done)} análisis en checkpoint")
+
+    entries: list[tuple[str, str, dict, int, int]] = []
+    todo: list[tuple[str, str, Path, int, int]] = []
+    # mtimes de directorio antes de listar: un archivo que llegue durante la corrida deja el índice desactualizado
+    # respecto del directorio y la próxima corrida lo lista
+    dir_mtimes = {cat: dir_mtime_ns(cat) for cat in SAMPLE_CATEGORIES}
+    scanned: dict[str, dict[str, tuple[Path, int, int]]] = {}
+    for cat in SAMPLE_CATEGORIES:
+        files = None
+        if not args.force and old_dirs.get(cat) == dir_mtimes[cat]:
+            files = _stat_known(cat, old_rows)
+        if files is None:
+            files = scan_category(cat)
+        scanned[cat] = files
+        for rel, (path, mtime_ns, size) in files.items():
+            old = old_rows.get(rel)
+            if old is not None and (old[6], old[7]) == (mtime_ns, size):
+                meta = {"bpm": old[2], "key": old[3], "key_scale": old[4], "key_camelot": old[5]}
+                entries.append((rel, cat, meta, mtime_ns, size))
+                continue
+            ck = done.get(rel)
+            if ck is not None and (ck["mtime_ns"], ck["size"]) == (mtime_ns, size):
+                entries.append((rel, cat, ck["meta"], mtime_ns, size))
+                continue
+            todo.append((rel, cat, path, mtime_ns, size))
+
+    total = len(todo)
+    print(f"  {len(entries)} sin cambios, {total} para analizar ({args.workers} procesos)")
+    failed = 0
+    if todo:
+        start = time.perf_counter()
+        with open(checkpoint, "a", encoding="utf-8") as ck_file, ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = {pool.submit(_analyze, str(path), settings.default_sr): (rel, cat, mtime_ns, size) for rel, cat, path, mtime_ns, size in todo}
+            for i, fut in enumerate(as_completed(futures), start=1):
+                rel, cat, mtime_ns, size = futures[fut]
+                try:
+                    meta = fut.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"  Error analizando {rel}: {e}", file=sys.stderr)
+                    continue
+                entries.append((rel, cat, meta, mtime_ns, size))
+                ck_file.write(json.dumps({"rel": rel, "mtime_ns": mtime_ns, "size": size, "meta": meta}) + "\n")
+                ck_file.flush()
+                elapsed = time.perf_counter() - start
+                eta = elapsed / i * (total - i)
+                print(f"  [{i}/{total}] {rel}  bpm={meta.get('bpm')} key={meta.get('key_camelot')}  eta {eta:.0f}s", flush=True)
+        # Los sidecars escritos cambian el mtime del directorio: se guarda el nuevo solo si, re-listando, los audios
+        # son los mismos que antes del análisis (si llegó o cambió alguno, queda el previo y la próxima corrida lista)
+        for cat in {cat for _, cat, _, _, _ in todo}:
+            after = dir_mtime_ns(cat)
+            current = {rel: (m, size) for rel, (_, m, size) in scan_category(cat).items()}
+            if current == {rel: (m, size) for rel, (_, m, size) in scanned[cat].items()}:
+                dir_mtimes[cat] = after
+
+    _write_index(index, entries, dir_mtimes)
+    checkpoint.unlink(missing_ok=True)
+    print(f"Índice escrito: {len(entries)} samples ({failed} errores)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
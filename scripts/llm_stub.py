@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Stub OpenAI-compatible para pruebas de carga: POST /v1/chat/completions (streaming SSE o no) devuelve un objeto de
+decisión válido (los campos de llm_output.LLM_FIELDS) con latencia configurable: espera hasta el primer token +
+tokens a ritmo fijo, con jitter y una fracción opcional de errores 503 (el pipeline cae a heurísticas).
+GET /stats: requests, errores, concurrencia actual y máxima (para ver cuánto paralelismo llega al LLM).
+
+Sin dependencias (http.server). Apuntar la app con AUTOMIX_OPENAI_BASE_URL=http://127.0.0.1:8001/v1 y cualquier
+AUTOMIX_OPENAI_API_KEY.
+
+Uso (desde la raíz del proyecto):
+  python scripts/llm_stub.py                                  # :8001, ~0.8 s al primer token, 80 tokens/s
+  python scripts/llm_stub.py --port 8001 --latency 2 --jitter 0.5 --tokens-per-sec 40 --error-rate 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+# ~4 caracteres por token (orden de magnitud de los tokenizers de OpenAI para JSON)
+CHARS_PER_TOKEN = 4
+
+DECISION = {
+    "transition_type": "beat_match_crossfade",
+    "transition_length_bars": 16,
+    "crossfade_sec": 30.0,
+    "bass_swap_sec": None,
+    "filter_type": None,
+    "song_a_stretch_ratio": 1.0,
+    "song_a_pitch_semitones": 0.0,
+    "song_a_transition_start_sec": 0.0,
+    "song_b_stretch_ratio": 1.0,
+    "song_b_pitch_semitones": 0.0,
+    "song_b_transition_start_sec": 0.0,
+    "start_offset_bars": 0,
+    "reasoning": "Stub: transición de 16 compases en fase, sin ajustes de tempo ni tono.",
+    "dj_comment": "Stub LLM: crossfade de 16 compases.",
+    "fx_chain": None,
+    "overlay_instrument": None,
+    "overlay_vocal": None,
+    "overlay_instrument_url": None,
+    "overlay_vocal_url": None,
+}
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def enter(self) -> None:
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self, error: bool = False) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            self.errors += int(error)
+
+    def as_dict(self) -> dict[str, int]:
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors, "in_flight": self.in_flight,
+                    "max_in_flight": self.max_in_flight}
+
+
+def make_handler(args: argparse.Namespace, stats: Stats, rng: random.Random) -> type[BaseHTTPRequestHandler]:
+    rng_lock = threading.Lock()
+
+    def draw(mean: float) -> float:
+        with rng_lock:
+            return max(0.0, mean * (1.0 + rng.uniform(-args.jitter, args.jitter)))
+
+    def fail() -> bool:
+        with rng_lock:
+            return rng.random() < args.error_rate
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a: Any) -> None:
+            if args.verbose:
+                super().log_message(*a)
+
+        def _json(self, code: int, body: dict[str, Any]) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/stats"):
+                self._json(200, stats.as_dict())
+            elif self.path.rstrip("/").endswith("/models"):
+                self._json(200, {"object": "list", "data": [{"id": args.model, "object": "model"}]})
+            else:
+                self._json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self) -> None:
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._json(400, {"error": {"message": "invalid JSON body"}})
+                return
+            stats.enter()
+            error = False
+            try:
+                time.sleep(draw(args.latency))
+                if fail():
+                    error = True
+                    self._json(503, {"error": {"message": "stub: simulated overload", "type": "server_error"}})
+                    return
+                content = json.dumps(DECISION, ensure_ascii=False)
+                prompt_chars = sum(len(str(m.get("content") or "")) for m in request.get("messages") or [])
+                usage = {
+                    "prompt_tokens": prompt_chars // CHARS_PER_TOKEN,
+                    "completion_tokens": len(content) // CHARS_PER_TOKEN,
+                    "total_tokens": (prompt_chars + len(content)) // CHARS_PER_TOKEN,
+                }
+                model = request.get("model") or args.model
+                if request.get("stream"):
+                    include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+                    self._stream(content, model, usage if include_usage else None)
+                else:
+                    time.sleep(draw(len(content) / CHARS_PER_TOKEN / args.tokens_per_sec))
+                    self._json(200, {
+                        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": content}}],
+                        "usage": usage,
+                    })
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # el cliente corta el stream apenas cierra el objeto JSON
+            finally:
+                stats.leave(error)
+
+        def _stream(self, content: str, model: str, usage: dict[str, int] | None) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            cid = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+            created = int(time.time())
+
+            def send(choices: list[dict[str, Any]], **extra: Any) -> None:
+                chunk = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": choices, **extra}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            delay = 1.0 / args.tokens_per_sec
+            for i in range(0, len(content), CHARS_PER_TOKEN):
+                time.sleep(draw(delay))
+                send([{"index": 0, "delta": {"content": content[i:i + CHARS_PER_TOKEN]}, "finish_reason": None}])
+            send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if usage is not None:
+                send([], usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible con latencia configurable")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.8, help="segundos hasta el primer token (media)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="variación relativa uniforme (0.3 = ±30 %%)")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de requests que devuelven 503")
+    parser.add_argument("--model", default="stub-model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="loguear cada request")
+    args = parser.parse_args(argv)
+
+    stats = Stats()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, stats, random.Random(args.seed)))
+    server.daemon_threads = True
+    print(f"LLM stub en http://{args.host}:{server.server_address[1]}/v1 "
+          f"(latencia {args.latency}s ±{args.jitter:.0%}, {args.tokens_per_sec:g} tokens/s, "
+          f"errores {args.error_rate:.0%})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Stats: {stats.as_dict()}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
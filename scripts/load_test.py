@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga end-to-end: llegadas Poisson (open loop) de dos escenarios concurrentes contra la API.
+- generate: POST /session → /upload a y b → POST /generate → poll de status → GET /download
+- set: POST /process-folder con un crate de N tracks → poll de status (tiempo en cada phase) → GET del set
+Cada job sube tracks sintéticos únicos (scripts/synth_audio.py): sin hits del cache de análisis ni de estrategias.
+
+Reporte: throughput por escenario (jobs/min), p50/p95/p99 por fase y backlog en el tiempo (largo de las colas
+Celery y sesiones en curso, leídos de Redis cada --sample-sec).
+
+--start-stack levanta todo local: Redis (si no responde y hay redis-server), scripts/llm_stub.py con la latencia
+pedida, la API (uvicorn) y los workers Celery (ai_brain + N réplicas de audio worker, como en docker-compose).
+Así se mide el efecto de cada cambio de escala (--audio-workers, --audio-concurrency) en el sistema entero.
+
+Uso (desde la raíz del proyecto, con venv activado):
+  python scripts/load_test.py --start-stack --set-rate 2 --generate-rate 6 --duration 300
+  python scripts/load_test.py --start-stack --audio-workers 4 --crate-size 4-8 --llm-latency 2 --json out.json
+  python scripts/load_test.py --base-url http://localhost:8000 --redis-url redis://localhost:6379/0   # docker-compose
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+import numpy as np
+
+# Permitir importar backend.app (ejecutar desde raíz del proyecto)
+_root = Path(__file__).resolve().parent.parent
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+
+from backend.app.config import settings
+
+from synth_audio import NOTES, TrackSpec, synth_track
+
+FAILED_STATUSES = ("failed", "error")
+
+
+# ---------------------------------------------------------------------------
+# Tracks sintéticos (en memoria)
+# ---------------------------------------------------------------------------
+
+def track_bytes(seed: int, length: float, sr: int) -> bytes:
+    """WAV PCM 16 de un track único por seed (BPM, tónica y modo rotan con el seed)."""
+    import soundfile as sf
+
+    rng = random.Random(seed)
+    spec = TrackSpec(
+        bpm=float(rng.choice([118, 122, 124, 126, 128, 130])),
+        key=NOTES[rng.randrange(12)],
+        scale=rng.choice(["major", "minor"]),
+        duration_sec=length,
+        noise=0.02,
+        seed=seed,
+    )
+    y, _ = synth_track(spec, sr)
+    buf = io.BytesIO()
+    sf.write(buf, y, sr, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+
+def parse_range(value: str) -> tuple[int, int]:
+    lo, _, hi = value.partition("-")
+    lo_i = int(lo)
+    hi_i = int(hi) if hi else lo_i
+    if lo_i < 2 or hi_i < lo_i:
+        raise argparse.ArgumentTypeError("crate size: N o MIN-MAX con MIN >= 2")
+    return lo_i, hi_i
+
+
+# ---------------------------------------------------------------------------
+# Stack local
+# ---------------------------------------------------------------------------
+
+def _port_open(host: str, port: int) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Stack:
+    """Procesos locales (Redis, stub LLM, API, workers); logs en work/logs. stop() los termina en orden inverso."""
+
+    def __init__(self, work: Path):
+        self.work = work
+        self.logs = work / "logs"
+        self.logs.mkdir(parents=True, exist_ok=True)
+        self.procs: list[tuple[str, subprocess.Popen]] = []
+
+    def spawn(self, name: str, cmd: list[str], env: Optional[dict[str, str]] = None) -> None:
+        log = open(self.logs / f"{name}.log", "wb")
+        proc = subprocess.Popen(cmd, cwd=str(_root), env={**os.environ, **(env or {})}, stdout=log,
+                                stderr=subprocess.STDOUT)
+        self.procs.append((name, proc))
+
+    def check(self) -> Optional[str]:
+        for name, proc in self.procs:
+            if proc.poll() is not None:
+                return f"{name} terminó (exit {proc.returncode}); ver {self.logs / (name + '.log')}"
+        return None
+
+    def stop(self) -> None:
+        for _, proc in reversed(self.procs):
+            if proc.poll() is None:
+                proc.terminate()
+        for _, proc in reversed(self.procs):
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def start_stack(args: argparse.Namespace, work: Path) -> Stack:
+    stack = Stack(work)
+    redis = urlparse(args.redis_url)
+    host, port = redis.hostname or "127.0.0.1", redis.port or 6379
+    if not _port_open(host, port):
+        server = shutil.which("redis-server")
+        if server is None:
+            raise RuntimeError(f"Redis no responde en {host}:{port} y no hay redis-server en el PATH")
+        stack.spawn("redis", [server, "--port", str(port), "--save", "", "--appendonly", "no"])
+    llm_port = _free_port()
+    stack.spawn("llm_stub", [
+        sys.executable, str(_root / "scripts" / "llm_stub.py"), "--port", str(llm_port),
+        "--latency", str(args.llm_latency), "--tokens-per-sec", str(args.llm_tokens_per_sec),
+        "--error-rate", str(args.llm_error_rate), "--seed", str(args.seed),
+    ])
+    env = {
+        "AUTOMIX_REDIS_URL": args.redis_url,
+        "AUTOMIX_OPENAI_API_KEY": "stub",
+        "AUTOMIX_OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "AUTOMIX_SESSION_ROOT": str(work / "sessions"),
+    }
+    if not args.keep_strategy_cache:
+        env["AUTOMIX_STRATEGY_CACHE_ENABLED"] = "false"
+    api = urlparse(args.base_url)
+    stack.spawn("api", [
+        sys.executable, "-m", "uvicorn", "backend.app.main:asgi_app",
+        "--host", api.hostname or "127.0.0.1", "--port", str(api.port or 8000), "--log-level", "warning",
+    ], env)
+    celery = [sys.executable, "-m", "celery", "-A", "backend.app.celery_app", "worker", "-l", "warning"]
+    stack.spawn("ai_brain", [*celery, "-Q", "ai_brain", "-c", str(args.ai_brain_concurrency),
+                             "-n", "ai_brain@%h"], env)
+    for i in range(args.audio_workers):
+        stack.spawn(f"audio_worker_{i}", [
+            *celery, "-Q", "audio_interactive,audio_worker", "-O", "fair",
+            "-c", str(args.audio_concurrency), "-n", f"audio{i}@%h",
+        ], env)
+    return stack
+
+
+async def wait_healthy(client: Any, stack: Optional[Stack], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if stack is not None and (problem := stack.check()):
+            raise RuntimeError(problem)
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"La API no respondió /health en {timeout:.0f} s")
+
+
+# ---------------------------------------------------------------------------
+# Escenarios
+# ---------------------------------------------------------------------------
+
+class Recorder:
+    def __init__(self) -> None:
+        self.t0 = time.monotonic()
+        self.phases: dict[str, list[float]] = defaultdict(list)
+        self.jobs: dict[str, dict[str, Any]] = defaultdict(lambda: {"arrived": 0, "ok": 0, "failed": 0,
+                                                                    "last_done": 0.0})
+        self.errors: list[str] = []
+
+    def phase(self, name: str, seconds: float) -> None:
+        self.phases[name].append(seconds)
+
+    def done(self, scenario: str, ok: bool, error: str = "") -> None:
+        job = self.jobs[scenario]
+        job["ok" if ok else "failed"] += 1
+        job["last_done"] = time.monotonic() - self.t0
+        if error:
+            self.errors.append(f"{scenario}: {error}")
+
+
+class Timed:
+    def __init__(self, rec: Recorder, name: str):
+        self.rec, self.name = rec, name
+
+    def __enter__(self) -> "Timed":
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        if exc_type is None:
+            self.rec.phase(self.name, time.monotonic() - self.start)
+
+
+def _check(resp: Any, what: str) -> dict[str, Any]:
+    if resp.status_code >= 400:
+        raise RuntimeError(f"{what}: HTTP {resp.status_code} {resp.text[:200]}")
+    return resp.json()
+
+
+async def _download(client: Any, url: str) -> int:
+    size = 0
+    async with client.stream("GET", url) as resp:
+        if resp.status_code >= 400:
+            raise RuntimeError(f"GET {url}: HTTP {resp.status_code}")
+        async for chunk in resp.aiter_bytes():
+            size += len(chunk)
+    return size
+
+
+async def _poll(client: Any, url: str, rec: Recorder, args: argparse.Namespace,
+                phase_prefix: Optional[str] = None) -> dict[str, Any]:
+    """Poll hasta ready/failed; con phase_prefix registra el tiempo en cada phase reportada por el status."""
+    deadline = time.monotonic() + args.job_timeout
+    current: Optional[tuple[str, float]] = None
+    while time.monotonic() < deadline:
+        status = _check(await client.get(url), f"GET {url}")
+        now = time.monotonic()
+        phase = status.get("phase")
+        if phase_prefix and phase and (current is None or current[0] != phase):
+            if current is not None:
+                rec.phase(f"{phase_prefix}{current[0]}", now - current[1])
+            current = (phase, now)
+        if status.get("status") == "ready" or status.get("status") in FAILED_STATUSES:
+            if phase_prefix and current is not None and status.get("status") == "ready":
+                rec.phase(f"{phase_prefix}{current[0]}", now - current[1])
+            return status
+        await asyncio.sleep(args.poll_sec)
+    raise TimeoutError(f"{url}: sin terminar tras {args.job_timeout:.0f} s")
+
+
+async def generate_job(client: Any, rec: Recorder, args: argparse.Namespace, seed: int) -> None:
+    t0 = time.monotonic()
+    try:
+        a, b = await asyncio.to_thread(lambda: (track_bytes(seed, args.track_length, settings.default_sr),
+                                                track_bytes(seed + 1, args.track_length, settings.default_sr)))
+        with Timed(rec, "generate.session"):
+            sid = _check(await client.post("/session"), "POST /session")["session_id"]
+        for side, data in (("a", a), ("b", b)):
+            with Timed(rec, f"generate.upload_{side}"):
+                _check(await client.post(f"/upload/{sid}/{side}", files={"file": (f"{side}.wav", data, "audio/wav")}),
+                       f"POST /upload/{side}")
+        with Timed(rec, "generate.request"):  # análisis + decisión corren dentro del request
+            _check(await client.post(f"/generate/{sid}", json={}), "POST /generate")
+        with Timed(rec, "generate.render_wait"):
+            status = await _poll(client, f"/generate/{sid}/status", rec, args)
+        if status.get("status") != "ready":
+            raise RuntimeError(f"generate {status.get('status')}: {status.get('error')}")
+        with Timed(rec, "generate.download"):
+            await _download(client, f"/download/{sid}")
+        rec.phase("generate.total", time.monotonic() - t0)
+        rec.done("generate", True)
+    except Exception as e:
+        rec.done("generate", False, f"{type(e).__name__}: {str(e)[:200]}")
+
+
+async def set_job(client: Any, rec: Recorder, args: argparse.Namespace, seed: int, crate: int) -> None:
+    t0 = time.monotonic()
+    try:
+        tracks = await asyncio.to_thread(
+            lambda: [track_bytes(seed + i, args.track_length, settings.default_sr) for i in range(crate)])
+        files = [("files", (f"track_{i}.wav", data, "audio/wav")) for i, data in enumerate(tracks)]
+        with Timed(rec, "set.request"):
+            sid = _check(await client.post("/process-folder", files=files), "POST /process-folder")["session_id"]
+        with Timed(rec, "set.wait"):
+            status = await _poll(client, f"/process-folder/{sid}/status", rec, args, phase_prefix="set.phase_")
+        if status.get("status") != "ready":
+            raise RuntimeError(f"set {status.get('status')}: {status.get('error')}")
+        with Timed(rec, "set.download"):
+            await _download(client, f"/process-folder/{sid}/set")
+        rec.phase("set.total", time.monotonic() - t0)
+        rec.phase(f"set.total_per_track[{crate}]", (time.monotonic() - t0) / crate)
+        rec.done("set", True)
+    except Exception as e:
+        rec.done("set", False, f"{type(e).__name__}: {str(e)[:200]}")
+
+
+def arrivals(rate_per_min: float, duration: float, rng: random.Random) -> list[float]:
+    """Instantes de llegada Poisson en [0, duration)."""
+    times: list[float] = []
+    if rate_per_min <= 0:
+        return times
+    t = rng.expovariate(rate_per_min / 60.0)
+    while t < duration:
+        times.append(t)
+        t += rng.expovariate(rate_per_min / 60.0)
+    return times
+
+
+async def sample_backlog(rec: Recorder, interval: float, timeline: list[dict[str, Any]], stop: asyncio.Event) -> None:
+    from backend.app.metrics import queue_depths
+    from backend.app.redis_store import inflight_counts
+
+    while not stop.is_set():
+        depths, inflight = await asyncio.to_thread(lambda: (queue_depths(), inflight_counts()))
+        if depths is not None:
+            timeline.append({"t": round(time.monotonic() - rec.t0, 1), "queues": depths, "inflight": inflight or {}})
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    import httpx
+
+    rng = random.Random(args.seed)
+    rec = Recorder()
+    timeline: list[dict[str, Any]] = []
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.http_timeout, limits=limits) as client:
+        await wait_healthy(client, args.stack, args.startup_timeout)
+        rec.t0 = time.monotonic()
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_backlog(rec, args.sample_sec, timeline, stop))
+        plan = [(t, "generate") for t in arrivals(args.generate_rate, args.duration, rng)]
+        plan += [(t, "set") for t in arrivals(args.set_rate, args.duration, rng)]
+        plan.sort()
+        print(f"{sum(1 for _, k in plan if k == 'generate')} generate + {sum(1 for _, k in plan if k == 'set')} "
+              f"sets en {args.duration:.0f} s", flush=True)
+        jobs = []
+        for i, (at, kind) in enumerate(plan):
+            delay = at - (time.monotonic() - rec.t0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            rec.jobs[kind]["arrived"] += 1
+            seed = args.seed * 100_000 + i * 100
+            if kind == "generate":
+                jobs.append(asyncio.create_task(generate_job(client, rec, args, seed)))
+            else:
+                jobs.append(asyncio.create_task(set_job(client, rec, args, seed, rng.randint(*args.crate_size))))
+        await asyncio.gather(*jobs)
+        stop.set()
+        await sampler
+    return {"recorder": rec, "timeline": timeline}
+
+
+# ---------------------------------------------------------------------------
+# Reporte
+# ---------------------------------------------------------------------------
+
+def summarize(rec: Recorder, timeline: list[dict[str, Any]]) -> dict[str, Any]:
+    phases = {}
+    for name, values in sorted(rec.phases.items()):
+        arr = np.asarray(values)
+        phases[name] = {
+            "n": len(values),
+            "p50": round(float(np.percentile(arr, 50)), 3),
+            "p95": round(float(np.percentile(arr, 95)), 3),
+            "p99": round(float(np.percentile(arr, 99)), 3),
+            "max": round(float(arr.max()), 3),
+        }
+    scenarios = {}
+    for kind, job in rec.jobs.items():
+        makespan = job["last_done"] or 1e-9
+        scenarios[kind] = {**job, "throughput_per_min": round(job["ok"] / makespan * 60, 2)}
+    peak = {q: max((s["queues"].get(q, 0) for s in timeline), default=0)
+            for q in (timeline[0]["queues"] if timeline else {})}
+    return {"scenarios": scenarios, "phases": phases, "backlog_peak": peak, "backlog": timeline,
+            "errors": rec.errors}
+
+
+def print_report(summary: dict[str, Any], sample_sec: float) -> None:
+    print(f"\n{'escenario':<10} {'llegadas':>8} {'ok':>5} {'fallas':>6} {'jobs/min':>9}")
+    for kind, s in summary["scenarios"].items():
+        print(f"{kind:<10} {s['arrived']:>8} {s['ok']:>5} {s['failed']:>6} {s['throughput_per_min']:>9.2f}")
+    print(f"\n{'fase':<30} {'n':>5} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8}")
+    for name, p in summary["phases"].items():
+        print(f"{name[:30]:<30} {p['n']:>5} {p['p50']:>8.2f} {p['p95']:>8.2f} {p['p99']:>8.2f} {p['max']:>8.2f}")
+    timeline = summary["backlog"]
+    if timeline:
+        queues = list(timeline[0]["queues"])
+        step = max(1, len(timeline) // 30)  # ~30 filas
+        print(f"\nBacklog (cada {sample_sec * step:g} s): " + " ".join(f"{q:>17}" for q in queues)
+              + f" {'sets':>5} {'generate':>8}")
+        for s in timeline[::step]:
+            print(f"{s['t']:>8.0f} s" + " " * 11 + " ".join(f"{s['queues'].get(q, 0):>17}" for q in queues)
+                  + f" {s['inflight'].get('set', 0):>5} {s['inflight'].get('generate', 0):>8}")
+        print("Pico: " + ", ".join(f"{q}={n}" for q, n in summary["backlog_peak"].items()))
+    else:
+        print("\nSin backlog: Redis no disponible (--redis-url)")
+    if summary["errors"]:
+        print(f"\n{len(summary['errors'])} errores (primeros 10):")
+        for e in summary["errors"][:10]:
+            print(f"  {e}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga end-to-end (generate + process-folder)")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--redis-url", default=settings.redis_url or "redis://127.0.0.1:6379/0",
+                        help="Redis del stack (backlog de colas; con --start-stack, el que se usa/levanta)")
+    parser.add_argument("--duration", type=float, default=120.0, help="ventana de llegadas (s)")
+    parser.add_argument("--generate-rate", type=float, default=4.0, help="llegadas /generate por minuto")
+    parser.add_argument("--set-rate", type=float, default=1.0, help="llegadas /process-folder por minuto")
+    parser.add_argument("--crate-size", type=parse_range, default=(4, 4), help="tracks por set: N o MIN-MAX")
+    parser.add_argument("--track-length", type=float, default=90.0, help="largo de cada track sintético (s)")
+    parser.add_argument("--poll-sec", type=float, default=1.0)
+    parser.add_argument("--sample-sec", type=float, default=2.0, help="intervalo de muestreo del backlog")
+    parser.add_argument("--job-timeout", type=float, default=1800.0)
+    parser.add_argument("--http-timeout", type=float, default=600.0, help="por request (POST /generate analiza)")
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, default=None, help="escribir resumen y backlog en este archivo")
+    stack_opts = parser.add_argument_group("stack local (--start-stack)")
+    stack_opts.add_argument("--start-stack", action="store_true", help="levantar Redis, stub LLM, API y workers")
+    stack_opts.add_argument("--audio-workers", type=int, default=2, help="réplicas de audio worker")
+    stack_opts.add_argument("--audio-concurrency", type=int, default=2, help="-c de cada audio worker")
+    stack_opts.add_argument("--ai-brain-concurrency", type=int, default=2)
+    stack_opts.add_argument("--llm-latency", type=float, default=0.8, help="stub: segundos al primer token")
+    stack_opts.add_argument("--llm-tokens-per-sec", type=float, default=80.0)
+    stack_opts.add_argument("--llm-error-rate", type=float, default=0.0)
+    stack_opts.add_argument("--keep-strategy-cache", action="store_true",
+                            help="no desactivar el cache de estrategias (por defecto cada decisión llama al LLM)")
+    stack_opts.add_argument("--startup-timeout", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    # queue_depths / inflight_counts leen el Redis del stack bajo prueba
+    settings.redis_url = args.redis_url
+    args.stack = None
+    with tempfile.TemporaryDirectory(prefix="opus_load_") as tmp:
+        try:
+            if args.start_stack:
+                args.stack = start_stack(args, Path(tmp))
+                print(f"Stack local: {args.audio_workers} audio workers × {args.audio_concurrency}, "
+                      f"ai_brain × {args.ai_brain_concurrency}, LLM stub {args.llm_latency:g} s; logs en "
+                      f"{args.stack.logs}", flush=True)
+            result = asyncio.run(run(args))
+        except RuntimeError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        finally:
+            if args.stack is not None:
+                args.stack.stop()
+
+    summary = summarize(result["recorder"], result["timeline"])
+    summary["config"] = {k: v for k, v in vars(args).items() if k not in ("stack", "json")}
+    print_report(summary, args.sample_sec)
+    if args.json:
+        args.json.write_text(json.dumps(summary, indent=2, default=str), encoding="utf-8")
+    completed = sum(s["ok"] for s in summary["scenarios"].values())
+    return 0 if completed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Tracks sintéticos con ground truth conocido (para scripts/bench_*.py y load_test): click track (kick en cada beat,
+hi-hat en los contratiempos), pad de acordes en la tonalidad (I-IV-V-I en mayor, i-VI-iv-V en menor, un acorde por
+compás) y ruido blanco. Estructura en frases: secciones de phrase_bars compases que alternan nivel bajo (pad + kick
+suave) y alto (kick + hats + pad fuerte); las fronteras de sección son el ground truth de analyze_track_structure.
+"""
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+NOTES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+# (grado en semitonos desde la tónica, acorde menor?) por compás
+_PROGRESSION = {
+    "major": [(0, False), (5, False), (7, False), (0, False)],
+    "minor": [(0, True), (8, False), (5, True), (7, False)],
+}
+
+
+@dataclass
+class TrackSpec:
+    bpm: float
+    key: str  # nota (NOTES)
+    scale: str  # major | minor
+    duration_sec: float
+    noise: float = 0.0  # amplitud del ruido blanco (pico de la mezcla ~0.9)
+    phrase_bars: int = 16
+    seed: int = 0
+
+
+@dataclass
+class GroundTruth:
+    bpm: float
+    key: str
+    scale: str
+    duration_sec: float
+    beats: list[float] = field(default_factory=list)
+    section_bounds: list[float] = field(default_factory=list)  # fronteras internas (s)
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def _decay(n: int, sr: int, tau_sec: float) -> np.ndarray:
+    return np.exp(-np.arange(n) / (tau_sec * sr)).astype(np.float32)
+
+
+def _chord(root_midi: int, minor: bool, n: int, sr: int) -> np.ndarray:
+    """Tríada (más la fundamental una octava abajo) con 3 armónicos por nota."""
+    t = np.arange(n, dtype=np.float32) / sr
+    out = np.zeros(n, dtype=np.float32)
+    for interval in (0, 3 if minor else 4, 7, -12):
+        f0 = 440.0 * 2 ** ((root_midi + interval - 69) / 12)
+        for h, amp in ((1, 1.0), (2, 0.4), (3, 0.15)):
+            out += amp * np.sin(2 * np.pi * f0 * h * t, dtype=np.float32)
+    # ataque/release cortos: sin clicks entre compases
+    ramp = min(n // 2, int(0.02 * sr))
+    if ramp:
+        env = np.ones(n, dtype=np.float32)
+        env[:ramp] = np.linspace(0, 1, ramp)
+        env[-ramp:] = np.linspace(1, 0, ramp)
+        out *= env
+    return out / 4.0
+
+
+def synth_track(spec: TrackSpec, sr: int = 44100) -> tuple[np.ndarray, GroundTruth]:
+    """Audio mono float32 (pico ≤ 1) y su ground truth."""
+    rng = np.random.default_rng(spec.seed)
+    n = int(spec.duration_sec * sr)
+    y = np.zeros(n, dtype=np.float32)
+    beat_sec = 60.0 / spec.bpm
+    bar_sec = 4 * beat_sec
+    section_sec = spec.phrase_bars * bar_sec
+
+    # Kick: barrido 150→50 Hz + click de ruido (el transitorio que ve el onset detector, como en un kick real)
+    kick_n = int(0.12 * sr)
+    freq = 50.0 + 100.0 * _decay(kick_n, sr, 0.015)
+    kick = np.sin(2 * np.pi * np.cumsum(freq) / sr).astype(np.float32) * _decay(kick_n, sr, 0.05)
+    click_n = int(0.004 * sr)
+    kick[:click_n] += 0.6 * rng.standard_normal(click_n).astype(np.float32) * _decay(click_n, sr, 0.001)
+    hat_n = int(0.03 * sr)
+    hat = (rng.standard_normal(hat_n).astype(np.float32) * _decay(hat_n, sr, 0.006))
+
+    def high(t: float) -> bool:
+        return int(t // section_sec) % 2 == 1
+
+    beats = np.arange(0.0, spec.duration_sec, beat_sec)
+    for i, t in enumerate(beats):
+        s = int(t * sr)
+        level = 1.0 if high(t) else 0.45
+        seg = kick[: n - s] * (level * (1.15 if i % 4 == 0 else 1.0))
+        y[s:s + len(seg)] += seg
+        if high(t):
+            h = int((t + beat_sec / 2) * sr)
+            if h < n:
+                y[h:h + hat_n] += hat[: n - h] * 0.25
+
+    root = 48 + NOTES.index(spec.key)
+    progression = _PROGRESSION[spec.scale]
+    bar_n = int(bar_sec * sr)
+    for b, t in enumerate(np.arange(0.0, spec.duration_sec, bar_sec)):
+        s = int(t * sr)
+        if s >= n:
+            break
+        degree, minor = progression[b % len(progression)]
+        chord = _chord(root + degree, minor, min(bar_n, n - s), sr)
+        y[s:s + len(chord)] += chord * (0.35 if high(t) else 0.22)
+
+    if spec.noise > 0:
+        y += spec.noise * rng.standard_normal(n).astype(np.float32)
+    peak = float(np.max(np.abs(y))) or 1.0
+    y *= 0.9 / peak
+
+    bounds = np.arange(section_sec, spec.duration_sec - 1.0, section_sec)
+    truth = GroundTruth(
+        bpm=float(spec.bpm),
+        key=spec.key,
+        scale=spec.scale,
+        duration_sec=round(n / sr, 3),
+        beats=[round(float(b), 4) for b in beats],
+        section_bounds=[round(float(b), 3) for b in bounds],
+    )
+    return y, truth
+
+
+def write_track(path: Path, spec: TrackSpec, sr: int = 44100, stereo: bool = False) -> GroundTruth:
+    """Escribe el WAV (PCM 16) y devuelve el ground truth."""
+    import soundfile as sf
+
+    y, truth = synth_track(spec, sr)
+    data = np.stack([y, y], axis=1) if stereo else y
+    path.parent.mkdir(parents=True, exist_ok=True)
+    sf.write(str(path), data, sr, subtype="PCM_16")
+    return truth
+
+
+def default_specs(lengths: list[float], seed: int = 0, noise_levels: Optional[list[float]] = None) -> list[TrackSpec]:
+    """Una spec por (largo, nivel de ruido), rotando BPM, tónica y modo para cubrir el rango típico de un set."""
+    noise_levels = noise_levels if noise_levels is not None else [0.0, 0.02, 0.06]
+    bpms = [100.0, 124.0, 138.0, 90.0, 128.0, 174.0]
+    specs = []
+    i = 0
+    for length in lengths:
+        for noise in noise_levels:
+            specs.append(TrackSpec(
+                bpm=bpms[i % len(bpms)],
+                key=NOTES[(i * 5) % 12],
+                scale="minor" if i % 2 else "major",
+                duration_sec=float(length),
+                noise=noise,
+                seed=seed + i,
+            ))
+            i += 1
+    return specs
+
+
+def f_measure(estimated: list[float], truth: list[float], tolerance: float) -> float:
+    """F-measure de eventos (beats, fronteras): cada verdadero se empareja con a lo sumo un estimado a ±tolerance."""
+    if not truth and not estimated:
+        return 1.0
+    if not truth or not estimated:
+        return 0.0
+    est = sorted(estimated)
+    used = [False] * len(est)
+    hits = 0
+    for t in truth:
+        j = int(np.searchsorted(est, t - tolerance))
+        while j < len(est) and est[j] <= t + tolerance:
+            if not used[j]:
+                used[j] = True
+                hits += 1
+                break
+            j += 1
+    if hits == 0:
+        return 0.0
+    precision = hits / len(est)
+    recall = hits / len(truth)
+    return 2 * precision * recall / (precision + recall)
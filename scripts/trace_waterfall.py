@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Waterfall de una traza del exporter file (AUTOMIX_TRACING_EXPORTER=file): árbol de spans con offset, duración y una
+barra en la línea de tiempo; al final, tiempo por nombre de span (suma de duraciones: los renders en paralelo
+suman más que el total) para ver dónde se fue el tiempo de un set.
+
+Uso (desde la raíz del proyecto):
+  python scripts/trace_waterfall.py                       # última traza del archivo
+  python scripts/trace_waterfall.py --trace <trace_id>    # trace_id devuelto por POST /process-folder
+  python scripts/trace_waterfall.py --session <session_id> --file /app/data/.traces/spans.jsonl
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+_root = Path(__file__).resolve().parent.parent
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+
+BAR_WIDTH = 40
+
+
+def load_spans(path: Path) -> list[dict]:
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue  # línea cortada (proceso que murió escribiendo)
+    return spans
+
+
+def pick_trace(spans: list[dict], trace_id: str | None, session_id: str | None) -> str | None:
+    if trace_id:
+        return trace_id
+    if session_id:
+        for s in spans:
+            if (s.get("attrs") or {}).get("opus.session_id") == session_id:
+                return s["trace_id"]
+        return None
+    latest = max(spans, key=lambda s: s.get("start_ns") or 0, default=None)
+    return latest["trace_id"] if latest else None
+
+
+def print_waterfall(spans: list[dict], min_ms: float) -> None:
+    t0 = min(s["start_ns"] for s in spans)
+    t1 = max(s["end_ns"] for s in spans)
+    total = max(t1 - t0, 1)
+    ids = {s["span_id"] for s in spans}
+    children: dict[str | None, list[dict]] = defaultdict(list)
+    for s in spans:
+        # padre fuera del archivo (otro servicio con otro exporter) → raíz
+        children[s["parent_id"] if s["parent_id"] in ids else None].append(s)
+
+    print(f"{'offset s':>9} {'dur s':>9}  {'':<{BAR_WIDTH}}  span")
+
+    def walk(parent: str | None, depth: int) -> None:
+        for s in sorted(children.get(parent, []), key=lambda x: x["start_ns"]):
+            dur = s["end_ns"] - s["start_ns"]
+            if dur / 1e6 >= min_ms or children.get(s["span_id"]):
+                start = int((s["start_ns"] - t0) / total * BAR_WIDTH)
+                width = max(1, int(dur / total * BAR_WIDTH))
+                bar = (" " * start + ("!" if s.get("error") else "█") * width)[:BAR_WIDTH]
+                attrs = s.get("attrs") or {}
+                extra = " ".join(
+                    f"{k.split('.', 1)[-1]}={v}" for k, v in attrs.items()
+                    if k in ("opus.segment", "opus.track", "opus.source", "celery.queue", "opus.model")
+                )
+                print(
+                    f"{(s['start_ns'] - t0) / 1e9:>9.2f} {dur / 1e9:>9.2f}  {bar:<{BAR_WIDTH}}  "
+                    f"{'  ' * depth}{s['name']} [{s.get('service') or '?'}] {extra}".rstrip()
+                )
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+    print(f"\nTotal: {total / 1e9:.2f} s")
+    by_name: dict[str, list[float]] = defaultdict(list)
+    for s in spans:
+        by_name[s["name"]].append((s["end_ns"] - s["start_ns"]) / 1e9)
+    print(f"\n{'span':<28} {'n':>5} {'suma s':>9} {'max s':>8}")
+    for name, durs in sorted(by_name.items(), key=lambda kv: -sum(kv[1]))[:20]:
+        print(f"{name[:28]:<28} {len(durs):>5} {sum(durs):>9.2f} {max(durs):>8.2f}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    from backend.app.tracing import trace_file
+
+    parser = argparse.ArgumentParser(description="Waterfall de una traza (exporter file)")
+    parser.add_argument("--file", type=Path, default=None, help="JSON lines de spans (default: AUTOMIX_TRACING_FILE)")
+    parser.add_argument("--trace", default=None, help="trace_id")
+    parser.add_argument("--session", default=None, help="session_id (busca la traza que lo contiene)")
+    parser.add_argument("--min-ms", type=float, default=0.0, help="ocultar spans hoja más cortos que esto")
+    args = parser.parse_args(argv)
+
+    path = args.file or trace_file()
+    if not path.exists():
+        print(f"No existe {path}", file=sys.stderr)
+        return 1
+    spans = load_spans(path)
+    trace_id = pick_trace(spans, args.trace, args.session)
+    selected = [s for s in spans if s.get("trace_id") == trace_id and s.get("end_ns")]
+    if not selected:
+        print("Traza no encontrada", file=sys.stderr)
+        return 1
+    print(f"trace_id {trace_id} — {len(selected)} spans")
+    print_waterfall(selected, args.min_ms)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())